@@ -1,21 +1,69 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Body
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
 from motor.motor_asyncio import AsyncIOMotorClient
 from fastapi.templating import Jinja2Templates
-from bson import ObjectId
-from typing import List
+from bson import Binary, ObjectId
+from typing import List, Optional
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import base64
+import contextlib
+import csv
+import functools
+import io
+import itertools
+import json
 import ipaddress
-from utils import route_scan, router_connection_test, get_subnet_utilization, validate_ip, validate_prefix_length, get_break_subnet, encrypt_password, decrypt_password
+import os
+import tempfile
+from subnet_trie import SubnetTrie
+from prefix import Prefix
+from router_sessions import RouterSessionManager
+from router_pool import RouterPool
+from route_snapshot import RouteSnapshotCache, route_table_snapshot
+from router_transport import AsyncSSHTransport, async_route_scan, async_route_table_snapshot, async_router_connection_test, parse_router_transports
+from scan_scheduler import ScanScheduler
+from metrics import MetricsMiddleware, MongoCommandMetrics, OPERATION_SECONDS, SUBNET_SCANS, registry, timed
+from view_cache import ViewCache
+from subnet_import import IMPORT_FORMATS, load_import_rows
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from db_schema import backfill_covered_addresses, bootstrap_schema, ensure_scan_history, format_covered_addresses, get_network_fields, decode_address
+from utils import route_scan, router_connection_test, validate_ip, validate_prefix_length, get_break_subnet, get_break_preview, encrypt_password, check_secret_key
 
 # data structure used is tree for the subnets, each subnet can have many children. The link between the node and its parent is "subnet_parent".
 
 
-app = FastAPI()
-
-# MongoDB connection
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_secret_key()
+    await bootstrap_schema(collection, router_collection)
+    await ensure_scan_history(db, scan_history_collection.name, SCAN_HISTORY_RETENTION)
+    await load_subnet_index()
+    await backfill_covered_addresses(collection, subnet_index)
+    session_eviction_task = asyncio.create_task(evict_idle_router_sessions())
+    scan_scheduler.start()
+    break_scheduler.start()
+    yield
+    await break_scheduler.stop()
+    await scan_scheduler.stop()
+    session_eviction_task.cancel()
+    router_sessions.close_all()
+    async_transport.close_all()
+    scan_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+# MongoDB connection, its commands are counted and timed per request handler for /metrics
 MONGO_URI = "mongodb://localhost:27017"
-client = AsyncIOMotorClient(MONGO_URI)
+client = AsyncIOMotorClient(MONGO_URI, event_listeners=[MongoCommandMetrics()])
 
 
 db = client.network_db
@@ -26,6 +74,119 @@ collection = db.subnets
 # database for routers
 router_collection = db.routers
 
+# time series of the subnets scan results
+scan_history_collection = db.scan_history
+
+# Worker pool for the blocking router calls. SCAN_WORKERS is the pool size, and SCAN_ROUTER_CONCURRENCY
+# is the maximum number of calls running at the same time against a single router.
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "16"))
+SCAN_ROUTER_CONCURRENCY = int(os.getenv("SCAN_ROUTER_CONCURRENCY", "4"))
+scan_executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan")
+router_semaphores = {}
+
+# Authenticated router sessions are kept open and reused between scans, until idle for ROUTER_SESSION_IDLE_TIMEOUT seconds.
+ROUTER_SESSION_IDLE_TIMEOUT = int(os.getenv("ROUTER_SESSION_IDLE_TIMEOUT", "300"))
+ROUTER_SESSION_HEALTH_CHECK_INTERVAL = int(os.getenv("ROUTER_SESSION_HEALTH_CHECK_INTERVAL", "60"))
+router_sessions = RouterSessionManager(idle_timeout=ROUTER_SESSION_IDLE_TIMEOUT, health_check_interval=ROUTER_SESSION_HEALTH_CHECK_INTERVAL)
+
+# Router transport by vendor, "Vendor=asyncssh,..." runs the commands of these vendors on the event loop over SSH,
+# the other vendors use NAPALM. Commands time out after ROUTER_COMMAND_TIMEOUT seconds.
+# ROUTER_SSH_KNOWN_HOSTS is the known_hosts file checking the routers keys, not checked when empty (like NAPALM).
+ROUTER_TRANSPORTS = parse_router_transports(os.getenv("ROUTER_TRANSPORTS", ""))
+ROUTER_CONNECT_TIMEOUT = int(os.getenv("ROUTER_CONNECT_TIMEOUT", "10"))
+ROUTER_COMMAND_TIMEOUT = int(os.getenv("ROUTER_COMMAND_TIMEOUT", "60"))
+async_transport = AsyncSSHTransport(connect_timeout=ROUTER_CONNECT_TIMEOUT, command_timeout=ROUTER_COMMAND_TIMEOUT, idle_timeout=ROUTER_SESSION_IDLE_TIMEOUT,
+                                    known_hosts=os.getenv("ROUTER_SSH_KNOWN_HOSTS") or None)
+
+# Full routing table snapshots pulled by the snapshot scan are reused for ROUTE_SNAPSHOT_TTL seconds.
+ROUTE_SNAPSHOT_TTL = int(os.getenv("ROUTE_SNAPSHOT_TTL", "300"))
+route_snapshots = RouteSnapshotCache(ttl=ROUTE_SNAPSHOT_TTL)
+
+# Routers used by the scans, with their decrypted credentials, are read again from the database every ROUTER_CACHE_TTL seconds.
+# A router failing ROUTER_FAILURE_THRESHOLD calls in a row is skipped for ROUTER_RESET_TIMEOUT seconds.
+# Single scans in race mode query the first SCAN_RACE_ROUTERS routers at the same time.
+ROUTER_CACHE_TTL = int(os.getenv("ROUTER_CACHE_TTL", "60"))
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3"))
+ROUTER_RESET_TIMEOUT = int(os.getenv("ROUTER_RESET_TIMEOUT", "60"))
+SCAN_RACE_ROUTERS = int(os.getenv("SCAN_RACE_ROUTERS", "2"))
+# Decrypted router passwords are kept in memory for ROUTER_PASSWORD_TTL seconds.
+ROUTER_PASSWORD_TTL = int(os.getenv("ROUTER_PASSWORD_TTL", "3600"))
+router_pool = RouterPool(ttl=ROUTER_CACHE_TTL, failure_threshold=ROUTER_FAILURE_THRESHOLD, reset_timeout=ROUTER_RESET_TIMEOUT, password_ttl=ROUTER_PASSWORD_TTL)
+
+SCAN_WRITE_BATCH_SIZE = 1000
+
+# Scan history records are deleted after SCAN_HISTORY_RETENTION seconds.
+SCAN_HISTORY_RETENTION = int(os.getenv("SCAN_HISTORY_RETENTION", str(90 * 24 * 3600)))
+BREAK_WRITE_BATCH_SIZE = 1000
+BREAK_PREVIEW_SIZE = 5
+
+# Breaks creating more than BREAK_SYNC_CHILDREN subnets run as a background job, more than BREAK_MAX_CHILDREN are refused.
+BREAK_SYNC_CHILDREN = int(os.getenv("BREAK_SYNC_CHILDREN", "4096"))
+BREAK_MAX_CHILDREN = int(os.getenv("BREAK_MAX_CHILDREN", str(1 << 20)))
+
+
+async def get_router_pool():
+    if router_pool.stale():
+        # Decryption of new or changed passwords runs off the event loop
+        routers = await router_collection.find().to_list()
+        await asyncio.to_thread(router_pool.load, routers)
+
+    # Routers left out of the pool (password can't be decrypted) still count as configured
+    if not router_pool.sources and not router_pool.errors:
+        raise HTTPException(status_code=404, detail="Router not found. Please add Router first")
+    return router_pool
+
+
+async def evict_idle_router_sessions():
+    while True:
+        await asyncio.sleep(ROUTER_SESSION_IDLE_TIMEOUT / 2)
+        await asyncio.get_running_loop().run_in_executor(scan_executor, router_sessions.evict_idle)
+        async_transport.evict_idle()
+
+# In-memory prefix trie over all subnets. Loaded from the database at startup and kept in sync on every write.
+subnet_index = SubnetTrie()
+
+
+@timed(OPERATION_SECONDS, operation="load_subnet_index")
+async def load_subnet_index():
+    subnet_index.clear()
+    async for subnet in collection.find({}, {"subnet_prefix": 1, "subnet_root": 1}):
+        subnet_index.insert(subnet['subnet_prefix'], subnet['subnet_root'])
+
+
+# Rendered home and subnet detail views, HTML and JSON, are cached for VIEW_CACHE_TTL seconds (0 disables the cache),
+# up to VIEW_CACHE_SIZE views. Every write drops the views of the subnets it changed.
+VIEW_CACHE_TTL = int(os.getenv("VIEW_CACHE_TTL", "30"))
+VIEW_CACHE_SIZE = int(os.getenv("VIEW_CACHE_SIZE", "1024"))
+view_cache = ViewCache(ttl=VIEW_CACHE_TTL, max_entries=VIEW_CACHE_SIZE)
+
+
+# Drop the cached views showing the given subnets: their own pages, the pages of their upper subnets, and the home page
+def invalidate_views(subnet_prefixes):
+    prefixes = {""}
+    for subnet_prefix in subnet_prefixes:
+        if subnet_prefix:
+            prefixes.add(subnet_prefix)
+            prefixes.update(subnet_index.matches(subnet_prefix))
+    view_cache.invalidate(prefixes)
+
+
+# Return the cached view of the request, or render it with render() and cache it under the subnet prefix.
+# The ETag lets the browsers revalidate their copy and get a 304 while the view is unchanged.
+async def cached_view(request, subnet_prefix, render):
+    key = (request.url.path, str(request.query_params))
+    entry = view_cache.get(key)
+    if entry is None:
+        version = view_cache.version
+        response = await render()
+        entry = view_cache.set(key, subnet_prefix, response.body, response.media_type, version)
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match == "*" or entry.etag in [etag.strip() for etag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type=entry.media_type, headers=headers)
+
 
 # Serve static files from "static" folder
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -57,12 +218,111 @@ class Router(BaseModel):
     router_vendor: str = Field(...)
 
 
+# Fields needed to list subnets, the other fields are not fetched from the database
+SUBNET_LIST_PROJECTION = {"subnet_prefix": 1, "subnet_id": 1, "subnet_mask": 1, "subnet_root": 1, "subnet_parent": 1, "subnet_name": 1, "subnet_service": 1,
+                          "subnet_description": 1, "offline_utilization": 1, "online_status": 1, "online_utilization": 1, "net_version": 1,
+                          "net_start": 1, "net_end": 1}
+
+# Sort keys accepted by the subnet lists. The address family, the network address and the last address are always the
+# last sort keys, "address" sorts on them alone. The last address goes the other way, so a subnet comes before the
+# subnets inside it starting at the same address, and the three keys together are unique to a subnet.
+SUBNET_SORT_FIELDS = {"address": None, "name": "subnet_name", "service": "subnet_service", "utilization": "offline_utilization",
+                      "online_status": "online_status", "online_utilization": "online_utilization"}
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+# IPv6 network addresses are binary values, kept in the cursor as {"ipv6": hex}
+def encode_page_cursor(values):
+    values = [{"ipv6": value.hex()} if isinstance(value, bytes) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_page_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if isinstance(values, list):
+            values = [Binary(bytes.fromhex(value["ipv6"])) if isinstance(value, dict) else value for value in values]
+    except (ValueError, KeyError, TypeError):
+        values = None
+
+    if not isinstance(values, list) or not values:
+        raise HTTPException(status_code=400, detail="Invalid page cursor")
+    return values
+
+
+# Make a subnet document JSON serializable
+def serialize_subnet(subnet):
+    subnet["_id"] = str(subnet["_id"])  # Convert ObjectId to String
+    for field in ("net_start", "net_end"):
+        if field in subnet:
+            subnet[field] = decode_address(subnet[field])
+    return subnet
+
+
+# Get one page of the subnets matching query. Pagination is keyset based: the cursor holds the sort values of the last
+# subnet of the previous page, so every page costs the same whatever its position.
+@timed(OPERATION_SECONDS, operation="get_subnets_page")
+async def get_subnets_page(query, sort="address", order="asc", after=None, limit=DEFAULT_PAGE_SIZE):
+    if sort not in SUBNET_SORT_FIELDS or order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Invalid sort")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    sort_field = SUBNET_SORT_FIELDS[sort]
+    direction = ASCENDING if order == "asc" else DESCENDING
+    sort_keys = [(field, direction) for field in (sort_field, "net_version", "net_start") if field] + [("net_end", -direction)]
+
+    if after:
+        values = decode_page_cursor(after)
+        if len(values) != len(sort_keys):
+            raise HTTPException(status_code=400, detail="Invalid page cursor")
+        # Subnets after the cursor: the first sort key differing from the cursor is past its value
+        clauses = []
+        for index, (field, field_direction) in enumerate(sort_keys):
+            clause = {previous: value for (previous, _), value in zip(sort_keys[:index], values)}
+            clause[field] = {"$gt" if field_direction == ASCENDING else "$lt": values[index]}
+            clauses.append(clause)
+        query = {"$and": [query, {"$or": clauses}]}
+
+    subnets = await collection.find(query, SUBNET_LIST_PROJECTION, sort=sort_keys, limit=limit + 1).to_list()
+
+    next_cursor = None
+    if len(subnets) > limit:
+        subnets = subnets[:limit]
+        last = subnets[-1]
+        next_cursor = encode_page_cursor([last.get(field) for field, _ in sort_keys])
+
+    for subnet in subnets:
+        serialize_subnet(subnet)
+
+    return subnets, next_cursor
+
+
+def get_page_context(sort, order, after, limit, next_cursor):
+    return {"sort": sort, "order": order, "after": after, "limit": limit, "next_cursor": next_cursor}
+
+
+# Major subnets are the subnets without parent
+MAJOR_SUBNETS_QUERY = {"subnet_parent": {"$in": ["", None]}}
+
+
 # Home Page
 @app.get("/")
-async def serve_index(request: Request):
-    subnets = await collection.find().to_list()
-    major_subnets = [subnet for subnet in subnets if subnet['subnet_prefix'] == subnet['subnet_root']]
-    return templates.TemplateResponse("index.html", {"request": request, "subnets": major_subnets})
+async def serve_index(request: Request, sort: str = "address", order: str = "asc", after: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    async def render():
+        major_subnets, next_cursor = await get_subnets_page(MAJOR_SUBNETS_QUERY, sort, order, after, limit)
+        return templates.TemplateResponse("index.html", {"request": request, "subnets": major_subnets, **get_page_context(sort, order, after, limit, next_cursor)})
+    return await cached_view(request, "", render)
+
+
+# Major subnets list API
+@app.get("/api/subnets")
+async def list_major_subnets(request: Request, sort: str = "address", order: str = "asc", after: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    async def render():
+        major_subnets, next_cursor = await get_subnets_page(MAJOR_SUBNETS_QUERY, sort, order, after, limit)
+        return JSONResponse(jsonable_encoder({"subnets": major_subnets, "next": next_cursor}))
+    return await cached_view(request, "", render)
 
 
 
@@ -81,7 +341,7 @@ async def help(request: Request):
 # List all Routers
 @app.get("/routers")
 async def list_routers(request: Request):
-    routers = await router_collection.find().to_list(length=2)
+    routers = await router_collection.find().to_list()
 
     for router in routers:
         router["_id"] = str(router["_id"])  # Convert Router ObjectId to String
@@ -108,14 +368,15 @@ async def add_router(router: Router):
     if existing_router:
         raise HTTPException(status_code=400, detail="Router already exists")
 
-    # Limit is two routers. One is main and other is backup
-    all_existing_routers =  await router_collection.find().to_list()
-    if len(all_existing_routers) == 2:
-        raise HTTPException(status_code=400, detail="Limit exceeded, there are already two Routers.")
-
+    # Any number of routers can be added. The scans try them in the order they were added, and spread bulk scans over them.
     router_dict = router.model_dump()
     router_dict['router_password'] = encrypt_password(router_dict['router_password'])
-    await router_collection.insert_one(router_dict)
+    try:
+        await router_collection.insert_one(router_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Router already exists")
+
+    router_pool.invalidate()
     return {"message": "Router added successfully"}
 
 
@@ -131,6 +392,12 @@ async def update_router(router_id: str, updateData: dict):
     updateData['router_password'] = encrypt_password(updateData['router_password'])
 
     await router_collection.update_one({"_id": router["_id"]},{"$set": updateData})
+
+    # Sessions opened with the old credentials are not reused
+    await asyncio.get_running_loop().run_in_executor(scan_executor, router_sessions.close, router_id)
+    async_transport.close(router_id)
+    route_snapshots.invalidate(router_id)
+    router_pool.invalidate(router_id)
     return {"success": True}
 
 
@@ -144,6 +411,11 @@ async def delete_router(router_id: str):
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Router not found")
 
+    await asyncio.get_running_loop().run_in_executor(scan_executor, router_sessions.close, router_id)
+    async_transport.close(router_id)
+    route_snapshots.invalidate(router_id)
+    router_pool.invalidate(router_id)
+
     return {"message": f"Router Deleted Successfully"}
 
 
@@ -151,14 +423,16 @@ async def delete_router(router_id: str):
 # Test Router Connection
 @app.get("/routers/testconnection/{router_id}")
 async def testConnection(router_id: str):
-    object_id = ObjectId(router_id)   # Convert String to ObjectId
-    router = await router_collection.find_one({"_id": object_id})
-    router['router_password'] = decrypt_password(router['router_password'])
-
-    device_info = {"hostname": router['router_ip'], "username": router['router_username'], "password": router['router_password'] }
+    # The router and its decrypted password come from the router pool
+    pool = await get_router_pool()
+    source = pool.get(router_id)
+    if not source and router_id in pool.errors:
+        raise HTTPException(status_code=400, detail=pool.errors[router_id])
+    if not source:
+        raise HTTPException(status_code=404, detail="Router not found")
 
     # Test if SSH to router is successful using the input username and password
-    result = router_connection_test(router['router_vendor'], **device_info)
+    result = await run_router_call(source.router, router_connection_test, source.router_vendor, async_function=async_router_connection_test, **source.device_info)
 
     if result:
         return {"message": "Test Connection success"}
@@ -175,120 +449,271 @@ async def add_subnet_page(request: Request):
 
 
 
-# Subnet Detail Page
-@app.get("/subnets/{subnet_id}-{subnet_mask}")
-async def get_subnet_detail(request: Request, subnet_id: str, subnet_mask: str):
+async def get_subnet_with_children(subnet_id, subnet_mask, sort, order, after, limit):
     main_subnet_prefix = f"{subnet_id}/{subnet_mask}"
-    main_subnet = await collection.find_one({"subnet_prefix": main_subnet_prefix })
+    main_subnet = await collection.find_one({"subnet_prefix": main_subnet_prefix }, SUBNET_LIST_PROJECTION)
 
     if not main_subnet:
         raise HTTPException(status_code=404, detail="Subnet not found")
+    serialize_subnet(main_subnet)
+
+    # Get one page of the active children subnets under the selected main subnet
+    subnets, next_cursor = await get_subnets_page({"subnet_parent": main_subnet_prefix}, sort, order, after, limit)
+    return main_subnet, subnets, next_cursor
 
-    # Get all active children subnets under the selected main subnet
-    all_subnets = await collection.find({"subnet_parent":main_subnet_prefix}).to_list()
 
-    for subnet in all_subnets:
-        subnet["_id"] = str(subnet["_id"])  # Convert ObjectId to String
-    return templates.TemplateResponse("subnet_detail.html", {"request": request, "subnet": main_subnet, "subnets": all_subnets})
+# Subnet Detail Page
+@app.get("/subnets/{subnet_id}-{subnet_mask}")
+async def get_subnet_detail(request: Request, subnet_id: str, subnet_mask: str, sort: str = "address", order: str = "asc", after: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    async def render():
+        main_subnet, all_subnets, next_cursor = await get_subnet_with_children(subnet_id, subnet_mask, sort, order, after, limit)
+        return templates.TemplateResponse("subnet_detail.html", {"request": request, "subnet": main_subnet, "subnets": all_subnets, **get_page_context(sort, order, after, limit, next_cursor)})
+    return await cached_view(request, f"{subnet_id}/{subnet_mask}", render)
+
+
+# Search API
+#   exact:    the subnet equal to q
+#   contains: the allocated subnets containing the IP address or prefix q, from the most to the least specific
+#   within:   the subnets inside the range q, paginated by network address
+#   free:     the first free blocks of length prefixlen under the subnet q
+SEARCH_MODES = ("exact", "contains", "within", "free")
+
+
+@app.get("/api/search")
+async def search_subnets(q: str, mode: str = "exact", prefixlen: int = None, after: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail="Invalid search mode")
+
+    try:
+        search_network = Prefix.parse(q)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Wrong search query!")
+    search_prefix = str(search_network)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if mode == "exact":
+        prefixes = [search_prefix] if search_prefix in subnet_index else []
+        return {"mode": mode, "query": search_prefix, "results": await get_subnets_by_prefix(prefixes), "next": None}
+
+    if mode == "contains":
+        prefixes = subnet_index.matches(search_prefix)[::-1]
+        return {"mode": mode, "query": search_prefix, "results": await get_subnets_by_prefix(prefixes), "next": None}
+
+    if mode == "within":
+        network_fields = get_network_fields(search_prefix)
+        query = {"net_version": network_fields['net_version'], "net_start": {"$gte": network_fields['net_start']}, "net_end": {"$lte": network_fields['net_end']}}
+        subnets, next_cursor = await get_subnets_page(query, "address", "asc", after, limit)
+        return {"mode": mode, "query": search_prefix, "results": subnets, "next": next_cursor}
+
+    if search_prefix not in subnet_index:
+        raise HTTPException(status_code=404, detail="Subnet not found")
+    if prefixlen is None or not search_network.prefixlen < prefixlen <= search_network.max_prefixlen:
+        raise HTTPException(status_code=400, detail=f"Wrong subnet Mask, Please input mask in range (0 to {search_network.max_prefixlen}) !")
 
+    free_blocks = list(itertools.islice(subnet_index.free_blocks(search_prefix, prefixlen), limit))
+    return {"mode": mode, "query": search_prefix, "results": [{"subnet_prefix": block} for block in free_blocks], "next": None}
 
 
-# Add a new Major subnet
-@app.post("/subnets/")
-async def add_major_subnet(subnet: Subnet):
-    # Check if the new added subnet already exist
-    existing_subnet = await collection.find_one({"subnet_prefix": subnet.subnet_prefix})
+# Get the subnets of the given prefixes, in the same order
+async def get_subnets_by_prefix(prefixes):
+    if not prefixes:
+        return []
 
-    if existing_subnet:
-        raise HTTPException(status_code=400, detail="Major Subnet already exists")
+    subnets = await collection.find({"subnet_prefix": {"$in": prefixes}}, SUBNET_LIST_PROJECTION).to_list()
+    for subnet in subnets:
+        serialize_subnet(subnet)
 
-    subnet_dict = subnet.model_dump()
+    order = {prefix: i for i, prefix in enumerate(prefixes)}
+    return sorted(subnets, key=lambda subnet: order.get(subnet['subnet_prefix'], len(order)))
 
-    await collection.insert_one(subnet_dict)
-    return {"message": "Subnet added successfully"}
 
+# Subnet detail API
+@app.get("/api/subnets/{subnet_id}-{subnet_mask}")
+async def get_subnet_detail_api(request: Request, subnet_id: str, subnet_mask: str, sort: str = "address", order: str = "asc", after: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    async def render():
+        main_subnet, subnets, next_cursor = await get_subnet_with_children(subnet_id, subnet_mask, sort, order, after, limit)
+        return JSONResponse(jsonable_encoder({"subnet": main_subnet, "subnets": subnets, "next": next_cursor}))
+    return await cached_view(request, f"{subnet_id}/{subnet_mask}", render)
 
 
-# Delete one or multiple subnets by ObjectId
-@app.delete("/subnets/")
-async def delete_subnets(ids: List[str]):
+# Hit and miss counters of the view cache
+@app.get("/api/cache")
+async def get_view_cache_stats():
+    return view_cache.stats()
 
-    # Delete the subnet only if it has no child subnets
-    for id in ids:
-        object_id = ObjectId(id)
-        subnet = await collection.find_one({"_id": object_id})
-        subnet_prefix = subnet['subnet_prefix']
-        child_subnets = await collection.find({"subnet_parent":subnet_prefix}).to_list()
 
-        if child_subnets:
-            ids.remove(id)
-            raise HTTPException(status_code=400, detail="The subnet contains active smaller subnet(s). Cant' be deleted!")
+# State of the caches, jobs and routers, read when /metrics is rendered
+def count_jobs():
+    counts = {}
+    for kind, scheduler in (("scan", scan_scheduler), ("break", break_scheduler)):
+        for job in scheduler.jobs.values():
+            counts[(kind, job.status)] = counts.get((kind, job.status), 0) + 1
+    return counts
 
-    if ids:
-        object_ids = [ObjectId(id) for id in ids]  # Convert String to ObjectId
 
+def count_router_breakers():
+    counts = {}
+    for breaker in router_pool.breakers.values():
+        counts[(breaker.state,)] = counts.get((breaker.state,), 0) + 1
+    return counts
 
-        # Gather Parent subnet IDs, to update their utilization later.
-        upper_subnet_prefixes = []
 
-        for object_id in object_ids:
-            subnet = await collection.find_one({"_id": object_id})
-            upper_subnet_prefix = subnet['subnet_parent']
-            if (upper_subnet_prefix not in upper_subnet_prefixes) and upper_subnet_prefix != "":
-                upper_subnet_prefixes.append(upper_subnet_prefix)
+registry.callback("ipam_view_cache_entries", "Views in the view cache.", (), lambda: {(): len(view_cache.entries)})
+registry.callback("ipam_view_cache_requests_total", "View cache lookups by result.", ("result",),
+                  lambda: {("hit",): view_cache.hits, ("miss",): view_cache.misses}, type="counter")
+registry.callback("ipam_subnet_index_size", "Subnets in the in-memory subnet index.", (), lambda: {(): len(subnet_index)})
+registry.callback("ipam_jobs", "Scan and break jobs kept for polling, by kind and status.", ("kind", "status"), count_jobs)
+registry.callback("ipam_router_breakers", "Router circuit breakers by state.", ("state",), count_router_breakers)
+registry.callback("ipam_router_ssh_connections", "Open connections of the async SSH router transport.", (), lambda: {(): len(async_transport.connections)})
 
-        result = await collection.delete_many({"_id": {"$in": object_ids}})
 
+# Prometheus metrics: request latency per route, MongoDB commands per handler, router timings, scan outcomes,
+# operation timings, and the state of the caches, jobs and routers
+@app.get("/metrics")
+async def get_metrics():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
 
-        # Update utilization for parent subnets
-        for upper_subnet_prefix in upper_subnet_prefixes:
-            all_upper_children = await collection.find({"subnet_parent": upper_subnet_prefix}).to_list()
-            all_upper_children_subnets = []
-            for child in all_upper_children:
-                all_upper_children_subnets.append(child['subnet_prefix'])
 
-            utilization = get_subnet_utilization(upper_subnet_prefix,all_upper_children_subnets)
-            await collection.update_one({"subnet_prefix": upper_subnet_prefix},{"$set": {"offline_utilization": utilization}})
 
+# Add a new Major subnet. The prefix is stored normalized (host bits cleared), as the index keeps it, and must not
+# overlap an existing subnet: a major subnet is the root of its own tree.
+@app.post("/subnets/")
+async def add_major_subnet(subnet: Subnet):
+    try:
+        prefix = Prefix.parse(subnet.subnet_prefix)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Wrong subnet prefix!")
+    subnet_prefix = str(prefix)
 
-        return {"message": f"Deleted {result.deleted_count} subnets"}
+    # Check if the new added subnet already exist
+    existing_subnet = await collection.find_one({"subnet_prefix": subnet_prefix})
 
+    if existing_subnet:
+        raise HTTPException(status_code=400, detail="Major Subnet already exists")
 
+    async with get_subnet_lock(subnet_prefix):
+        # Checked and reserved in the index without awaiting, so two overlapping major subnets can't both pass
+        if subnet_prefix in subnet_index:
+            raise HTTPException(status_code=400, detail="Major Subnet already exists")
+        if subnet_index.longest_match(subnet_prefix) or subnet_index.children(subnet_prefix):
+            raise HTTPException(status_code=400, detail="Overlaps existing major subnets")
+        subnet_index.insert(subnet_prefix, subnet_prefix)
+
+        subnet_dict = subnet.model_dump()
+        subnet_dict.update({"subnet_prefix": subnet_prefix, "subnet_id": prefix.network_address, "subnet_mask": str(prefix.prefixlen),
+                            "subnet_root": subnet_prefix, "subnet_parent": ""})
+        subnet_dict.update(get_network_fields(subnet_prefix))
+
+        try:
+            await collection.insert_one(subnet_dict)
+        except DuplicateKeyError:
+            subnet_index.remove(subnet_prefix)
+            raise HTTPException(status_code=400, detail="Major Subnet already exists")
+        except BaseException:
+            subnet_index.remove(subnet_prefix)
+            raise
+
+    invalidate_views([subnet_prefix])
+    return {"message": "Subnet added successfully"}
 
 
-# Delete one or multiple subnets by ObjectId
+
+# Delete multiple subnets by ObjectId. The subnets are read in one query, their children outside the deleted subnets
+# are counted in one aggregation, the deletable subnets are deleted with one delete_many, and the utilization of their
+# upper subnets is written in one batched update. The outcome of every id is returned.
+@app.delete("/subnets/")
+async def delete_subnets(ids: List[str]):
+    # Results keyed by the normalized id (ObjectId takes upper case hex), as found back from the subnets
+    results = {}
+    for id in ids:
+        key = str(ObjectId(id)) if ObjectId.is_valid(id) else id
+        if key not in results:
+            results[key] = {"id": id, "subnet_prefix": None, "deleted": False,
+                            "message": "Subnet not found" if ObjectId.is_valid(id) else "Invalid subnet id"}
+
+    object_ids = [ObjectId(id) for id in results if ObjectId.is_valid(id)]
+    subnets = await collection.find({"_id": {"$in": object_ids}}, {"subnet_prefix": 1}).to_list()
+
+    roots = {subnet_index.get(subnet['subnet_prefix']) for subnet in subnets} - {None}
+    async with contextlib.AsyncExitStack() as stack:
+        # The locks are taken in the same order by every delete, and the other writes take one lock only
+        for root_subnet in sorted(roots):
+            await stack.enter_async_context(get_subnet_lock(root_subnet))
+
+        # Read again holding the locks: the subnets deleted or moved by another request while the locks were awaited
+        # are found as they are now, and the subnets deleted meanwhile are no longer in the index
+        subnets = await collection.find({"_id": {"$in": object_ids}}, {"subnet_prefix": 1, "subnet_parent": 1}).to_list()
+        subnets = {subnet['subnet_prefix']: subnet for subnet in subnets if subnet_index.get(subnet['subnet_prefix']) in roots}
+
+        # Subnets with children that are not deleted with them are kept
+        pipeline = [
+            {"$match": {"subnet_parent": {"$in": list(subnets)}, "subnet_prefix": {"$nin": list(subnets)}}},
+            {"$group": {"_id": "$subnet_parent"}},
+        ]
+        kept = [group["_id"] async for group in collection.aggregate(pipeline)]
+
+        # ... and so are their upper subnets in the deleted subnets
+        while kept:
+            subnet_prefix = kept.pop()
+            subnet = subnets.pop(subnet_prefix, None)
+            if subnet is None:
+                continue
+            result = results[str(subnet["_id"])]
+            result["subnet_prefix"] = subnet_prefix
+            result["message"] = "The subnet contains active smaller subnet(s). Cant' be deleted!"
+            kept.append(subnet.get("subnet_parent"))
+
+        deleted_count = 0
+        if subnets:
+            delete_result = await collection.delete_many({"_id": {"$in": [subnet["_id"] for subnet in subnets.values()]}})
+            deleted_count = delete_result.deleted_count
+
+            for subnet_prefix, subnet in subnets.items():
+                subnet_index.remove(subnet_prefix)
+                results[str(subnet["_id"])].update({"subnet_prefix": subnet_prefix, "deleted": True, "message": "Subnet Deleted"})
+            invalidate_views(subnets)
+
+            # Update utilization for the upper subnets still existing
+            await update_subnets_utilization(subnet.get("subnet_parent") for subnet in subnets.values())
+
+    results = list(results.values())
+    not_deleted = sum(not result["deleted"] for result in results)
+    message = f"Deleted {deleted_count} subnets" + (f", {not_deleted} not deleted" if not_deleted else "")
+    return {"message": message, "results": results}
+
+
+
+
+# Delete one subnet by ObjectId, holding the lock of its root subnet like the other tree writes
 @app.delete("/subnet/{id}")
 async def delete_subnet(id: str):
-
-    # Delete the subnet only if it has no child subnets
     object_id = ObjectId(id)
     subnet = await collection.find_one({"_id": object_id})
     if not subnet:
         raise HTTPException(status_code=404, detail="Subnet not found")
 
     subnet_prefix = subnet['subnet_prefix']
-    child_subnets = await collection.find({"subnet_parent":subnet_prefix}).to_list()
-
-    if child_subnets:
-        raise HTTPException(status_code=400, detail="The subnet contains active smaller subnet(s). Cant' be deleted!")
-
-
-    # Gather Parent subnet IDs, to update their utilization later.
-
-    subnet = await collection.find_one({"_id": object_id})
-    upper_subnet_prefix = subnet['subnet_parent']
-    await collection.delete_many({"_id": {"$in": object_id}})
+    root_subnet = subnet_index.get(subnet_prefix)
+    if root_subnet is None:
+        raise HTTPException(status_code=404, detail="Subnet not found")
 
-    if upper_subnet_prefix != "":
+    async with get_subnet_lock(root_subnet):
+        # Deleted by another request while the lock was awaited
+        if subnet_prefix not in subnet_index:
+            raise HTTPException(status_code=404, detail="Subnet not found")
 
-        all_upper_children = await collection.find({"subnet_parent": upper_subnet_prefix}).to_list()
-        all_upper_children_subnets = []
-        for child in all_upper_children:
-            all_upper_children_subnets.append(child['subnet_prefix'])
+        # Delete the subnet only if it has no child subnets
+        if subnet_index.children(subnet_prefix):
+            raise HTTPException(status_code=400, detail="The subnet contains active smaller subnet(s). Cant' be deleted!")
 
-        utilization = get_subnet_utilization(upper_subnet_prefix,all_upper_children_subnets)
-        await collection.update_one({"subnet_prefix": upper_subnet_prefix},{"$set": {"offline_utilization": utilization}})
+        # Parent subnet, to update its utilization later. Taken from the index holding the lock, a subnet may have been
+        # inserted between the subnet and its stored parent while the lock was awaited.
+        upper_subnet_prefix = subnet_index.longest_match(subnet_prefix, strict=True)
+        await collection.delete_one({"_id": object_id})
+        subnet_index.remove(subnet_prefix)
+        invalidate_views([subnet_prefix])
 
+        await update_subnets_utilization([upper_subnet_prefix])
 
     return {"message": f"Subnet Deleted"}
 
@@ -305,12 +730,103 @@ async def update_subnet(id: str, updateData: dict):
         raise HTTPException(status_code=404, detail="Subnet not found")
 
     await collection.update_one({"_id": existing_subnet["_id"]},{"$set": updateData})
+    invalidate_views([existing_subnet.get("subnet_prefix")])
 
     return {"success": True}
 
 
 
+# Run a blocking router call (NAPALM) on the scan worker pool, so the event loop keeps serving other requests.
+# For the vendors using the async transport, async_function runs on the event loop instead.
+# The number of calls running at the same time against one router is limited by its own semaphore,
+# and the call reuses the router's pooled sessions.
+async def run_router_call(router, function, *args, async_function=None, **device_info):
+    router_id = str(router.get("_id", router['router_ip']))
+    if router_id not in router_semaphores:
+        router_semaphores[router_id] = asyncio.Semaphore(SCAN_ROUTER_CONCURRENCY)
+
+    async with router_semaphores[router_id]:
+        if async_function is not None and ROUTER_TRANSPORTS.get(router['router_vendor']) == "asyncssh":
+            return await async_function(*args, transport=async_transport, router_id=router_id, **device_info)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(scan_executor, functools.partial(function, *args, sessions=router_sessions, router_id=router_id, **device_info))
+
+
+
+# Scan a subnet prefix on one router, and keep its circuit breaker up to date.
+# The breaker must have been acquired by the caller.
+async def scan_on_route_source(source, subnet_prefix):
+    try:
+        scan_result = await run_router_call(source.router, route_scan, subnet_prefix, source.router_vendor, async_function=async_route_scan, **source.device_info)
+    except asyncio.CancelledError:
+        source.breaker.release()
+        raise
+
+    if scan_result['status']:
+        source.breaker.record_success()
+    else:
+        source.breaker.record_failure()
+    return scan_result
+
+
+# Scan a subnet prefix on the routers one after the other, until one of them answers.
+async def scan_with_failover(subnet_prefix, sources):
+    for source in sources:
+        # Skip the routers whose breaker was opened, or is being tried, by another scan meanwhile
+        if not source.breaker.acquire():
+            continue
+
+        scan_result = await scan_on_route_source(source, subnet_prefix)
+        if scan_result['status']:
+            SUBNET_SCANS.inc(outcome="success")
+            return scan_result
+
+    SUBNET_SCANS.inc(outcome="failure")
+    raise HTTPException(status_code=400, detail="Can't Connect to Routers")
+
+
+# Scan a subnet prefix on the first SCAN_RACE_ROUTERS routers at the same time, and take the first answer.
+# If all of them fail, the other routers are tried one after the other.
+async def scan_with_race(subnet_prefix, sources):
+    tasks = [asyncio.create_task(scan_on_route_source(source, subnet_prefix)) for source in sources[:SCAN_RACE_ROUTERS] if source.breaker.acquire()]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            scan_result = await next_result
+            if scan_result['status']:
+                SUBNET_SCANS.inc(outcome="success")
+                return scan_result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return await scan_with_failover(subnet_prefix, sources[SCAN_RACE_ROUTERS:])
+
+
+# Scan one subnet document through the given routers, and update its online status and utilization.
+async def run_subnet_scan(subnet, sources, race=False):
+    if race:
+        scan_result = await scan_with_race(subnet['subnet_prefix'], sources)
+    else:
+        scan_result = await scan_with_failover(subnet['subnet_prefix'], sources)
+
+    update_data = {
+        "online_status": scan_result['online_status'],
+        "online_utilization": scan_result['online_utilization']
+    }
+
+    await collection.update_one(
+        {"_id": subnet["_id"]},
+        {"$set": update_data}
+    )
+    invalidate_views([subnet['subnet_prefix']])
+
+    return {"message": "Subnet Scanned Successfully"}
+
+
+
 # Scan a subnet, which means check if the subnet exist in live network.
+# The routers are tried in their configured order, or raced with "race": true.
 @app.put("/scan_subnet/")
 async def scan_subnet(data: dict):
     subnet_prefix= data['subnet_prefix']
@@ -319,91 +835,350 @@ async def scan_subnet(data: dict):
     if not existing_subnet:
         raise HTTPException(status_code=404, detail="Subnet not found")
 
-    routers = await router_collection.find().to_list()   #return the two routers
+    pool = await get_router_pool()
 
-    if not routers:
-        raise HTTPException(status_code=404, detail="Router not found. Please add Router first")
+    return await run_subnet_scan(existing_subnet, pool.available(), race=bool(data.get("race", False)))
 
-    main_router = routers[0]
-    router_vendor = main_router['router_vendor']
-    main_router['router_password'] = decrypt_password(main_router['router_password'])
-    router_device_info = {"hostname": main_router['router_ip'], "username": main_router['router_username'], "password": main_router['router_password'] }
 
-    connection_status_to_main_router = router_connection_test(router_vendor, **router_device_info)
+# Scan multiple subnets concurrently on the scan worker pool, and return the result of each subnet.
+# The subnets are spread over the available routers.
+@app.put("/scan_subnets/")
+async def scan_subnets(ids: List[str]):
+    object_ids = [ObjectId(id) for id in ids]
+    subnets = await collection.find({"_id": {"$in": object_ids}}).to_list()
+    subnets = {str(subnet["_id"]): subnet for subnet in subnets}
 
-    # If connection failed to the main router, and no backup router, raise error.
-    if not connection_status_to_main_router and len(routers) == 1:
-        raise HTTPException(status_code=400, detail="Can't Connect to Router")
+    pool = await get_router_pool()
 
-    # If connection failed to the main router, proceed with the backup router if exists.
-    if not connection_status_to_main_router and len(routers)==2:
-        backup_router = routers[1]
-        router_vendor = backup_router['router_vendor']
-        backup_router['router_password'] = decrypt_password(backup_router['router_password'])
-        router_device_info = {"hostname": backup_router['router_ip'], "username": backup_router['router_username'], "password": backup_router['router_password'] }
+    async def scan(id):
+        subnet = subnets.get(id)
+        if not subnet:
+            return {"id": id, "subnet_prefix": None, "success": False, "message": "Subnet not found"}
 
-        if not router_connection_test(router_vendor, **router_device_info):
-            raise HTTPException(status_code=400, detail="Can't Connect to Routers")
+        try:
+            result = await run_subnet_scan(subnet, pool.spread())
+        except HTTPException as e:
+            return {"id": id, "subnet_prefix": subnet['subnet_prefix'], "success": False, "message": e.detail}
 
-    scan_result = route_scan(subnet_prefix, router_vendor, **router_device_info)
+        return {"id": id, "subnet_prefix": subnet['subnet_prefix'], "success": True, "message": result["message"]}
 
-    # If route successfully was queried from the router, then update the scan results with online status and utilization.
-    if scan_result['status']:
-        update_data = {
-            "online_status": scan_result['online_status'],
-            "online_utilization": scan_result['online_utilization']
-        }
+    results = await asyncio.gather(*(scan(id) for id in ids))
+    return {"results": results}
 
-        await collection.update_one(
-            {"_id": existing_subnet["_id"]},
-            {"$set": update_data}
-        )
 
-        return {"message": "Subnet Scanned Successfully"}
 
-    return {"message": "Connection to Router Failed"}
+# Get the routing table snapshot of the first reachable router, from the cache if still valid.
+async def get_route_snapshot(sources):
+    for source in sources:
+        snapshot = route_snapshots.get(source.router_id)
+        if snapshot is not None:
+            return source.router, snapshot
+        if not source.breaker.acquire():
+            continue
 
+        try:
+            snapshot = await run_router_call(source.router, route_table_snapshot, source.router_vendor, async_function=async_route_table_snapshot, **source.device_info)
+        except asyncio.CancelledError:
+            source.breaker.release()
+            raise
+        except Exception as e:
+            print(f"exception: {e}")
+            source.breaker.record_failure()
+            continue
+
+        source.breaker.record_success()
+        route_snapshots.put(source.router_id, snapshot)
+        return source.router, snapshot
+
+    raise HTTPException(status_code=400, detail="Can't Connect to Routers")
+
+
+
+# Snapshot scan: pull the routing table once, and compute the online status and utilization of the subnets locally.
+# Without ids, all the subnets in the database are scanned.
+@app.put("/scan_snapshot/")
+async def scan_snapshot(ids: Optional[List[str]] = Body(None)):
+    pool = await get_router_pool()
+
+    router, snapshot = await get_route_snapshot(pool.available())
+
+    query = {} if ids is None else {"_id": {"$in": [ObjectId(id) for id in ids]}}
+    scanned = 0
+    updates = []
+    scanned_prefixes = []
+    async for subnet in collection.find(query, {"subnet_prefix": 1}):
+        updates.append(UpdateOne({"_id": subnet["_id"]}, {"$set": snapshot.lookup(subnet['subnet_prefix'])}))
+        scanned_prefixes.append(subnet['subnet_prefix'])
+
+        if len(updates) == SCAN_WRITE_BATCH_SIZE:
+            await collection.bulk_write(updates, ordered=False)
+            invalidate_views(scanned_prefixes)
+            scanned += len(updates)
+            updates = []
+            scanned_prefixes = []
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        invalidate_views(scanned_prefixes)
+        scanned += len(updates)
+
+    return {"message": "Subnets Scanned Successfully", "router": router['router_name'], "routes": len(snapshot), "scanned": scanned}
+
+
+
+# Background scan jobs. The subnets are scanned concurrently in batches, spread over the available routers,
+# and every batch writes the subnets scan results and their history records.
+SCAN_JOB_SCOPES = ("all", "major", "ids")
+
+
+async def run_scan_job(job):
+    try:
+        pool = await get_router_pool()
+    except HTTPException as e:
+        job.finish(e.detail)
+        return
+
+    if job.scope == "ids":
+        query = {"_id": {"$in": [ObjectId(id) for id in job.ids]}}
+    elif job.scope == "major":
+        query = MAJOR_SUBNETS_QUERY
+    else:
+        query = {}
+
+    subnets = await collection.find(query, {"subnet_prefix": 1}).to_list()
+    job.start(len(subnets))
+
+    async def scan(subnet):
+        try:
+            return await scan_with_failover(subnet['subnet_prefix'], pool.spread())
+        except Exception as e:
+            print(f"exception: {e}")
+            return {"status": False}
+
+    for start in range(0, len(subnets), SCAN_WRITE_BATCH_SIZE):
+        batch = subnets[start:start + SCAN_WRITE_BATCH_SIZE]
+        scan_results = await asyncio.gather(*(scan(subnet) for subnet in batch))
+
+        scanned_at = datetime.now(timezone.utc)
+        updates = []
+        history = []
+        for subnet, scan_result in zip(batch, scan_results):
+            if not scan_result['status']:
+                continue
+            update_data = {"online_status": scan_result['online_status'], "online_utilization": scan_result['online_utilization']}
+            updates.append(UpdateOne({"_id": subnet["_id"]}, {"$set": update_data}))
+            history.append({"scanned_at": scanned_at, "subnet_prefix": subnet['subnet_prefix'], "job_id": job.job_id, **update_data})
+
+        if updates:
+            await collection.bulk_write(updates, ordered=False)
+            await scan_history_collection.insert_many(history, ordered=False)
+            invalidate_views([record['subnet_prefix'] for record in history])
+
+        job.advance(len(batch), failed=len(batch) - len(updates))
 
-# Scan a subnet, which means check if the subnet exist in live network.
-@app.put("/scan_subnets/")
-async def scan_subnets(ids: List[str]):
-    for id in ids:
-        object_id = ObjectId(id)
-        subnet = await collection.find_one({"_id": object_id})
-        subnet_prefix = subnet['subnet_prefix']
-        data = {"subnet_prefix": subnet_prefix}
-        await scan_subnet(data)
+
+# Periodic rescans every SCAN_INTERVAL seconds (0 disables them), of all the subnets or the major subnets only.
+SCAN_INTERVAL = int(os.getenv("SCAN_INTERVAL", "0"))
+SCAN_INTERVAL_SCOPE = os.getenv("SCAN_INTERVAL_SCOPE", "all")
+scan_scheduler = ScanScheduler(run_scan_job, interval=SCAN_INTERVAL, scope=SCAN_INTERVAL_SCOPE)
+
+
+class ScanJobRequest(BaseModel):
+    scope: str = "all"
+    ids: Optional[List[str]] = None
+
+
+# Submit a background scan job, the job id is returned immediately.
+@app.post("/scan_jobs/")
+async def submit_scan_job(scan_job: Optional[ScanJobRequest] = Body(None)):
+    scan_job = scan_job or ScanJobRequest()
+    scope = "ids" if scan_job.ids is not None else scan_job.scope
+    if scope not in SCAN_JOB_SCOPES:
+        raise HTTPException(status_code=400, detail="Invalid scan scope")
+    if scope == "ids" and not all(ObjectId.is_valid(id) for id in scan_job.ids or []):
+        raise HTTPException(status_code=400, detail="Invalid subnet id")
+
+    job = scan_scheduler.submit(scope, scan_job.ids)
+    return {"job_id": job.job_id, "status": job.status}
+
+
+# List the scan jobs, most recent first
+@app.get("/scan_jobs/")
+async def list_scan_jobs():
+    return {"jobs": [job.to_dict() for job in scan_scheduler.list()]}
+
+
+# Progress and ETA of a scan job
+@app.get("/scan_jobs/{job_id}")
+async def get_scan_job(job_id: str):
+    job = scan_scheduler.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job.to_dict()
+
+
+SCAN_HISTORY_PROJECTION = {"_id": 0, "scanned_at": 1, "job_id": 1, "online_status": 1, "online_utilization": 1}
+
+
+# Scan history of a subnet, most recent first
+@app.get("/api/subnets/{subnet_id}-{subnet_mask}/history")
+async def get_subnet_scan_history(subnet_id: str, subnet_mask: str, limit: int = DEFAULT_PAGE_SIZE):
+    subnet_prefix = f"{subnet_id}/{subnet_mask}"
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    history = await scan_history_collection.find({"subnet_prefix": subnet_prefix}, SCAN_HISTORY_PROJECTION, sort=[("scanned_at", DESCENDING)], limit=limit).to_list()
+
+    for record in history:
+        record['scanned_at'] = record['scanned_at'].isoformat()
+    return {"subnet_prefix": subnet_prefix, "history": history}
 
 
 
 # Break a subnet, means to divide a subnet into smaller subnets.
+# The children are validated once against the index and written with batched insert_many, then the parent
+# utilization is computed once. Breaks of more than BREAK_SYNC_CHILDREN children run as a background job,
+# and breaks of more than BREAK_MAX_CHILDREN children are refused.
 @app.put("/break_subnet/")
 async def break_subnet(data: dict):
+    main_subnet_prefix, break_prefixlen, count = get_break_request(data)
+
+    if count > BREAK_SYNC_CHILDREN:
+        # The children are checked again when the job runs, but a wrong request is refused right away
+        if subnet_index.children(main_subnet_prefix):
+            raise HTTPException(status_code=400, detail="Subnet already contains smaller subnet(s). You should delete them first before breaking it.")
+
+        job = break_scheduler.submit("break", trigger="api", params={"subnet_prefix": main_subnet_prefix, "break_prefixlen": break_prefixlen})
+        return {"message": f"Subnet is being divided into {count} subnets in the background", "job_id": job.job_id}
+
+    await write_break_subnets(main_subnet_prefix, break_prefixlen)
+    return {"message": "Subnet has been divided successfully"}
+
+
+# Dry run of a break: the number of children, and the first and last of them, nothing is written
+@app.post("/break_subnet/preview")
+async def preview_break_subnet(data: dict):
+    main_subnet_prefix, break_prefixlen, count = get_break_request(data, check_limit=False)
+
+    preview = get_break_preview(main_subnet_prefix, break_prefixlen, BREAK_PREVIEW_SIZE)
+    if count > BREAK_MAX_CHILDREN:
+        preview['mode'] = "refused"
+    elif count > BREAK_SYNC_CHILDREN:
+        preview['mode'] = "job"
+    else:
+        preview['mode'] = "sync"
+    return preview
+
+
+# Validate a break request, return the normalized subnet prefix, the break prefix length and the number of children
+def get_break_request(data, check_limit=True):
     main_subnet_prefix= data['subnet_prefix']
-    break_prefixlen = data ['break_prefixlen']
-    main_subnet_id,main_subnet_mask = main_subnet_prefix.split("/")
-    break_prefixlen = int(break_prefixlen.strip("/")) # convert the prefix length from /xx string format to integer number xx
+    try:
+        break_prefixlen = int(str(data['break_prefixlen']).strip("/")) # convert the prefix length from /xx string format to integer number xx
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Wrong break prefix length!")
 
-    # Check if the subnet already has child subnets, at least one.
-    existing_child_subnet = await collection.find_one({"subnet_parent": main_subnet_prefix})
+    if main_subnet_prefix not in subnet_index:
+        raise HTTPException(status_code=404, detail="Subnet not found")
 
-    if  existing_child_subnet:
-        raise HTTPException(status_code=400, detail="Subnet already contains smaller subnet(s). You should delete them first before breaking it.")
+    main_subnet_network = Prefix.parse(main_subnet_prefix)
+    if not main_subnet_network.prefixlen < break_prefixlen <= main_subnet_network.max_prefixlen:
+        raise HTTPException(status_code=400, detail="Wrong break prefix length!")
 
-    child_subnets_list = get_break_subnet(main_subnet_prefix,break_prefixlen)
-    for child_subnet in child_subnets_list:
-        child_subnet_data = Subnet(
-        subnet_prefix=child_subnet["subnet_prefix"],
-        subnet_id = child_subnet["subnet_id"],
-        subnet_mask = child_subnet["subnet_mask"],
-        subnet_name = child_subnet["subnet_name"],
-        subnet_service = child_subnet["subnet_service"],
-        subnet_description = child_subnet["subnet_description"]
-        )
-        await add_subnet(main_subnet_id,main_subnet_mask,child_subnet_data)
+    count = main_subnet_network.count_subnets(break_prefixlen)
+    if check_limit and count > BREAK_MAX_CHILDREN:
+        raise HTTPException(status_code=400, detail=f"Too many subnets, a break can create up to {BREAK_MAX_CHILDREN} subnets!")
+    return str(main_subnet_network), break_prefixlen, count
 
 
-    return {"message": "Subnet has been divided successfully"}
+# Write the children of a break, progress(done) is called after every batch. Every batch is written holding the root
+# lock, released between the batches so a break of many children doesn't hold back the other writes under the root
+# subnet until it ends. The tree is checked again with every batch, it may have changed meanwhile.
+@timed(OPERATION_SECONDS, operation="write_break_subnets")
+async def write_break_subnets(main_subnet_prefix, break_prefixlen, progress=None):
+    root_subnet = subnet_index.get(main_subnet_prefix)
+    if root_subnet is None:
+        raise HTTPException(status_code=404, detail="Subnet not found")
+
+    child_subnets = get_break_subnet(main_subnet_prefix,break_prefixlen)
+    first_batch = True
+    while True:
+        batch = list(itertools.islice(child_subnets, BREAK_WRITE_BATCH_SIZE))
+        if not batch:
+            break
+
+        async with get_subnet_lock(root_subnet):
+            # Deleted by another request while the lock was awaited
+            if main_subnet_prefix not in subnet_index:
+                raise HTTPException(status_code=404, detail="Subnet not found")
+
+            # Check if the subnet already has child subnets, at least one.
+            if first_batch and subnet_index.children(main_subnet_prefix):
+                raise HTTPException(status_code=400, detail="Subnet already contains smaller subnet(s). You should delete them first before breaking it.")
+            first_batch = False
+
+            await insert_child_subnets(batch, root_subnet)
+
+        if progress:
+            progress(len(batch))
+
+
+async def run_break_job(job):
+    main_subnet_prefix = job.params['subnet_prefix']
+    break_prefixlen = job.params['break_prefixlen']
+    job.start(Prefix.parse(main_subnet_prefix).count_subnets(break_prefixlen))
+
+    try:
+        await write_break_subnets(main_subnet_prefix, break_prefixlen, job.advance)
+    except HTTPException as e:
+        job.finish(e.detail)
+
+
+break_scheduler = ScanScheduler(run_break_job)
+
+
+# Progress and ETA of a background break
+@app.get("/break_jobs/{job_id}")
+async def get_break_job(job_id: str):
+    job = break_scheduler.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Break job not found")
+    return job.to_dict()
+
+
+# Write a batch of break children, add the written ones to the index, and update the utilization of their upper subnets.
+# Must be called holding the lock of the root subnet. Between two batches other requests may have added subnets under
+# the broken subnet: a child added meanwhile is skipped, a child gets the smallest subnet containing it as parent,
+# and takes the subnets inside it as children.
+async def insert_child_subnets(child_subnets, root_subnet):
+    documents = []
+    moved_subnets = {}
+    for child_subnet in child_subnets:
+        child_subnet_prefix = child_subnet['subnet_prefix']
+        if child_subnet_prefix in subnet_index:
+            continue
+        upper_subnet_prefix = subnet_index.longest_match(child_subnet_prefix, strict=True)
+        documents.append(get_subnet_document(child_subnet, root_subnet, upper_subnet_prefix))
+        moved_subnets.update({subnet_prefix: child_subnet_prefix for subnet_prefix in subnet_index.children(child_subnet_prefix)})
+
+    failed_indexes = set()
+    try:
+        if documents:
+            await collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # Subnets added meanwhile by another instance, the other subnets of the batch are written
+        failed_indexes = {error["index"] for error in e.details.get("writeErrors", [])}
+
+    written = [document for index, document in enumerate(documents) if index not in failed_indexes]
+    written_prefixes = {document['subnet_prefix'] for document in written}
+    for document in written:
+        subnet_index.insert(document['subnet_prefix'], root_subnet)
+
+    moved_subnets = {subnet_prefix: parent for subnet_prefix, parent in moved_subnets.items() if parent in written_prefixes}
+    try:
+        if moved_subnets:
+            await collection.bulk_write([UpdateOne({"subnet_prefix": child}, {"$set": {"subnet_parent": parent}}) for child, parent in moved_subnets.items()], ordered=False)
+            invalidate_views(moved_subnets)
+    finally:
+        await update_subnets_utilization([document['subnet_parent'] for document in written] + list(moved_subnets.values()))
 
 
 
@@ -415,6 +1190,52 @@ async def add_subnet_form(request: Request, main_subnet_id: str, main_subnet_mas
 
 
 
+# Writes changing the subnets tree under one root subnet are serialized with the lock of the root
+subnet_locks = {}
+
+
+def get_subnet_lock(root_subnet):
+    if root_subnet not in subnet_locks:
+        subnet_locks[root_subnet] = asyncio.Lock()
+    return subnet_locks[root_subnet]
+
+
+# Write the covered addresses and the utilization of the subnets, as maintained incrementally by the index,
+# in one batched update. Only the parent of an added or deleted subnet changes, its upper subnets keep the same children.
+@timed(OPERATION_SECONDS, operation="update_subnets_utilization")
+async def update_subnets_utilization(subnet_prefixes):
+    subnet_prefixes = list(dict.fromkeys(subnet_prefixes))
+    updates = []
+    for subnet_prefix in subnet_prefixes:
+        if subnet_prefix and subnet_prefix in subnet_index:
+            covered_addresses = format_covered_addresses(subnet_prefix, subnet_index.covered(subnet_prefix))
+            update_data = {"covered_addresses": covered_addresses, "offline_utilization": subnet_index.utilization(subnet_prefix)}
+            updates.append(UpdateOne({"subnet_prefix": subnet_prefix}, {"$set": update_data}))
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+    invalidate_views(subnet_prefixes)
+
+
+# Form the database document of a new child subnet
+def get_subnet_document(subnet, root_subnet, parent_subnet):
+    return {
+        "subnet_prefix": subnet["subnet_prefix"],
+        "subnet_id": subnet["subnet_id"],
+        "subnet_mask": subnet["subnet_mask"],
+        "subnet_root": root_subnet,
+        "subnet_parent": parent_subnet,
+        "subnet_name": subnet["subnet_name"],
+        "subnet_service": subnet["subnet_service"],
+        "subnet_description": subnet["subnet_description"],
+        "offline_utilization": 0.00,
+        "covered_addresses": format_covered_addresses(subnet["subnet_prefix"], 0),
+        "online_status": "",
+        "online_utilization": 0.00,
+        **get_network_fields(subnet["subnet_prefix"])
+    }
+
+
 # Add subnet under Upper subnet
 @app.post("/subnets/{upper_subnet_id}-{upper_subnet_mask}/add-subnet")
 async def add_subnet(upper_subnet_id: str, upper_subnet_mask: str, subnet: Subnet):
@@ -429,79 +1250,298 @@ async def add_subnet(upper_subnet_id: str, upper_subnet_mask: str, subnet: Subne
     if not validate_ip(subnet.subnet_id):
         raise HTTPException(status_code=400, detail="Wrong subnet ID!")
 
-    # Validating subnet mask/prefix-length in the range from 0 to 32
-    if not validate_prefix_length(subnet.subnet_mask):
-        raise HTTPException(status_code=400, detail="Wrong subnet Mask, Please input mask in range (0 to 32) !")
+    # Validating subnet mask/prefix-length in the range from 0 to 32 (0 to 128 for IPv6)
+    max_prefixlen = ipaddress.ip_address(subnet.subnet_id).max_prefixlen
+    if not validate_prefix_length(subnet.subnet_mask, max_prefixlen):
+        raise HTTPException(status_code=400, detail=f"Wrong subnet Mask, Please input mask in range (0 to {max_prefixlen}) !")
 
     # Forming upper subnet prefix
     upper_subnet_prefix = f"{upper_subnet_id}/{upper_subnet_mask}"
 
-    # Getting the new subnet from DB, if exist
-    existing_subnet = await collection.find_one({"subnet_prefix": subnet.subnet_prefix})
+    # Extract root subnet from the index, the upper subnet must already exist
+    if upper_subnet_prefix not in subnet_index:
+        raise HTTPException(status_code=404, detail="Upper subnet not found")
+    root_subnet = subnet_index.get(upper_subnet_prefix)
 
-    # Extract root subnet
-    upper_subnet = await collection.find_one({"subnet_prefix": upper_subnet_prefix})
-    root_subnet = upper_subnet['subnet_root']
-    root_subnet_network =  ipaddress.IPv4Network(root_subnet,strict=False)
-    root_subnet_prefixlen = root_subnet_network.prefixlen
-
-    if existing_subnet:
-        raise HTTPException(status_code=400, detail="Subnet Already Exists.")
+    new_subnet_network = Prefix.parse(subnet.subnet_prefix)  # convert string subnet into Prefix
+    upper_subnet_network = Prefix.parse(upper_subnet_prefix)  # convert string subnet into Prefix
 
-
-    # Subnet doesn't exist, create it and bind it to the parents subnet, and child subnets if exist.
-    else:
-        new_subnet_network = ipaddress.IPv4Network(subnet.subnet_prefix,strict=False)  # convert string subnet into class ipaddress
-        upper_subnet_network = ipaddress.IPv4Network(upper_subnet_prefix,strict=False)  # convert string subnet into class ipaddress
+    async with get_subnet_lock(root_subnet):
+        if subnet.subnet_prefix in subnet_index:
+            raise HTTPException(status_code=400, detail="Subnet Already Exists.")
 
         # Verify new subnet is part of the upper subnet.
-        if not new_subnet_network.subnet_of(upper_subnet_network):
+        if not upper_subnet_network.contains(new_subnet_network):
             raise HTTPException(status_code=400, detail="Invalid Subnet.")
 
-        # Iterate to smaller subnets
-        all_upper_children_subnets = await collection.find({"subnet_parent":upper_subnet_prefix}).to_list()
-        for child in all_upper_children_subnets:
-            child_network = ipaddress.IPv4Network(child['subnet_prefix'],strict=False)
-            if child_network in list(new_subnet_network.subnets()):
-                # Update child parent to the new_subnet
-                await collection.update_one({"subnet_prefix":child['subnet_prefix']},{"$set":{"subnet_parent":subnet.subnet_prefix}})
-
-
-        # Iterate to upper subnets towards root (if exist)
-        for i in range(new_subnet_network.prefixlen-1,root_subnet_prefixlen+1,-1):
-            # find the smallest upper network and set it to be a parent
-            tmp_subnet_prefix = new_subnet_network.supernet(new_subnet_network.prefixlen-i)
-            tmp_subnet = await collection.find_one({"subnet_prefix":str(tmp_subnet_prefix)})
-            if tmp_subnet:
-                upper_subnet_prefix = str(tmp_subnet_prefix)
-                break
-
-        post_data = {
-            "subnet_prefix": str(new_subnet_network),
-            "subnet_id": str(new_subnet_network.network_address),
-            "subnet_mask": subnet.subnet_mask,
-            "subnet_root": root_subnet,
-            "subnet_parent": upper_subnet_prefix,
-            "subnet_name": subnet.subnet_name,
-            "subnet_service": subnet.subnet_service,
-            "subnet_description": subnet.subnet_description,
-            "offline_utilization": 0.00,
-            "online_status": "",
-            "online_utilization": 0.00
-        }
-
-        await collection.insert_one(post_data)
-
-        # Update utilization for upper subnet
-        all_upper_children = await collection.find({"subnet_parent":upper_subnet_prefix}).to_list()
-        all_upper_children_subnets = []
-        for child in all_upper_children:
-            all_upper_children_subnets.append(child['subnet_prefix'])
-
-        utilization = get_subnet_utilization(upper_subnet_prefix,all_upper_children_subnets)
-        await collection.update_one({"subnet_prefix": upper_subnet_prefix},{"$set": {"offline_utilization": utilization}})
-
-        return {"message": "Subnet added successfully"}
+        # Subnet doesn't exist, create it and bind it to the parents subnet, and child subnets if exist.
+        try:
+            await insert_subnet(new_subnet_network, subnet, root_subnet)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Subnet Already Exists.")
+
+    return {"message": "Subnet added successfully"}
+
+
+# Insert a new subnet under its smallest existing upper subnet, and move the existing subnets under it.
+# Must be called holding the lock of the root subnet.
+@timed(OPERATION_SECONDS, operation="insert_subnet")
+async def insert_subnet(new_subnet_network, subnet, root_subnet):
+    new_subnet_prefix = str(new_subnet_network)
+
+    # The smallest existing subnet containing the new subnet becomes its parent
+    upper_subnet_prefix = subnet_index.longest_match(new_subnet_prefix, strict=True)
+
+    post_data = get_subnet_document({
+        "subnet_prefix": new_subnet_prefix,
+        "subnet_id": new_subnet_network.network_address,
+        "subnet_mask": subnet.subnet_mask,
+        "subnet_name": subnet.subnet_name,
+        "subnet_service": subnet.subnet_service,
+        "subnet_description": subnet.subnet_description,
+    }, root_subnet, upper_subnet_prefix)
+
+    await collection.insert_one(post_data)
+
+    # Existing subnets directly under the new subnet are moved under it
+    child_subnet_prefixes = subnet_index.children(new_subnet_prefix)
+    if child_subnet_prefixes:
+        await collection.update_many({"subnet_prefix": {"$in": child_subnet_prefixes}},{"$set":{"subnet_parent":new_subnet_prefix}})
+
+    subnet_index.insert(new_subnet_prefix, root_subnet)
+    invalidate_views(child_subnet_prefixes)
+
+    # Update utilization for upper subnet, and for the new subnet when existing subnets moved under it
+    await update_subnets_utilization([upper_subnet_prefix, new_subnet_prefix] if child_subnet_prefixes else [upper_subnet_prefix])
+
+    return post_data
+
+
+class SubnetAllocation(BaseModel):
+    prefixlen: int = Field(...)
+    strategy: str = "first"     # "first": lowest free address, "best": smallest free region that fits
+    subnet_name: str = ""
+    subnet_service: str = ""
+    subnet_description: str = ""
+
+
+ALLOCATION_ATTEMPTS = 8
+
+
+# Allocate the next free subnet of the requested prefix length under the upper subnet, and reserve it.
+# Allocations under the same root subnet are serialized, so two callers never get the same subnet.
+@app.post("/subnets/{upper_subnet_id}-{upper_subnet_mask}/allocate")
+async def allocate_subnet(upper_subnet_id: str, upper_subnet_mask: str, allocation: SubnetAllocation):
+    upper_subnet_prefix = f"{upper_subnet_id}/{upper_subnet_mask}"
+
+    if upper_subnet_prefix not in subnet_index:
+        raise HTTPException(status_code=404, detail="Upper subnet not found")
+    root_subnet = subnet_index.get(upper_subnet_prefix)
+
+    upper_subnet_network = Prefix.parse(upper_subnet_prefix)
+    if not upper_subnet_network.prefixlen < allocation.prefixlen <= upper_subnet_network.max_prefixlen:
+        raise HTTPException(status_code=400, detail=f"Wrong subnet Mask, Please input mask in range (0 to {upper_subnet_network.max_prefixlen}) !")
+
+    if allocation.strategy not in ("first", "best"):
+        raise HTTPException(status_code=400, detail="Invalid allocation strategy")
+
+    async with get_subnet_lock(root_subnet):
+        for attempt in range(ALLOCATION_ATTEMPTS):
+            free_block = subnet_index.find_free_block(str(upper_subnet_network), allocation.prefixlen, best_fit=allocation.strategy == "best")
+            if free_block is None:
+                raise HTTPException(status_code=409, detail="No free subnet available")
+
+            free_block_network = Prefix.parse(free_block)
+            subnet = Subnet(subnet_prefix=free_block, subnet_id=free_block_network.network_address, subnet_mask=str(allocation.prefixlen),
+                            subnet_name=allocation.subnet_name, subnet_service=allocation.subnet_service,
+                            subnet_description=allocation.subnet_description)
+            try:
+                await insert_subnet(free_block_network, subnet, root_subnet)
+            except DuplicateKeyError:
+                # Reserved meanwhile by another application process, take it into account and try the next one
+                subnet_index.insert(free_block, root_subnet)
+                continue
+
+            return {"message": "Subnet allocated successfully", "subnet_prefix": free_block}
+
+    raise HTTPException(status_code=409, detail="No free subnet available")
+
+
+
+# Bulk import of subnets from a CSV or NDJSON request body. The body is spooled to a temporary file (on disk past
+# IMPORT_SPOOL_SIZE bytes), the rows are parsed and sorted, then the subnets are written in batches of IMPORT_BATCH_SIZE.
+# The progress is streamed back as one JSON line per batch, the last line is the summary with the wrong rows.
+IMPORT_SPOOL_SIZE = 16 * 1024 * 1024
+IMPORT_BATCH_SIZE = 1000
+
+
+@app.post("/api/import")
+async def import_subnets(request: Request, format: str = "csv"):
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid import format")
+
+    upload = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+    async for chunk in request.stream():
+        upload.write(chunk)
+    upload.seek(0)
+
+    with upload, io.TextIOWrapper(upload, encoding="utf-8-sig", newline="") as text_file:
+        rows, errors, error_count = await asyncio.to_thread(load_import_rows, text_file, format)
+
+    return StreamingResponse(import_subnet_rows(rows, errors, error_count), media_type="application/x-ndjson")
+
+
+# Insert the sorted import rows. A subnet always comes after its upper subnets, so its parent and root are found in the
+# index, which holds the existing subnets and the subnets imported before it. Existing subnets falling under an imported
+# subnet are moved under it. The rows of one root subnet follow each other, and are read and written holding the root
+# lock, released while a progress line is sent.
+async def import_subnet_rows(rows, errors, error_count):
+    summary = {"processed": 0, "total": len(rows) + error_count, "imported": 0, "existing": 0, "failed": error_count}
+    batch = []
+    moved_subnets = {}
+    upper_subnet_prefixes = []
+    root_lock = None
+    root_subnet = None
+
+    async def flush():
+        nonlocal batch, moved_subnets, upper_subnet_prefixes
+        if batch:
+            try:
+                await collection.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Subnets added meanwhile by another instance, the existing subnets stay under their parent
+                failed_subnet_prefixes = {batch[error["index"]]["subnet_prefix"] for error in e.details.get("writeErrors", [])}
+                for subnet_prefix in failed_subnet_prefixes:
+                    subnet_index.remove(subnet_prefix)
+                for child_subnet_prefix, subnet_prefix in list(moved_subnets.items()):
+                    if subnet_prefix in failed_subnet_prefixes:
+                        del moved_subnets[child_subnet_prefix]
+                summary["failed"] += len(failed_subnet_prefixes)
+                summary["imported"] -= len(failed_subnet_prefixes)
+
+        if moved_subnets:
+            await collection.bulk_write([UpdateOne({"subnet_prefix": child}, {"$set": {"subnet_parent": parent}}) for child, parent in moved_subnets.items()], ordered=False)
+            invalidate_views(moved_subnets)
+        await update_subnets_utilization(upper_subnet_prefixes)
+
+        batch, moved_subnets, upper_subnet_prefixes = [], {}, []
+
+    try:
+        for version, net_start, prefixlen, name, service, description in rows:
+            summary["processed"] += 1
+            prefix = Prefix(net_start, prefixlen, 32 if version == 4 else 128)
+            subnet_id = prefix.network_address
+            subnet_prefix = f"{subnet_id}/{prefixlen}"
+
+            # The root lock is taken before the tree is read: the tree may change while the lock is awaited,
+            # so the root is found again once it is held
+            while True:
+                upper_subnet_prefix = subnet_index.longest_match(subnet_prefix)
+                subnet_root = subnet_index.get(upper_subnet_prefix) if upper_subnet_prefix else subnet_prefix
+                if subnet_root == root_subnet:
+                    break
+                await flush()
+                if root_lock:
+                    root_lock.release()
+                    root_lock = root_subnet = None
+                lock = get_subnet_lock(subnet_root)
+                await lock.acquire()
+                root_lock, root_subnet = lock, subnet_root
+
+            if subnet_prefix in subnet_index:
+                summary["existing"] += 1
+                continue
+
+            upper_subnet_prefix = subnet_index.longest_match(subnet_prefix, strict=True) or ""
+            child_subnet_prefixes = subnet_index.children(subnet_prefix)
+
+            # A new major subnet would change the root of the existing major subnets under it
+            if not upper_subnet_prefix and child_subnet_prefixes:
+                summary["failed"] += 1
+                if len(errors) < 100:
+                    errors.append({"subnet_prefix": subnet_prefix, "error": "Contains existing major subnets"})
+                continue
+
+            subnet = {"subnet_prefix": subnet_prefix, "subnet_id": subnet_id, "subnet_mask": str(prefixlen),
+                      "subnet_name": name, "subnet_service": service, "subnet_description": description}
+            batch.append(get_subnet_document(subnet, subnet_root, upper_subnet_prefix))
+            subnet_index.insert(subnet_prefix, subnet_root)
+            summary["imported"] += 1
+
+            moved_subnets.update({child_subnet_prefix: subnet_prefix for child_subnet_prefix in child_subnet_prefixes})
+            upper_subnet_prefixes.append(upper_subnet_prefix)
+            if child_subnet_prefixes:
+                upper_subnet_prefixes.append(subnet_prefix)
+
+            if len(batch) == IMPORT_BATCH_SIZE:
+                await flush()
+                # The progress is sent without the root lock, the client may read it slowly.
+                # The lock is taken again with the next row.
+                root_lock.release()
+                root_lock = root_subnet = None
+                yield json.dumps(summary) + "\n"
+
+        await flush()
+    finally:
+        if root_lock:
+            root_lock.release()
+        rows.close()
+
+    yield json.dumps({**summary, "errors": errors}) + "\n"
+
+
+
+# Streaming export of the subnets as CSV or NDJSON, sorted by network address. With root, only the subnets inside
+# the root subnet (itself included) are exported. Rows are read from a server side cursor EXPORT_BATCH_SIZE at a time,
+# and sent as they are read.
+EXPORT_FIELDS = ("subnet_prefix", "subnet_parent", "subnet_root", "subnet_name", "subnet_service", "subnet_description",
+                 "offline_utilization", "covered_addresses", "online_status", "online_utilization")
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_BATCH_SIZE = 1000
+
+
+@app.get("/api/export")
+async def export_subnets(format: str = "ndjson", root: str = None):
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid export format")
+
+    query = {}
+    if root:
+        try:
+            network_fields = get_network_fields(root)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Wrong subnet prefix!")
+        if root not in subnet_index:
+            raise HTTPException(status_code=404, detail="Subnet not found")
+        query = {"net_version": network_fields['net_version'], "net_start": {"$gte": network_fields['net_start']}, "net_end": {"$lte": network_fields['net_end']}}
+
+    sort = [("net_version", ASCENDING), ("net_start", ASCENDING), ("net_end", DESCENDING)]
+    cursor = collection.find(query, {field: 1 for field in EXPORT_FIELDS}, sort=sort, batch_size=EXPORT_BATCH_SIZE)
+    headers = {"Content-Disposition": f"attachment; filename=subnets.{format}"}
+    return StreamingResponse(export_subnet_rows(cursor, format), media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
+
+
+async def export_subnet_rows(cursor, format):
+    # Rows are joined and sent per cursor batch
+    rows = io.StringIO()
+    csv_writer = csv.writer(rows, lineterminator="\n")
+    if format == "csv":
+        csv_writer.writerow(EXPORT_FIELDS)
+
+    count = 0
+    async for subnet in cursor:
+        if format == "csv":
+            csv_writer.writerow([subnet.get(field, "") for field in EXPORT_FIELDS])
+        else:
+            rows.write(json.dumps({field: subnet.get(field) for field in EXPORT_FIELDS}) + "\n")
+
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield rows.getvalue()
+            rows.seek(0)
+            rows.truncate()
+
+    yield rows.getvalue()
 
 
 
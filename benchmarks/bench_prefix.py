@@ -0,0 +1,101 @@
+# Micro-benchmark of the Prefix type against ipaddress networks: parsing, breaking a subnet, and utilization,
+# with the time of each, and the memory blocks allocated by the call and still held by its result (tracemalloc snapshots).
+# Run from the repository root:
+#   python -m benchmarks.bench_prefix [--count 100000] [--break-prefix 10.16.0.0/12] [--break-length 28]
+
+import argparse
+import ipaddress
+import time
+import tracemalloc
+
+from prefix import Prefix
+from benchmarks.bench_utilization import MAIN_SUBNET, generate_routes
+from utils import get_covered_addresses
+
+
+def parse_ipaddress(routes):
+    return [ipaddress.ip_network(route) for route in routes]
+
+
+def parse_prefix(routes):
+    return [Prefix.parse(route) for route in routes]
+
+
+def break_ipaddress(main_subnet, prefixlen):
+    return [str(subnet) for subnet in ipaddress.ip_network(main_subnet).subnets(new_prefix=prefixlen)]
+
+
+def break_prefix(main_subnet, prefixlen):
+    return [str(subnet) for subnet in Prefix.parse(main_subnet).subnets(prefixlen)]
+
+
+# The utilization cases return the parsed routes with the utilization, like parse_routes then get_subnet_utilization
+def utilization_ipaddress(main_subnet, routes):
+    main = ipaddress.ip_network(main_subnet)
+    networks = parse_ipaddress(routes)
+    intervals = []
+    for network in networks:
+        if network.prefixlen > main.prefixlen:
+            intervals.append((int(network.network_address), int(network.broadcast_address) + 1))
+    return round((get_covered_addresses(intervals) / main.num_addresses) * 100,2), networks
+
+
+def utilization_prefix(main_subnet, routes):
+    main = Prefix.parse(main_subnet)
+    prefixes = parse_prefix(routes)
+    intervals = []
+    for prefix in prefixes:
+        if prefix.prefixlen > main.prefixlen:
+            intervals.append((prefix.address, prefix.address + prefix.size))
+    return round((get_covered_addresses(intervals) / main.size) * 100,2), prefixes
+
+
+def measured(function, *args):
+    # Time of one call, then the allocations of a second call: the blocks allocated between two tracemalloc snapshots
+    # and still alive, held by the result. Tracing slows the code down too much to time it.
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    del result
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = function(*args)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    statistics = after.compare_to(before, "filename")
+    blocks = sum(statistic.count_diff for statistic in statistics)
+    size = sum(statistic.size_diff for statistic in statistics)
+    return result, elapsed, blocks, size
+
+
+def report(name, ipaddress_case, prefix_case, key=None):
+    # key converts the results of both implementations to comparable values
+    ipaddress_result, ipaddress_time, ipaddress_blocks, ipaddress_size = measured(*ipaddress_case)
+    prefix_result, prefix_time, prefix_blocks, prefix_size = measured(*prefix_case)
+    if key:
+        ipaddress_result, prefix_result = key(ipaddress_result), key(prefix_result)
+    assert ipaddress_result == prefix_result
+    print(f"{name:>12} {ipaddress_time:>12.4f} {prefix_time:>12.4f} {ipaddress_time / prefix_time:>8.1f}x "
+          f"{ipaddress_blocks:>14} {prefix_blocks:>14} {ipaddress_size / 2**20:>12.1f} {prefix_size / 2**20:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100000, help="number of routes parsed and used for utilization")
+    parser.add_argument("--break-prefix", default=MAIN_SUBNET)
+    parser.add_argument("--break-length", type=int, default=28)
+    args = parser.parse_args()
+
+    routes = generate_routes(args.count)
+
+    print(f"{'case':>12} {'ipaddress (s)':>12} {'Prefix (s)':>12} {'speedup':>9} {'ipaddr blocks':>14} {'Prefix blocks':>14} "
+          f"{'ipaddr (MiB)':>12} {'Prefix (MiB)':>12}")
+    report("parse", (parse_ipaddress, routes), (parse_prefix, routes), key=lambda result: [str(prefix) for prefix in result])
+    report("break", (break_ipaddress, args.break_prefix, args.break_length), (break_prefix, args.break_prefix, args.break_length))
+    report("utilization", (utilization_ipaddress, MAIN_SUBNET, routes), (utilization_prefix, MAIN_SUBNET, routes),
+           key=lambda result: (result[0], [str(prefix) for prefix in result[1]]))
+
+
+if __name__ == "__main__":
+    main()
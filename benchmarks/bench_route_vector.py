@@ -0,0 +1,52 @@
+# Benchmark of the route scan utilization on large "longer-prefixes" outputs: NumPy path against the pure Python
+# path (parse_routes then get_subnet_utilization). Needs NumPy installed.
+# Run from the repository root:
+#   python -m benchmarks.bench_route_vector [--sizes 10000 100000 500000]
+
+import argparse
+import random
+import time
+
+from route_vector import get_route_utilization
+from utils import get_subnet_utilization, parse_routes
+
+MAIN_SUBNET = "10.0.0.0/8"
+
+
+def generate_output(count, seed=0):
+    # Cisco like "show ip route ... longer-prefixes" output with count routes (/20 to /30) under MAIN_SUBNET
+    rnd = random.Random(seed)
+    lines = ["Gateway of last resort is not set", ""]
+    for _ in range(count):
+        prefixlen = rnd.randint(20, 30)
+        address = (10 << 24) + (rnd.randrange(0, 1 << 24) & ~((1 << (32 - prefixlen)) - 1))
+        lines.append(f"O        {address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}/{prefixlen} [110/20] via 10.255.0.1, 3d04h, GigabitEthernet0/0")
+    return "\n".join(lines)
+
+
+def python_utilization(main_subnet, output):
+    return get_subnet_utilization(main_subnet, parse_routes(output, 4))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 500000])
+    args = parser.parse_args()
+
+    print(f"{'routes':>10} {'python (s)':>12} {'numpy (s)':>12} {'speedup':>10}  utilization")
+    for size in args.sizes:
+        output = generate_output(size)
+        python_result, python_time = timed(python_utilization, MAIN_SUBNET, output)
+        numpy_result, numpy_time = timed(get_route_utilization, MAIN_SUBNET, output)
+        assert python_result == numpy_result, (python_result, numpy_result)
+        print(f"{size:>10} {python_time:>12.4f} {numpy_time:>12.4f} {python_time / numpy_time:>9.1f}x  {numpy_result}")
+
+
+if __name__ == "__main__":
+    main()
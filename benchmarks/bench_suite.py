@@ -0,0 +1,198 @@
+# Benchmark suite of the IPAM operations on synthetic allocation trees (benchmarks/generator.py), with pytest-benchmark:
+# subnet add, break and delete through the API, utilization, break generation, route output parsing, and the home and
+# subnet detail page renders (view cache disabled). The application runs on mongomock, or on a MongoDB server.
+#
+# Run from the repository root (pip install pytest-benchmark mongomock-motor):
+#   SECRET_KEY=0123456789012345 python -m pytest benchmarks/bench_suite.py --benchmark-autosave
+#
+#   BENCH_TREE_SIZES    subnets of the generated trees, "1000,10000" by default, up to "1000,10000,100000,1000000"
+#   BENCH_ROUTE_COUNTS  routes of the parsed router outputs, "10000,100000" by default
+#   BENCH_ROUNDS        rounds of the add, break and delete benchmarks, 20 by default
+#   BENCH_MONGO_URI     MongoDB server to use instead of mongomock, its ipam_benchmark database is dropped and filled
+#
+# mongomock has no indexes and scans the collection on every query: it tracks the application code, a local mongod
+# (BENCH_MONGO_URI=mongodb://localhost:27017) is needed for the database cost and for the trees of 100000 subnets and more.
+#
+# Autosaved runs are kept in .benchmarks/ with their commit id, so the results are tracked across commits.
+# Compare a run with the last saved one and fail on a mean 15% slower:
+#   SECRET_KEY=0123456789012345 python -m pytest benchmarks/bench_suite.py --benchmark-compare --benchmark-compare-fail=mean:15%
+# List the saved runs side by side:
+#   pytest-benchmark compare --group-by=group,param
+
+import contextlib
+import os
+import random
+import types
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+import Main
+from benchmarks.bench_route_vector import MAIN_SUBNET, generate_output
+from benchmarks.generator import generate_allocation_tree, load_allocation_tree
+from subnet_trie import SubnetTrie
+from utils import get_break_subnet, get_route_scan_result, get_subnet_utilization, parse_routes
+from view_cache import ViewCache
+
+pytest.importorskip("pytest_benchmark")
+
+TREE_SIZES = [int(size) for size in os.getenv("BENCH_TREE_SIZES", "1000,10000").split(",")]
+ROUTE_COUNTS = [int(count) for count in os.getenv("BENCH_ROUTE_COUNTS", "10000,100000").split(",")]
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "20"))
+MONGO_URI = os.getenv("BENCH_MONGO_URI", "")
+BENCH_DB = "ipam_benchmark"
+
+
+class MongoMockCollection:
+    # mongomock collection running the bulk writes one update at a time, mongomock doesn't take the UpdateOne of pymongo 4.9+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            await self.collection.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+
+
+def open_database():
+    # Return the synchronous database loading the tree, and the database of the application, on the same data
+    if MONGO_URI:
+        return MongoClient(MONGO_URI)[BENCH_DB], AsyncIOMotorClient(MONGO_URI)[BENCH_DB]
+
+    mongomock = pytest.importorskip("mongomock")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    client = mongomock.MongoClient()
+    return client[BENCH_DB], mongomock_motor.AsyncMongoMockClient(mock_mongo_client=client)[BENCH_DB]
+
+
+@pytest.fixture(scope="module", params=TREE_SIZES, ids=lambda size: f"tree{size}")
+def ipam(request):
+    # The application started on a generated tree of request.param subnets
+    sync_db, db = open_database()
+    sync_db.client.drop_database(BENCH_DB)
+    load_allocation_tree(sync_db.subnets, generate_allocation_tree(request.param))
+
+    collection = db.subnets if MONGO_URI else MongoMockCollection(db.subnets)
+    # mongomock has no time series collections, the scan history is not benchmarked
+    scan_history = contextlib.nullcontext() if MONGO_URI else patch("Main.ensure_scan_history", AsyncMock())
+
+    with patch("Main.db", db), patch("Main.collection", collection), patch("Main.router_collection", db.routers), \
+            patch("Main.scan_history_collection", db.scan_history), patch("Main.subnet_index", SubnetTrie()), \
+            patch("Main.view_cache", ViewCache(ttl=0)), scan_history, TestClient(Main.app) as client:
+        subnets = list(sync_db.subnets.find({}, {"_id": 0, "subnet_prefix": 1, "subnet_root": 1}))
+        yield types.SimpleNamespace(client=client, subnets=sync_db.subnets, prefixes=[subnet['subnet_prefix'] for subnet in subnets],
+                                    roots=sorted({subnet['subnet_root'] for subnet in subnets}), rnd=random.Random(0))
+
+
+def find_free_subnet(ipam, prefixlen):
+    # (upper subnet, free block of length prefixlen inside it) under a random subnet of the tree,
+    # so that the new subnets land at every depth of the hierarchy
+    while True:
+        upper_subnet_prefix = ipam.rnd.choice(ipam.prefixes)
+        if int(upper_subnet_prefix.split("/")[1]) >= prefixlen:
+            continue
+        block = Main.subnet_index.find_free_block(upper_subnet_prefix, prefixlen)
+        if block is not None:
+            return upper_subnet_prefix, block
+
+
+def add_subnet(ipam, upper_subnet_prefix, subnet_prefix):
+    subnet_id, subnet_mask = subnet_prefix.split("/")
+    subnet = {"subnet_prefix": subnet_prefix, "subnet_id": subnet_id, "subnet_mask": subnet_mask,
+              "subnet_name": "Benchmark", "subnet_service": "Internet", "subnet_description": ""}
+    response = ipam.client.post(f"/subnets/{upper_subnet_prefix.replace('/', '-')}/add-subnet", json=subnet)
+    assert response.status_code == 200, response.text
+
+
+def break_subnet(ipam, subnet_prefix, break_prefixlen):
+    response = ipam.client.put("/break_subnet/", json={"subnet_prefix": subnet_prefix, "break_prefixlen": break_prefixlen})
+    assert response.status_code == 200, response.text
+
+
+def delete_subnets(ipam, ids):
+    response = ipam.client.request("DELETE", "/subnets/", json=ids)
+    assert response.status_code == 200, response.text
+    assert all(result["deleted"] for result in response.json()["results"])
+
+
+# ✅ Benchmark: add a /28 inside a random subnet of the tree
+@pytest.mark.benchmark(group="add_subnet")
+def test_add_subnet(benchmark, ipam):
+    benchmark.pedantic(add_subnet, setup=lambda: ((ipam, *find_free_subnet(ipam, 28)), {}), rounds=ROUNDS, iterations=1)
+
+
+# ✅ Benchmark: break a new /24 into 16 /28
+@pytest.mark.benchmark(group="break_subnet")
+def test_break_subnet(benchmark, ipam):
+    def setup():
+        upper_subnet_prefix, subnet_prefix = find_free_subnet(ipam, 24)
+        add_subnet(ipam, upper_subnet_prefix, subnet_prefix)
+        return (ipam, subnet_prefix, 28), {}
+
+    benchmark.pedantic(break_subnet, setup=setup, rounds=ROUNDS, iterations=1)
+
+
+# ✅ Benchmark: delete a broken /24 with its 16 /28 in one request
+@pytest.mark.benchmark(group="delete_subnets")
+def test_delete_subnets(benchmark, ipam):
+    def setup():
+        upper_subnet_prefix, subnet_prefix = find_free_subnet(ipam, 24)
+        add_subnet(ipam, upper_subnet_prefix, subnet_prefix)
+        break_subnet(ipam, subnet_prefix, 28)
+        query = {"$or": [{"subnet_prefix": subnet_prefix}, {"subnet_parent": subnet_prefix}]}
+        return (ipam, [str(subnet["_id"]) for subnet in ipam.subnets.find(query, {"_id": 1})]), {}
+
+    benchmark.pedantic(delete_subnets, setup=setup, rounds=ROUNDS, iterations=1)
+
+
+# ✅ Benchmark: utilization of a /8 root from all the subnets under it
+@pytest.mark.benchmark(group="get_subnet_utilization")
+def test_get_subnet_utilization(benchmark, ipam):
+    root_subnet = ipam.roots[0]
+    subnet_prefixes = [subnet['subnet_prefix'] for subnet in ipam.subnets.find({"subnet_root": root_subnet}, {"subnet_prefix": 1})]
+    benchmark(get_subnet_utilization, root_subnet, subnet_prefixes)
+
+
+# ✅ Benchmark: home page, the major subnets
+@pytest.mark.benchmark(group="render")
+def test_home_page(benchmark, ipam):
+    response = benchmark(ipam.client.get, "/")
+    assert response.status_code == 200
+
+
+# ✅ Benchmark: detail page of a /8 root, first page of its children
+@pytest.mark.benchmark(group="render")
+def test_subnet_detail_page(benchmark, ipam):
+    response = benchmark(ipam.client.get, f"/subnets/{ipam.roots[0].replace('/', '-')}")
+    assert response.status_code == 200
+
+
+# ✅ Benchmark: generate the children of a /8 break
+@pytest.mark.benchmark(group="get_break_subnet")
+@pytest.mark.parametrize("break_prefixlen", [20, 24])
+def test_get_break_subnet(benchmark, break_prefixlen):
+    subnets = benchmark(lambda: list(get_break_subnet("10.0.0.0/8", break_prefixlen)))
+    assert len(subnets) == 1 << (break_prefixlen - 8)
+
+
+# ✅ Benchmark: route scan result of a large "show ip route ... longer-prefixes" output
+@pytest.mark.benchmark(group="route_scan")
+@pytest.mark.parametrize("count", ROUTE_COUNTS)
+def test_route_scan_result(benchmark, count):
+    output = generate_output(count)
+    result = benchmark(get_route_scan_result, MAIN_SUBNET, output)
+    assert result["status"] is True
+
+
+# ✅ Benchmark: routes extracted from a large router output
+@pytest.mark.benchmark(group="route_scan")
+@pytest.mark.parametrize("count", ROUTE_COUNTS)
+def test_parse_routes(benchmark, count):
+    output = generate_output(count)
+    routes = benchmark(parse_routes, output, 4)
+    assert len(routes) == count
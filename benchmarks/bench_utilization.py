@@ -0,0 +1,76 @@
+# Micro-benchmark of get_subnet_utilization: interval merge against the previous nested subnet_of loop.
+# Run from the repository root:
+#   python -m benchmarks.bench_utilization [--sizes 1000 10000 100000] [--legacy-max 10000]
+
+import argparse
+import ipaddress
+import random
+import time
+
+from utils import get_subnet_utilization
+
+MAIN_SUBNET = "10.16.0.0/12"
+
+
+def legacy_get_subnet_utilization(main_subnet, subnet_dict):
+    # Previous implementation, kept here as the reference for speed and results.
+    main_subnet = ipaddress.ip_network(main_subnet)
+    main_subnet_total_ips = main_subnet.num_addresses
+
+    subnet_list = [ipaddress.ip_network(subnet) for subnet in subnet_dict if ipaddress.ip_network(subnet).prefixlen > main_subnet.prefixlen]
+
+    utilized_ips = 0
+    for subnet in subnet_list:
+        pass_subnet = True
+        for item in subnet_list:
+            if subnet.subnet_of(item) and subnet!=item:
+                pass_subnet = False
+                break
+
+        if pass_subnet:
+            utilized_ips += subnet.num_addresses
+
+    return round((utilized_ips / main_subnet_total_ips) * 100,2)
+
+
+def generate_routes(count, seed=0):
+    # Unique more specific routes (/20 to /30) under MAIN_SUBNET, like a "longer-prefixes" output. Some of them nest.
+    rnd = random.Random(seed)
+    main = ipaddress.IPv4Network(MAIN_SUBNET)
+    base = int(main.network_address)
+    routes = set()
+    while len(routes) < count:
+        prefixlen = rnd.randint(20, 30)
+        size = 1 << (32 - prefixlen)
+        start = base + rnd.randrange(0, main.num_addresses, size)
+        routes.add(f"{ipaddress.IPv4Address(start)}/{prefixlen}")
+    return sorted(routes)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--legacy-max", type=int, default=10000, help="skip the quadratic implementation above this size")
+    args = parser.parse_args()
+
+    print(f"{'prefixes':>10} {'merge (s)':>12} {'legacy (s)':>12} {'speedup':>10}  utilization")
+    for size in args.sizes:
+        routes = generate_routes(size)
+        utilization, merge_time = timed(get_subnet_utilization, MAIN_SUBNET, routes)
+
+        if size <= args.legacy_max:
+            legacy_utilization, legacy_time = timed(legacy_get_subnet_utilization, MAIN_SUBNET, routes)
+            assert legacy_utilization == utilization, (legacy_utilization, utilization)
+            print(f"{size:>10} {merge_time:>12.4f} {legacy_time:>12.4f} {legacy_time / merge_time:>9.0f}x  {utilization}")
+        else:
+            print(f"{size:>10} {merge_time:>12.4f} {'skipped':>12} {'-':>10}  {utilization}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# Synthetic allocation trees for the benchmarks: /8 roots split into hierarchies 5 to 10 levels deep (regions, sites,
+# buildings, ... down to /24 to /30 segments), from a thousand to a million subnets. The subnet documents have the
+# fields written by the application, covered addresses and utilization included, so they are loaded as they are.
+#
+# Fill a local MongoDB with a tree, run from the repository root:
+#   python -m benchmarks.generator --count 100000 [--roots 4] [--mongo-uri mongodb://localhost:27017] [--db ipam_benchmark]
+
+import argparse
+import math
+import random
+from pymongo import MongoClient
+
+from db_schema import get_network_fields
+from prefix import Prefix
+
+LEVEL_NAMES = ["Block", "Region", "Area", "Site", "Building", "Floor", "Room", "Rack", "Segment", "Link"]
+SERVICES = ["Internet", "Data center", "Voice", "Management", "Wireless", "Transit"]
+
+
+def get_level_prefixlens(rnd, min_depth, max_depth):
+    # Prefix lengths of the levels of one root: the /8, the intermediate levels, and a /24 to /30 last level
+    depth = rnd.randint(min_depth, max_depth)
+    return [8] + sorted(rnd.sample(range(9, 24), depth - 2)) + [rnd.randint(24, 30)]
+
+
+def get_subnet_document(prefix, root_subnet, parent_subnet, level, number, covered_addresses, rnd):
+    subnet_prefix = str(prefix)
+    return {
+        "subnet_prefix": subnet_prefix,
+        "subnet_id": prefix.network_address,
+        "subnet_mask": str(prefix.prefixlen),
+        "subnet_root": root_subnet,
+        "subnet_parent": parent_subnet,
+        "subnet_name": f"{LEVEL_NAMES[level]} {number}",
+        "subnet_service": rnd.choice(SERVICES),
+        "subnet_description": "",
+        "offline_utilization": round((covered_addresses / prefix.size) * 100,2),
+        "covered_addresses": covered_addresses,
+        "online_status": "",
+        "online_utilization": 0.00,
+        **get_network_fields(subnet_prefix)
+    }
+
+
+def generate_root(root, budget, levels, rnd):
+    # Generate up to budget documents under the root, level by level. Every subnet gets about the same number of
+    # children, chosen so that the budget is spent on the last level. A subnet is generated with its children.
+    root_subnet = str(root)
+    frontier = [(root, "")]
+    remaining = budget - 1
+    for level, prefixlen in enumerate(levels[1:], 1):
+        available = 1 << (prefixlen - levels[level - 1])
+        remaining_levels = len(levels) - level
+        if remaining_levels == 1:
+            fanout = math.ceil(remaining / len(frontier)) if frontier else 0
+        else:
+            fanout = math.ceil((remaining / len(frontier)) ** (1 / remaining_levels)) if frontier else 0
+        fanout = max(0, min(fanout, available))
+
+        next_frontier = []
+        for number, (subnet, parent_subnet) in enumerate(frontier):
+            count = min(fanout, remaining)
+            remaining -= count
+            size = 1 << (32 - prefixlen)
+            children = [Prefix(subnet.address + index * size, prefixlen) for index in sorted(rnd.sample(range(available), count))]
+            yield get_subnet_document(subnet, root_subnet, parent_subnet, level - 1, number, count * size, rnd)
+            next_frontier.extend((child, str(subnet)) for child in children)
+        frontier = next_frontier
+
+    for number, (subnet, parent_subnet) in enumerate(frontier):
+        yield get_subnet_document(subnet, root_subnet, parent_subnet, len(levels) - 1, number, 0, rnd)
+
+
+def generate_allocation_tree(count, roots=4, min_depth=5, max_depth=10, seed=0):
+    # Generate count subnet documents over at least roots /8 roots, every subnet before its children.
+    # A root that can't hold its share of the subnets (a shallow hierarchy) leaves the rest to an additional root.
+    rnd = random.Random(seed)
+    first_octets = rnd.sample([octet for octet in range(1, 224) if octet != 127], 222)
+    budget = math.ceil(count / roots)
+    generated = 0
+    for first_octet in first_octets:
+        if generated == count:
+            break
+        levels = get_level_prefixlens(rnd, min_depth, max_depth)
+        for document in generate_root(Prefix(first_octet << 24, 8), min(budget, count - generated), levels, rnd):
+            generated += 1
+            yield document
+
+    if generated < count:
+        raise ValueError(f"Can't generate {count} subnets under the /8 roots")
+
+
+def load_allocation_tree(collection, documents, batch_size=10000):
+    # Insert the documents with a pymongo (or mongomock) collection, return the number of inserted subnets
+    inserted = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batch_size:
+            collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a MongoDB database with a synthetic allocation tree.")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--roots", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="ipam_benchmark")
+    args = parser.parse_args()
+
+    collection = MongoClient(args.mongo_uri)[args.db].subnets
+    collection.drop()
+    inserted = load_allocation_tree(collection, generate_allocation_tree(args.count, args.roots, seed=args.seed))
+    print(f"{inserted} subnets inserted into {args.db}.subnets")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+from bson import Binary
+from prefix import Prefix
+from subnet_trie import SubnetTrie
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import CollectionInvalid, OperationFailure
+from utils import ENCRYPTED_PASSWORD_PREFIX, check_secret_key, decrypt_password, encrypt_password
+
+# Database schema bootstrap: indexes for the hot queries, and the numeric network fields of the subnets.
+# "net_start" and "net_end" are the first and the last address of the subnet as integers (binary for IPv6), so range
+# queries such as "every subnet inside 10.0.0.0/8" are served from the index. "net_version" is the address family (4 or 6):
+# MongoDB orders the integers before the binary values but never compares them in a range query, so the subnet lists sort
+# on the family first and the page cursors carry it.
+#
+# Migration of an existing database, run from the repository root:
+#   python db_schema.py [--mongo-uri mongodb://localhost:27017] [--db network_db]
+
+
+def get_network_fields(subnet_prefix):
+    prefix = Prefix.parse(subnet_prefix)
+    return {"net_version": prefix.version,
+            "net_start": encode_address(prefix.address, prefix.version),
+            "net_end": encode_address(prefix.last_address, prefix.version)}
+
+
+def encode_address(address, version=4):
+    # IPv6 addresses don't fit the 64 bits integers of MongoDB, they are stored as 16 bytes big endian binary.
+    # MongoDB compares binary values of the same length byte by byte, so the range queries and sorts keep working,
+    # and the IPv6 subnets sort after the IPv4 ones.
+    if version == 6:
+        return Binary(address.to_bytes(16, "big"))
+    return address
+
+
+def decode_address(value):
+    if isinstance(value, bytes):
+        return int.from_bytes(value, "big")
+    return value
+
+
+async def ensure_indexes(collection, router_collection):
+    await collection.create_index([("subnet_prefix", ASCENDING)], unique=True, name="subnet_prefix_unique")
+    # Serves the pages of the subnet lists, sorted on (net_version, net_start, net_end descending)
+    await collection.create_index([("subnet_parent", ASCENDING), ("net_version", ASCENDING), ("net_start", ASCENDING), ("net_end", DESCENDING)],
+                                  name="subnet_parent_net_range")
+    await collection.create_index([("subnet_root", ASCENDING)], name="subnet_root")
+    # Serves the range queries of one family, and the export order: a subnet before the subnets inside it (same start, smaller end)
+    await collection.create_index([("net_version", ASCENDING), ("net_start", ASCENDING), ("net_end", DESCENDING)], name="net_version_range")
+    await router_collection.create_index([("router_ip", ASCENDING)], unique=True, name="router_ip_unique")
+
+
+async def ensure_scan_history(db, name="scan_history", retention=90 * 24 * 3600):
+    # Scan results history, one record per subnet per scan. Stored as a time series collection (MongoDB 5.0+),
+    # bucketed per subnet, so the records are kept compressed. Older servers get a regular collection.
+    try:
+        await db.create_collection(name, timeseries={"timeField": "scanned_at", "metaField": "subnet_prefix", "granularity": "hours"},
+                                   expireAfterSeconds=retention)
+    except CollectionInvalid:
+        pass    # Already exists
+    except OperationFailure as e:
+        print(f"exception: {e}. Using a regular collection for the scan history.")
+        await db[name].create_index([("scanned_at", ASCENDING)], expireAfterSeconds=retention, name="scanned_at_ttl")
+
+    await db[name].create_index([("subnet_prefix", ASCENDING), ("scanned_at", ASCENDING)], name="subnet_prefix_scanned_at")
+
+
+async def backfill_network_fields(collection, batch_size=1000):
+    # Add net_version/net_start/net_end to the subnets created before these fields existed. Returns the number of updated subnets.
+    updated = 0
+    updates = []
+    async for subnet in collection.find({"net_version": {"$exists": False}}, {"subnet_prefix": 1}):
+        try:
+            network_fields = get_network_fields(subnet['subnet_prefix'])
+        except ValueError:
+            print(f"Skipping invalid subnet prefix: {subnet['subnet_prefix']}")
+            continue
+
+        updates.append(UpdateOne({"_id": subnet["_id"]}, {"$set": network_fields}))
+        if len(updates) == batch_size:
+            await collection.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        updated += len(updates)
+
+    return updated
+
+
+def format_covered_addresses(subnet_prefix, covered_addresses):
+    # IPv6 address counts don't fit MongoDB integers, they are always stored as decimal strings
+    if ":" in subnet_prefix:
+        return str(covered_addresses)
+    return covered_addresses
+
+
+async def backfill_covered_addresses(collection, subnet_index, batch_size=1000):
+    # Add covered_addresses to the subnets created before this field existed, counted by the subnet index.
+    # Returns the number of updated subnets.
+    updated = 0
+    updates = []
+    async for subnet in collection.find({"covered_addresses": {"$exists": False}}, {"subnet_prefix": 1}):
+        if subnet['subnet_prefix'] not in subnet_index:
+            continue
+
+        covered_addresses = format_covered_addresses(subnet['subnet_prefix'], subnet_index.covered(subnet['subnet_prefix']))
+        updates.append(UpdateOne({"_id": subnet["_id"]}, {"$set": {"covered_addresses": covered_addresses}}))
+        if len(updates) == batch_size:
+            await collection.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+        updated += len(updates)
+
+    return updated
+
+
+async def load_subnet_index(collection):
+    subnet_index = SubnetTrie()
+    async for subnet in collection.find({}, {"subnet_prefix": 1, "subnet_root": 1}):
+        subnet_index.insert(subnet['subnet_prefix'], subnet['subnet_root'])
+    return subnet_index
+
+
+async def reencrypt_router_passwords(router_collection):
+    # Router passwords encrypted without the EAX tag are encrypted again with it, so they are verified on decryption
+    updated = 0
+    async for router in router_collection.find({"router_password": {"$not": {"$regex": f"^{ENCRYPTED_PASSWORD_PREFIX}"}}}, {"router_password": 1}):
+        try:
+            password = decrypt_password(router['router_password'])
+        except ValueError:
+            print(f"Can't decrypt the password of router {router['_id']}, check SECRET_KEY")
+            continue
+
+        await router_collection.update_one({"_id": router["_id"]}, {"$set": {"router_password": encrypt_password(password)}})
+        updated += 1
+    return updated
+
+
+async def find_duplicate_prefixes(collection):
+    # Duplicate subnet prefixes prevent the unique index from being created
+    pipeline = [
+        {"$group": {"_id": "$subnet_prefix", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    return [group["_id"] async for group in collection.aggregate(pipeline)]
+
+
+async def bootstrap_schema(collection, router_collection):
+    # Called on application startup. A database that can't get its indexes yet (duplicates) still starts.
+    await backfill_network_fields(collection)
+    try:
+        await ensure_indexes(collection, router_collection)
+    except OperationFailure as e:
+        print(f"exception: {e}. Run 'python db_schema.py' to migrate the database.")
+
+
+async def migrate(mongo_uri, db_name):
+    db = AsyncIOMotorClient(mongo_uri)[db_name]
+
+    updated = await backfill_network_fields(db.subnets)
+    print(f"Backfilled network fields of {updated} subnets")
+
+    updated = await backfill_covered_addresses(db.subnets, await load_subnet_index(db.subnets))
+    print(f"Backfilled covered addresses of {updated} subnets")
+
+    try:
+        check_secret_key()
+    except ValueError as e:
+        print(f"{e} Router passwords are not encrypted again.")
+    else:
+        updated = await reencrypt_router_passwords(db.routers)
+        print(f"Encrypted again the passwords of {updated} routers")
+
+    duplicates = await find_duplicate_prefixes(db.subnets)
+    if duplicates:
+        print("Duplicate subnet prefixes must be removed before creating the unique index:")
+        for subnet_prefix in duplicates:
+            print(f"  {subnet_prefix}")
+        return False
+
+    await ensure_indexes(db.subnets, db.routers)
+    await ensure_scan_history(db)
+    print("Indexes created")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the IPAM database indexes and backfill the subnet network fields.")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="network_db")
+    args = parser.parse_args()
+
+    if not asyncio.run(migrate(args.mongo_uri, args.db)):
+        raise SystemExit(1)
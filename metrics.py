@@ -0,0 +1,259 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import math
+import threading
+import time
+from pymongo import monitoring
+
+# In-process metrics of the service, served at /metrics in the Prometheus text format.
+# Counters and histograms keep one series per combination of label values, created on first use. The router calls run
+# on the scan worker threads, so every update takes the lock of its metric.
+#
+# The hot paths are timed with timed(histogram, **labels), as a context manager:
+#     with timed(ROUTER_SECONDS, vendor=router_vendor, router=hostname, stage="command"):
+# or as a decorator of a function or a coroutine function:
+#     @timed(OPERATION_SECONDS, operation="get_subnet_utilization")
+#
+# MetricsMiddleware times every request by route, and MongoCommandMetrics (a pymongo command listener) counts and times
+# the MongoDB commands of the request being served, so handlers running many queries per request stand out.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500, 1000)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    values = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, values)) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.series = {}    # label values -> value of the series
+        self.lock = threading.Lock()
+
+    def get_key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def get_samples(self):
+        # (name suffix, labels, value) of every series
+        with self.lock:
+            return [("", dict(zip(self.labelnames, key)), value) for key, value in sorted(self.series.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.get_samples():
+            lines.append(f"{self.name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Observations per bucket (not cumulative), sum, count
+                series = self.series[key] = [[0] * len(self.buckets), 0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def get_samples(self):
+        with self.lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self.series.items())]
+
+        samples = []
+        for key, counts, total, count in series:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", {**labels, "le": format_value(float(bound))}, cumulative))
+            samples.append(("_bucket", {**labels, "le": "+Inf"}, count))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class CallbackMetric(Metric):
+    # Value read from the application when the metrics are rendered: function() returns {label values: value}
+    def __init__(self, name, help, labelnames, function, type="gauge"):
+        super().__init__(name, help, labelnames)
+        self.function = function
+        self.type = type
+
+    def get_samples(self):
+        return [("", dict(zip(self.labelnames, key)), value) for key, value in sorted(self.function().items())]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, labelnames, function, type="gauge"):
+        return self.register(CallbackMetric(name, help, labelnames, function, type))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+class Timer:
+    # Observe the duration of the block, or of every call of the decorated function, in seconds
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+    def __call__(self, function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with Timer(self.histogram, self.labels):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Timer(self.histogram, self.labels):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+def timed(histogram, **labels):
+    return Timer(histogram, labels)
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram("ipam_http_request_duration_seconds", "HTTP request latency by route.", ["handler", "method", "status"])
+MONGO_COMMAND_SECONDS = registry.histogram("ipam_mongo_command_duration_seconds", "MongoDB command latency by handler and command.", ["handler", "command"])
+MONGO_COMMAND_FAILURES = registry.counter("ipam_mongo_command_failures_total", "Failed MongoDB commands by handler and command.", ["handler", "command"])
+MONGO_COMMANDS_PER_REQUEST = registry.histogram("ipam_mongo_commands_per_request", "MongoDB commands run by one request, by route.", ["handler"], COUNT_BUCKETS)
+ROUTER_SECONDS = registry.histogram("ipam_router_duration_seconds", "Router connect, command and output parsing time.", ["vendor", "router", "stage"])
+ROUTER_CALLS = registry.counter("ipam_router_calls_total", "Router scans and connection tests by outcome.", ["call", "vendor", "router", "outcome"])
+SUBNET_SCANS = registry.counter("ipam_subnet_scans_total", "Subnet scans by outcome, after the failover between the routers.", ["outcome"])
+OPERATION_SECONDS = registry.histogram("ipam_operation_duration_seconds", "Time of the subnet tree and utilization operations.", ["operation"])
+
+
+# Metrics of the request being served, shared with the MongoDB command listener through a context variable
+class RequestMetrics:
+    __slots__ = ("scope", "mongo_commands", "lock")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.mongo_commands = 0
+        self.lock = threading.Lock()    # Motor runs the commands of one request on several threads
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def get_handler(scope):
+    # Route path template, such as "/subnets/{subnet_id}-{subnet_mask}", so the label values stay bounded
+    route = scope.get("route")
+    return getattr(route, "path", "other")
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request = RequestMetrics(scope)
+        token = current_request.set(request)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            handler = get_handler(scope)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, handler=handler, method=scope["method"], status=status)
+            MONGO_COMMANDS_PER_REQUEST.observe(request.mongo_commands, handler=handler)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    # Commands run outside of a request (background jobs, startup) are counted under the "background" handler
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.record(event)
+
+    def failed(self, event):
+        self.record(event, failed=True)
+
+    def record(self, event, failed=False):
+        request = current_request.get()
+        if request is None:
+            handler = "background"
+        else:
+            handler = get_handler(request.scope)
+            with request.lock:
+                request.mongo_commands += 1
+
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, handler=handler, command=event.command_name)
+        if failed:
+            MONGO_COMMAND_FAILURES.inc(handler=handler, command=event.command_name)
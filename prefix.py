@@ -0,0 +1,114 @@
+import ipaddress
+
+# Lightweight IP prefix: an integer network address and a prefix length, without the ipaddress objects.
+# Used inside the service wherever many prefixes are parsed, compared or generated (subnet index, utilization, break,
+# import). Prefixes are converted back to strings only when written to the database or returned by the API.
+
+
+def parse_ipv4_address(address):
+    # Same rules as ipaddress: four decimal octets, no leading zeros
+    octets = address.split(".")
+    if len(octets) != 4:
+        raise ValueError(f"Invalid IPv4 address: {address}")
+
+    value = 0
+    for octet in octets:
+        if not octet.isdigit() or not octet.isascii() or len(octet) > 3 or (len(octet) > 1 and octet[0] == "0"):
+            raise ValueError(f"Invalid IPv4 address: {address}")
+        octet = int(octet)
+        if octet > 255:
+            raise ValueError(f"Invalid IPv4 address: {address}")
+        value = (value << 8) | octet
+    return value
+
+
+def format_ipv4_address(address):
+    return f"{address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}"
+
+
+class Prefix:
+    __slots__ = ("address", "prefixlen", "max_prefixlen")
+
+    def __init__(self, address, prefixlen, max_prefixlen=32):
+        self.address = address
+        self.prefixlen = prefixlen
+        self.max_prefixlen = max_prefixlen  # 32 for IPv4, 128 for IPv6
+
+    @classmethod
+    def parse(cls, prefix, strict=False):
+        # Parse "address/len" (the whole address without /len). With strict=False the host bits are cleared,
+        # otherwise a prefix with host bits set is refused like ipaddress does.
+        if isinstance(prefix, Prefix):
+            return prefix
+
+        address, slash, prefixlen = prefix.strip().partition("/")
+        if ":" in address:
+            max_prefixlen = 128
+            address = int(ipaddress.IPv6Address(address))
+        else:
+            max_prefixlen = 32
+            address = parse_ipv4_address(address)
+
+        if not slash:
+            prefixlen = max_prefixlen
+        elif prefixlen.isdigit() and prefixlen.isascii():
+            prefixlen = int(prefixlen)
+        else:
+            raise ValueError(f"Invalid prefix length: {prefixlen}")
+        if prefixlen > max_prefixlen:
+            raise ValueError(f"Invalid prefix length: {prefixlen}")
+
+        network_address = address & ~((1 << (max_prefixlen - prefixlen)) - 1)
+        if strict and network_address != address:
+            raise ValueError(f"{prefix} has host bits set")
+        return cls(network_address, prefixlen, max_prefixlen)
+
+    @property
+    def version(self):
+        return 4 if self.max_prefixlen == 32 else 6
+
+    @property
+    def size(self):
+        return 1 << (self.max_prefixlen - self.prefixlen)
+
+    @property
+    def last_address(self):
+        return self.address + self.size - 1
+
+    @property
+    def network_address(self):
+        if self.max_prefixlen == 32:
+            return format_ipv4_address(self.address)
+        return str(ipaddress.IPv6Address(self.address))
+
+    def __str__(self):
+        return f"{self.network_address}/{self.prefixlen}"
+
+    def __repr__(self):
+        return f"Prefix('{self}')"
+
+    def __eq__(self, other):
+        return isinstance(other, Prefix) and (self.address, self.prefixlen, self.max_prefixlen) == (other.address, other.prefixlen, other.max_prefixlen)
+
+    def __hash__(self):
+        return hash((self.address, self.prefixlen, self.max_prefixlen))
+
+    def __lt__(self, other):
+        return (self.max_prefixlen, self.address, self.prefixlen) < (other.max_prefixlen, other.address, other.prefixlen)
+
+    def contains(self, other):
+        return (self.max_prefixlen == other.max_prefixlen and self.prefixlen <= other.prefixlen
+                and self.address <= other.address and other.last_address <= self.last_address)
+
+    def count_subnets(self, prefixlen):
+        return 1 << (prefixlen - self.prefixlen)
+
+    def subnets(self, prefixlen, start=0, stop=None):
+        # Generate the subnets of length prefixlen, from the start-th one up to the stop-th one excluded
+        if not self.prefixlen <= prefixlen <= self.max_prefixlen:
+            raise ValueError(f"Invalid prefix length: {prefixlen}")
+
+        step = 1 << (self.max_prefixlen - prefixlen)
+        stop = self.count_subnets(prefixlen) if stop is None else min(stop, self.count_subnets(prefixlen))
+        for index in range(start, stop):
+            yield Prefix(self.address + index * step, prefixlen, self.max_prefixlen)
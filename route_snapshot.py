@@ -0,0 +1,89 @@
+import time
+from array import array
+from bisect import bisect_left
+from prefix import Prefix
+from utils import prefix_to_interval, get_covered_addresses, get_route_table_output, parse_routes, run_on_router
+from metrics import ROUTER_SECONDS, timed
+
+# Snapshot of a router's full routing tables, used to scan many subnets with one router command.
+# Routes are kept per IP version as sorted parallel arrays of network address and prefix length, so the routes under
+# a subnet are found with a binary search, and the subnet status and utilization are computed locally.
+# IPv6 addresses don't fit a typed array, they are kept in a sorted list of integers.
+
+
+class RouteSnapshot:
+    def __init__(self, routes):
+        intervals = {32: set(), 128: set()}
+        for route in routes:
+            try:
+                route = Prefix.parse(route)
+            except ValueError:
+                continue
+            intervals[route.max_prefixlen].add((route.address, route.prefixlen))
+
+        self.starts = {}
+        self.prefixlens = {}
+        for max_prefixlen, family_intervals in intervals.items():
+            family_intervals = sorted(family_intervals)
+            starts = [start for start, prefixlen in family_intervals]
+            self.starts[max_prefixlen] = array("I", starts) if max_prefixlen == 32 else starts
+            self.prefixlens[max_prefixlen] = array("B", [prefixlen for start, prefixlen in family_intervals])
+        self.created = time.monotonic()
+
+    def __len__(self):
+        return sum(len(starts) for starts in self.starts.values())
+
+    def lookup(self, subnet_prefix):
+        # The routes equal to or more specific than the subnet make it Active, the more specific ones give its online
+        # utilization. Unlike route_scan, which reports Active for any non-empty command output, a subnet without
+        # such a route is Inactive: the IOS longer-prefixes output always carries the codes header, so route_scan
+        # reports an IOS subnet without routes as Active while the snapshot reports it Inactive.
+        start, end, prefixlen = prefix_to_interval(subnet_prefix)
+        max_prefixlen = 128 if ":" in subnet_prefix else 32
+        starts = self.starts[max_prefixlen]
+        prefixlens = self.prefixlens[max_prefixlen]
+
+        active = False
+        intervals = []
+        for i in range(bisect_left(starts, start), bisect_left(starts, end)):
+            route_prefixlen = prefixlens[i]
+            if route_prefixlen < prefixlen:
+                continue
+
+            active = True
+            if route_prefixlen > prefixlen:
+                route_start = starts[i]
+                intervals.append((route_start, route_start + (1 << (max_prefixlen - route_prefixlen))))
+
+        if not active:
+            return {"online_status": "Inactive", "online_utilization": 0.00}
+
+        utilization = round((get_covered_addresses(intervals) / (end - start)) * 100,2)
+        return {"online_status": "Active", "online_utilization": utilization}
+
+
+class RouteSnapshotCache:
+    def __init__(self, ttl=300):
+        self.ttl = ttl    # Snapshots older than this number of seconds are pulled again from the router
+        self.snapshots = {}
+
+    def get(self, router_id):
+        snapshot = self.snapshots.get(router_id)
+        if snapshot is None or time.monotonic() - snapshot.created >= self.ttl:
+            return None
+        return snapshot
+
+    def put(self, router_id, snapshot):
+        self.snapshots[router_id] = snapshot
+
+    def invalidate(self, router_id=None):
+        if router_id is None:
+            self.snapshots.clear()
+        else:
+            self.snapshots.pop(router_id, None)
+
+
+def route_table_snapshot(router_vendor, sessions=None, router_id=None, **device_info):
+    route_table = run_on_router(router_vendor, lambda device: get_route_table_output(device, router_vendor), sessions, router_id, **device_info)
+    with timed(ROUTER_SECONDS, vendor=router_vendor, router=device_info['hostname'], stage="parse"):
+        return RouteSnapshot(parse_routes(route_table))
@@ -0,0 +1,62 @@
+import re
+from prefix import Prefix
+from metrics import OPERATION_SECONDS, timed
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional, utils falls back to the pure Python path without it
+    numpy = None
+
+# Vectorized IPv4 route parsing and utilization for large router outputs (hundreds of thousands of routes).
+# The routes are extracted in one regex pass and their numbers converted in one NumPy call into uint32 network
+# addresses and prefix lengths. The covered addresses are computed with a sort and a running maximum,
+# instead of a Python object and an interval tuple per route. Results are the same as parse_routes and
+# get_subnet_utilization in utils.
+
+# Same routes as the IPv4 part of utils.ROUTE_PATTERN, restricted to valid octets (no leading zeros, up to 255)
+# so that no route rejected by ipaddress is kept. The leading lookahead lets the regex skip non digits quickly.
+OCTET = r"(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)"
+IPV4_ROUTE_PATTERN = re.compile(rf"(?=\d)(?<![\w:.]){OCTET}\.{OCTET}\.{OCTET}\.{OCTET}/\d{{1,2}}(?![\w:.])")
+
+
+def parse_ipv4_routes(route_list_str):
+    # Return the routes of a router output as (network addresses, prefix lengths) uint32 arrays, host bits cleared
+    routes = " ".join(IPV4_ROUTE_PATTERN.findall(route_list_str))
+    columns = numpy.fromstring(routes.replace(".", " ").replace("/", " "), dtype=numpy.uint32, sep=" ").reshape(-1, 5)
+    columns = columns[columns[:, 4] <= 32]
+    prefixlens = columns[:, 4]
+
+    addresses = (columns[:, 0] << 24) | (columns[:, 1] << 16) | (columns[:, 2] << 8) | columns[:, 3]
+    # 2**(32 - len) - 1 host mask, computed in 64 bits so that a /0 does not overflow
+    host_masks = ((numpy.uint64(1) << (32 - prefixlens).astype(numpy.uint64)) - numpy.uint64(1)).astype(numpy.uint32)
+    return addresses & ~host_masks, prefixlens
+
+
+def get_covered_addresses(starts, ends):
+    # Number of addresses covered by the union of [start, end) intervals
+    if not len(starts):
+        return 0
+
+    order = numpy.argsort(starts, kind="stable")
+    starts = starts[order]
+    ends = numpy.maximum.accumulate(ends[order])
+
+    # Every interval adds the part of it past the end of all the intervals starting before it
+    previous_ends = numpy.concatenate(([0], ends[:-1]))
+    return int(numpy.clip(ends - numpy.maximum(starts, previous_ends), 0, None).sum())
+
+
+@timed(OPERATION_SECONDS, operation="get_route_utilization")
+def get_route_utilization(main_subnet, route_list_str):
+    # Same result as get_subnet_utilization(main_subnet, parse_routes(route_list_str, 4)), for an IPv4 main subnet
+    main_prefixlen = Prefix.parse(main_subnet).prefixlen
+
+    addresses, prefixlens = parse_ipv4_routes(route_list_str)
+
+    # Only more specific subnets are counted
+    more_specific = prefixlens > main_prefixlen
+    starts = addresses[more_specific].astype(numpy.int64)
+    ends = starts + (numpy.int64(1) << (32 - prefixlens[more_specific].astype(numpy.int64)))
+
+    utilized_ips = get_covered_addresses(starts, ends)
+    return round((utilized_ips / (1 << (32 - main_prefixlen))) * 100,2)
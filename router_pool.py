@@ -0,0 +1,149 @@
+import itertools
+import time
+from utils import decrypt_password
+
+# Route sources (routers or route reflectors) used to scan the subnets.
+# The routers are loaded from the database and kept for a few seconds, so scans don't read them again for every subnet.
+# The password of a router is decrypted once and kept up to password_ttl seconds, reloads reuse it as long as the
+# encrypted password in the database is unchanged. Every router has a circuit breaker: after failure_threshold
+# failed calls in a row, the router is skipped without being contacted, until reset_timeout seconds have passed.
+# Then one caller gets a trial call (acquire), the router stays unavailable to the others until the trial ends.
+# A router whose password can't be decrypted (modified, or encrypted with another SECRET_KEY) is left out of the
+# pool, the other routers are still loaded.
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None  # Monotonic time the breaker opened at, None while closed
+        self.trial = None   # Monotonic time the half open trial call started at, None without a trial call
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return "closed"
+        if time.monotonic() - self.opened >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def trial_running(self):
+        # A trial call that never reported back is given up after reset_timeout seconds
+        return self.trial is not None and time.monotonic() - self.trial < self.reset_timeout
+
+    def available(self):
+        # Closed, or half open without a trial call running. The trial call itself is claimed with acquire()
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self.trial_running())
+
+    def acquire(self):
+        # Called right before calling the router. Half open: the caller gets the trial call, a success closes the
+        # breaker and a failure opens it again, the other callers are refused until then.
+        if not self.available():
+            return False
+        if self.state == "half-open":
+            self.trial = time.monotonic()
+        return True
+
+    def release(self):
+        # The call ended without a result (cancelled), the next caller gets the trial call
+        self.trial = None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened = None
+        self.trial = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial = None
+        if self.failures >= self.failure_threshold:
+            self.opened = time.monotonic()
+
+
+def get_router_id(router):
+    return str(router.get("_id", router['router_ip']))
+
+
+class RouteSource:
+    def __init__(self, router, breaker, password):
+        self.router = router
+        self.router_id = get_router_id(router)
+        self.router_vendor = router['router_vendor']
+        self.device_info = {"hostname": router['router_ip'], "username": router['router_username'], "password": password }
+        self.breaker = breaker
+
+
+class RouterPool:
+    def __init__(self, ttl=60, failure_threshold=3, reset_timeout=60, password_ttl=3600):
+        self.ttl = ttl  # Seconds the loaded routers are used before being read again from the database
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.password_ttl = password_ttl
+        self.sources = []
+        self.breakers = {}
+        self.passwords = {}  # router id -> (encrypted password, password, monotonic decryption time)
+        self.errors = {}     # router id -> why the router was left out of the pool
+        self.loaded = None
+        self.rotation = itertools.count()
+
+    def stale(self):
+        return self.loaded is None or time.monotonic() - self.loaded >= self.ttl
+
+    def invalidate(self, router_id=None):
+        # The routers are read again on the next use, and the password of router_id is decrypted again
+        self.loaded = None
+        if router_id is not None:
+            self.passwords.pop(router_id, None)
+
+    def get_password(self, router):
+        router_id = get_router_id(router)
+        cached = self.passwords.get(router_id)
+        if cached is None or cached[0] != router['router_password'] or time.monotonic() - cached[2] >= self.password_ttl:
+            cached = (router['router_password'], decrypt_password(router['router_password']), time.monotonic())
+            self.passwords[router_id] = cached
+        return cached[1]
+
+    def load(self, routers):
+        # The breakers and the passwords of the routers still configured are kept
+        breakers = {}
+        passwords = {}
+        errors = {}
+        sources = []
+        for router in routers:
+            router_id = get_router_id(router)
+            try:
+                password = self.get_password(router)
+            except ValueError as e:
+                print(f"exception: {e}. Skipping router {router['router_ip']}, its password can't be decrypted.")
+                errors[router_id] = "Router password can't be decrypted, please save it again"
+                continue
+
+            breakers[router_id] = self.breakers.get(router_id) or CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            sources.append(RouteSource(router, breakers[router_id], password))
+            passwords[router_id] = self.passwords[router_id]
+
+        self.sources = sources
+        self.breakers = breakers
+        self.passwords = passwords
+        self.errors = errors
+        self.loaded = time.monotonic()
+
+    def get(self, router_id):
+        for source in self.sources:
+            if source.router_id == router_id:
+                return source
+        return None
+
+    def available(self):
+        # Routers with a closed or half open breaker, in the configured order
+        return [source for source in self.sources if source.breaker.available()]
+
+    def spread(self):
+        # Available routers, starting from the next one in turn, so consecutive scans are spread over all the routers
+        sources = self.available()
+        if not sources:
+            return sources
+        start = next(self.rotation) % len(sources)
+        return sources[start:] + sources[:start]
@@ -0,0 +1,112 @@
+import threading
+import time
+from utils import open_router_device
+
+# Pool of authenticated NAPALM sessions, keyed by router id.
+# A session is taken out of the pool for one call and put back afterwards, so concurrent calls to the same router
+# never share an SSH channel, and repeated scans reuse the already opened sessions.
+
+
+class _Session:
+    __slots__ = ("device", "router_vendor", "device_info", "last_used", "last_checked")
+
+    def __init__(self, device, router_vendor, device_info):
+        self.device = device
+        self.router_vendor = router_vendor
+        self.device_info = device_info
+        self.last_used = time.monotonic()
+        self.last_checked = self.last_used
+
+
+class RouterSessionManager:
+    def __init__(self, idle_timeout=300, health_check_interval=60):
+        self.idle_timeout = idle_timeout    # Idle sessions are closed after this number of seconds
+        self.health_check_interval = health_check_interval    # Sessions idle longer than this are checked before reuse
+        self.idle_sessions = {}
+        self.lock = threading.Lock()
+
+    def _open(self, router_vendor, device_info):
+        device = open_router_device(router_vendor, **device_info)
+        return _Session(device, router_vendor, dict(device_info))
+
+    def _close(self, session):
+        try:
+            session.device.close()
+        except Exception as e:
+            print(f"exception: {e}")
+
+    def _is_healthy(self, session):
+        now = time.monotonic()
+        if now - session.last_checked < self.health_check_interval:
+            return True
+
+        session.last_checked = now
+        try:
+            return session.device.is_alive().get("is_alive", False)
+        except Exception:
+            return False
+
+    def acquire(self, router_id, router_vendor, device_info):
+        self.evict_idle()
+
+        while True:
+            with self.lock:
+                sessions = self.idle_sessions.get(router_id)
+                session = sessions.pop() if sessions else None
+
+            if session is None:
+                return self._open(router_vendor, device_info)
+
+            # Sessions opened with old credentials, or found dead, are closed and replaced
+            if session.router_vendor == router_vendor and session.device_info == device_info and self._is_healthy(session):
+                return session
+
+            self._close(session)
+
+    def release(self, router_id, session):
+        session.last_used = time.monotonic()
+        with self.lock:
+            self.idle_sessions.setdefault(router_id, []).append(session)
+
+    def run(self, router_id, router_vendor, device_info, function):
+        session = self.acquire(router_id, router_vendor, device_info)
+        try:
+            result = function(session.device)
+        except Exception:
+            # The session may have been dropped by the router, reconnect once and retry
+            self._close(session)
+            session = self._open(router_vendor, device_info)
+            try:
+                result = function(session.device)
+            except Exception:
+                self._close(session)
+                raise
+
+        self.release(router_id, session)
+        return result
+
+    def evict_idle(self):
+        expired = []
+        now = time.monotonic()
+        with self.lock:
+            for router_id, sessions in self.idle_sessions.items():
+                expired.extend(session for session in sessions if now - session.last_used >= self.idle_timeout)
+                sessions[:] = [session for session in sessions if now - session.last_used < self.idle_timeout]
+
+        for session in expired:
+            self._close(session)
+
+    def close(self, router_id):
+        with self.lock:
+            sessions = self.idle_sessions.pop(router_id, [])
+
+        for session in sessions:
+            self._close(session)
+
+    def close_all(self):
+        with self.lock:
+            sessions = [session for router_sessions in self.idle_sessions.values() for session in router_sessions]
+            self.idle_sessions.clear()
+
+        for session in sessions:
+            self._close(session)
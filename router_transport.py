@@ -0,0 +1,170 @@
+import asyncio
+import time
+from metrics import ROUTER_CALLS, ROUTER_SECONDS, timed
+from route_snapshot import RouteSnapshot
+from utils import get_route_command, get_route_scan_result, get_route_table_commands, parse_routes
+
+try:
+    import asyncssh
+except ImportError:  # asyncssh is optional, the routers are reached through NAPALM without it
+    asyncssh = None
+
+# Async router transport: the router commands run over SSH on the event loop, without a worker thread per call.
+# A slow router only delays its own scans, every command has a timeout and a cancelled scan (race mode) stops its
+# command right away. One SSH connection is kept per router and shared by the concurrent commands, each command runs
+# on its own channel. The routers must accept commands on the SSH exec channel, "ssh router 'show ip route'".
+#
+# The transport is chosen per vendor with ROUTER_TRANSPORTS, for example "Cisco=asyncssh,Huawei=asyncssh".
+# The other vendors are reached through NAPALM.
+
+ROUTER_TRANSPORT_NAMES = ("napalm", "asyncssh")
+
+
+def parse_router_transports(value):
+    # "Vendor=transport,..." into {vendor: transport}, the vendors not listed use NAPALM
+    transports = {}
+    for item in value.split(","):
+        vendor, _, transport = item.partition("=")
+        vendor, transport = vendor.strip(), transport.strip()
+        if not vendor:
+            continue
+        if transport not in ROUTER_TRANSPORT_NAMES:
+            raise ValueError(f"Unknown router transport: {transport}")
+        if transport == "asyncssh" and asyncssh is None:
+            raise ValueError("The asyncssh router transport needs asyncssh installed: pip install asyncssh")
+        transports[vendor] = transport
+    return transports
+
+
+class RouterCommandError(Exception):
+    pass
+
+
+class _Connection:
+    __slots__ = ("connection", "device_info", "last_used")
+
+    def __init__(self, connection, device_info):
+        self.connection = connection
+        self.device_info = device_info
+        self.last_used = time.monotonic()
+
+
+class AsyncSSHTransport:
+    def __init__(self, connect_timeout=10, command_timeout=60, idle_timeout=300, known_hosts=None, port=22):
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.idle_timeout = idle_timeout    # Idle connections are closed after this number of seconds
+        self.known_hosts = known_hosts      # known_hosts file of the routers keys, None doesn't check them (like NAPALM)
+        self.port = port
+        self.connections = {}
+        self.locks = {}
+
+    async def connect(self, router_id, device_info, router_vendor=""):
+        # Return the open connection of the router, connections opened with old credentials or closed are replaced
+        if router_id not in self.locks:
+            self.locks[router_id] = asyncio.Lock()
+
+        async with self.locks[router_id]:
+            cached = self.connections.get(router_id)
+            if cached is not None and cached.device_info == device_info and not cached.connection.is_closed():
+                return cached.connection
+            if cached is not None:
+                self.close(router_id)
+
+            with timed(ROUTER_SECONDS, vendor=router_vendor, router=device_info['hostname'], stage="connect"):
+                connection = await asyncssh.connect(device_info['hostname'], device_info.get('port', self.port), username=device_info['username'],
+                                                    password=device_info['password'], known_hosts=self.known_hosts,
+                                                    connect_timeout=self.connect_timeout)
+            self.connections[router_id] = _Connection(connection, dict(device_info))
+            return connection
+
+    async def run_command(self, connection, command):
+        # Run one command on its own channel. A timeout or a cancellation closes this channel only, the other commands
+        # running on the connection keep going.
+        process = await connection.create_process(command)
+        try:
+            result = await process.wait(check=False)
+        except BaseException:
+            process.close()
+            raise
+
+        if (result.exit_status is not None and result.exit_status != 0) or result.exit_signal:
+            raise RouterCommandError(f"Command {command!r} failed with exit status {result.exit_status}")
+
+        # Many network OSes close the channel without sending an exit status: the output is complete when the channel
+        # was closed with some output and the connection is still up. Without output the command was cut short.
+        if result.exit_status is None and (not result.stdout or connection.is_closed()):
+            raise RouterCommandError(f"Command {command!r} ended without an exit status or an output")
+        return result.stdout or ""
+
+    async def cli(self, router_id, device_info, commands, router_vendor=""):
+        # Run the commands, and return their output by command like the NAPALM cli()
+        connection = await self.connect(router_id, device_info, router_vendor)
+        try:
+            with timed(ROUTER_SECONDS, vendor=router_vendor, router=device_info['hostname'], stage="command"):
+                outputs = await asyncio.wait_for(asyncio.gather(*(self.run_command(connection, command) for command in commands)), self.command_timeout)
+        except BaseException:
+            # A broken connection is not reused, the next call opens a new one
+            cached = self.connections.get(router_id)
+            if cached is not None and cached.connection is connection and connection.is_closed():
+                self.close(router_id)
+            raise
+
+        cached = self.connections.get(router_id)
+        if cached is not None:
+            cached.last_used = time.monotonic()
+        return dict(zip(commands, outputs))
+
+    def close(self, router_id):
+        cached = self.connections.pop(router_id, None)
+        if cached is not None:
+            cached.connection.close()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for router_id, cached in list(self.connections.items()):
+            if now - cached.last_used >= self.idle_timeout:
+                self.close(router_id)
+
+    def close_all(self):
+        for router_id in list(self.connections):
+            self.close(router_id)
+
+
+# Async counterparts of the NAPALM router calls of utils and route_snapshot, with the same results
+
+
+async def async_route_scan(route_prefix, router_vendor, transport=None, router_id=None, **device_info):
+    try:
+        command = get_route_command(route_prefix, router_vendor)
+        output = await transport.cli(router_id or device_info['hostname'], device_info, [command], router_vendor)
+        with timed(ROUTER_SECONDS, vendor=router_vendor, router=device_info['hostname'], stage="parse"):
+            scan_result = get_route_scan_result(route_prefix, output[command])
+
+    except Exception as e:
+        print(f"exception: {e}")
+        ROUTER_CALLS.inc(call="route_scan", vendor=router_vendor, router=device_info.get('hostname'), outcome="failure")
+        return {"status": False, "online_status": "", "online_utilization": None}
+
+    ROUTER_CALLS.inc(call="route_scan", vendor=router_vendor, router=device_info['hostname'], outcome="success")
+    return scan_result
+
+
+async def async_router_connection_test(router_vendor, transport=None, router_id=None, **device_info):
+    try:
+        await transport.connect(router_id or device_info['hostname'], device_info, router_vendor)
+
+    except Exception as e:
+        print(f"exception: {e}")
+        ROUTER_CALLS.inc(call="connection_test", vendor=router_vendor, router=device_info.get('hostname'), outcome="failure")
+        return False
+
+    ROUTER_CALLS.inc(call="connection_test", vendor=router_vendor, router=device_info['hostname'], outcome="success")
+    return True
+
+
+async def async_route_table_snapshot(router_vendor, transport=None, router_id=None, **device_info):
+    commands = get_route_table_commands(router_vendor)
+    output = await transport.cli(router_id or device_info['hostname'], device_info, commands, router_vendor)
+    with timed(ROUTER_SECONDS, vendor=router_vendor, router=device_info['hostname'], stage="parse"):
+        return RouteSnapshot(parse_routes("\n".join(output[command] for command in commands)))
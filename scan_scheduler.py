@@ -0,0 +1,132 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Background scan jobs. Submitted jobs are queued and run one at a time by a worker task, so large rescans
+# run off the request path. A running job reports its progress and an estimated time to completion.
+# With an interval set, a rescan job is also submitted periodically.
+# The scheduler runs any kind of long job given as run_job, for example the break of a large subnet.
+
+
+class ScanJob:
+    def __init__(self, scope="all", ids=None, trigger="api", params=None):
+        self.job_id = uuid.uuid4().hex
+        self.scope = scope      # "all" subnets, "major" subnets only, or "ids"
+        self.ids = ids
+        self.params = params    # Arguments of the other kinds of jobs
+        self.trigger = trigger  # "api" or "schedule"
+        self.status = "queued"
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.error = None
+        self.submitted_at = datetime.now(timezone.utc)
+        self.started_at = None
+        self.finished_at = None
+        self.started = None     # Monotonic start time, for the ETA
+
+    def start(self, total):
+        self.status = "running"
+        self.total = total
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.monotonic()
+
+    def advance(self, done, failed=0):
+        self.done += done
+        self.failed += failed
+
+    def finish(self, error=None):
+        self.status = "failed" if error else "completed"
+        self.error = error
+        self.finished_at = datetime.now(timezone.utc)
+
+    def eta(self):
+        # Seconds left, estimated from the average time per subnet so far
+        if self.status != "running" or not self.done:
+            return None
+        elapsed = time.monotonic() - self.started
+        return round(elapsed / self.done * (self.total - self.done), 1)
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "scope": self.scope,
+            "trigger": self.trigger,
+            "params": self.params,
+            "status": self.status,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "progress": round((self.done / self.total) * 100,2) if self.total else 0.00,
+            "eta_seconds": self.eta(),
+            "error": self.error,
+            "submitted_at": self.submitted_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class ScanScheduler:
+    def __init__(self, run_job, interval=0, scope="all", max_jobs=100):
+        self.run_job = run_job      # Coroutine function scanning the subnets of a job
+        self.interval = interval    # Seconds between two scheduled rescans, 0 disables them
+        self.scope = scope          # Scope of the scheduled rescans
+        self.max_jobs = max_jobs    # Number of jobs kept for polling, the oldest finished ones are dropped
+        self.jobs = OrderedDict()
+        self.queue = asyncio.Queue()
+        self.tasks = []
+
+    def start(self):
+        self.tasks.append(asyncio.create_task(self.worker()))
+        if self.interval > 0:
+            self.tasks.append(asyncio.create_task(self.schedule()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, scope="all", ids=None, trigger="api", params=None):
+        job = ScanJob(scope, ids, trigger, params)
+        self.jobs[job.job_id] = job
+        self.queue.put_nowait(job)
+
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ("completed", "failed")]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        # Most recent jobs first
+        return list(reversed(self.jobs.values()))
+
+    def pending(self, trigger):
+        return any(job.trigger == trigger and job.status in ("queued", "running") for job in self.jobs.values())
+
+    async def run(self, job):
+        try:
+            await self.run_job(job)
+        except Exception as e:
+            print(f"exception: {e}")
+            job.finish(str(e))
+        else:
+            if job.status != "failed":
+                job.finish()
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            await self.run(job)
+
+    async def schedule(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # A slow rescan is not queued again before it finishes
+            if not self.pending("schedule"):
+                self.submit(self.scope, trigger="schedule")
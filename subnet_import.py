@@ -0,0 +1,140 @@
+import argparse
+import csv
+import heapq
+import json
+import os
+import tempfile
+import requests
+from prefix import Prefix
+
+# Bulk import of existing allocations from a CSV file (with a header line) or an NDJSON file.
+# Columns/keys: subnet_prefix, subnet_name, subnet_service, subnet_description.
+# Rows are parsed one at a time into compact tuples, and sorted by IP version, network address then prefix length,
+# so every subnet comes after the subnets containing it and the tree is built in one pass. The rows are sorted in chunks
+# of IMPORT_SORT_CHUNK_SIZE rows, every full chunk is spilled to a temporary file, and the chunks are merged when read,
+# so a large file doesn't need all its rows in memory.
+#
+# Import of a file through the running application, run from the repository root:
+#   python subnet_import.py allocations.csv [--url http://localhost:8000]
+
+IMPORT_FORMATS = ("csv", "ndjson")
+IMPORT_SORT_CHUNK_SIZE = 100000
+
+
+def read_import_rows(text_file, format):
+    # Generate (line number, row) from the file, the row is None when the line can't be parsed
+    if format == "csv":
+        reader = csv.DictReader(text_file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text_file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def parse_import_row(row):
+    # Return (IP version, network address, prefix length, name, service, description), raise ValueError on a wrong row
+    if row is None:
+        raise ValueError("Invalid row")
+
+    prefix = Prefix.parse(str(row.get("subnet_prefix") or ""), strict=True)
+    return (prefix.version, prefix.address, prefix.prefixlen,
+            str(row.get("subnet_name") or ""), str(row.get("subnet_service") or ""), str(row.get("subnet_description") or ""))
+
+
+class SortedRows:
+    # Rows sorted on iteration: the last chunk is sorted in memory, and merged with the chunks spilled to temporary files
+    def __init__(self, chunk_size=IMPORT_SORT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.files = []
+        self.count = 0
+
+    def append(self, row):
+        self.chunk.append(row)
+        self.count += 1
+        if len(self.chunk) == self.chunk_size:
+            self.spill()
+
+    def spill(self):
+        self.chunk.sort()
+        chunk_file = tempfile.TemporaryFile("w+", encoding="utf-8")
+        chunk_file.writelines(json.dumps(row) + "\n" for row in self.chunk)
+        self.files.append(chunk_file)
+        self.chunk = []
+
+    @staticmethod
+    def read_chunk(chunk_file):
+        chunk_file.seek(0)
+        for line in chunk_file:
+            yield tuple(json.loads(line))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        self.chunk.sort()
+        return heapq.merge(self.chunk, *(self.read_chunk(chunk_file) for chunk_file in self.files))
+
+    def close(self):
+        for chunk_file in self.files:
+            chunk_file.close()
+        self.files = []
+
+
+def load_import_rows(text_file, format, max_errors=100, chunk_size=IMPORT_SORT_CHUNK_SIZE):
+    # Return the sorted rows (to close once read), the first max_errors errors, and the number of wrong rows
+    rows = SortedRows(chunk_size)
+    errors = []
+    error_count = 0
+    try:
+        for line_number, row in read_import_rows(text_file, format):
+            try:
+                rows.append(parse_import_row(row))
+            except ValueError as e:
+                error_count += 1
+                if len(errors) < max_errors:
+                    errors.append({"line": line_number, "error": str(e)})
+    except BaseException:
+        rows.close()
+        raise
+
+    return rows, errors, error_count
+
+
+def import_file(path, url, format=None):
+    # Stream the file to the import API, and print the progress reported back
+    format = format or ("ndjson" if os.path.splitext(path)[1].lower() in (".ndjson", ".jsonl") else "csv")
+
+    with open(path, "rb") as upload:
+        response = requests.post(f"{url}/api/import", params={"format": format}, data=upload, stream=True)
+        response.raise_for_status()
+
+        summary = None
+        for line in response.iter_lines():
+            summary = json.loads(line)
+            print(f"{summary['processed']}/{summary['total']} rows, {summary['imported']} imported, {summary['existing']} existing, {summary['failed']} failed")
+
+    for error in summary.get("errors", []) if summary else []:
+        print(f"  {error.get('line', error.get('subnet_prefix'))}: {error['error']}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import subnets from a CSV or NDJSON file.")
+    parser.add_argument("path")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--format", choices=IMPORT_FORMATS)
+    args = parser.parse_args()
+
+    summary = import_file(args.path, args.url, args.format)
+    if not summary or summary['failed']:
+        raise SystemExit(1)
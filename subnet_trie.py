@@ -0,0 +1,295 @@
+from prefix import Prefix
+
+# Binary prefix trie (one bit per level) holding every subnet of the IPAM.
+# A stored subnet is keyed on its integer network address and its prefix length, so that parent lookup,
+# children lookup, longest-prefix match and "is this prefix free" checks cost O(prefixlen) and never query MongoDB.
+# IPv4 and IPv6 subnets go through the same code, in two separate trees of 32 and 128 levels.
+#
+# Every node also keeps a bitmask of the free space under it: bit n is set when the branch contains a free region
+# (not overlapping any stored subnet below the node) of prefix length n. Free block allocation follows these bits down
+# the trie, so finding the first fitting or the best fitting block costs O(prefixlen) too.
+#
+# Stored subnets keep the number of addresses covered by their children. Children of a subnet never overlap, so the
+# count changes only for the parent of an inserted or removed subnet, and is updated incrementally.
+
+
+class _Node:
+    __slots__ = ("children", "prefix", "value", "free_mask", "covered")
+
+    def __init__(self, depth):
+        self.children = [None, None]
+        self.prefix = None   # Subnet prefix string, set only when a subnet is stored at this node
+        self.value = None
+        self.free_mask = 1 << depth
+        self.covered = 0    # Number of addresses covered by the children subnets
+
+
+class SubnetTrie:
+    def __init__(self):
+        self.roots = {32: _Node(0), 128: _Node(0)}   # One tree per address family, keyed by its address length
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, prefix):
+        node = self._find_node(prefix)
+        return node is not None and node.prefix is not None
+
+    def clear(self):
+        self.roots = {32: _Node(0), 128: _Node(0)}
+        self.size = 0
+
+    def _key(self, prefix):
+        prefix = Prefix.parse(prefix)
+        return prefix.address, prefix.prefixlen, prefix, prefix.max_prefixlen
+
+    def _bit(self, address, depth, max_prefixlen):
+        return (address >> (max_prefixlen - 1 - depth)) & 1
+
+    def _find_node(self, prefix):
+        address, prefixlen, _, max_prefixlen = self._key(prefix)
+        node = self.roots[max_prefixlen]
+        for depth in range(prefixlen):
+            node = node.children[self._bit(address, depth, max_prefixlen)]
+            if node is None:
+                return None
+        return node
+
+    def _update_free_masks(self, path):
+        # Recompute the free space bitmasks of the nodes on path, from the deepest one up to the root
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            if node.children[0] is None and node.children[1] is None:
+                node.free_mask = 1 << depth
+                continue
+
+            free_mask = 0
+            for child in node.children:
+                if child is None:
+                    free_mask |= 1 << (depth + 1)
+                elif child.prefix is None:
+                    free_mask |= child.free_mask
+            node.free_mask = free_mask
+
+    def _size(self, prefixlen, max_prefixlen):
+        return 1 << (max_prefixlen - prefixlen)
+
+    def _children_nodes(self, node, depth):
+        # Nearest stored nodes under node, with their depth
+        stack = [(node.children[1], depth + 1), (node.children[0], depth + 1)]
+        while stack:
+            node, depth = stack.pop()
+            if node is None:
+                continue
+            if node.prefix is not None:
+                yield node, depth
+            else:
+                stack.append((node.children[1], depth + 1))
+                stack.append((node.children[0], depth + 1))
+
+    def _parent_node(self, path):
+        # Nearest stored node above the last node of path
+        for node in reversed(path[:-1]):
+            if node.prefix is not None:
+                return node
+        return None
+
+    def insert(self, prefix, value=None):
+        address, prefixlen, prefix, max_prefixlen = self._key(prefix)
+        path = [self.roots[max_prefixlen]]
+        node = path[0]
+        for depth in range(prefixlen):
+            bit = self._bit(address, depth, max_prefixlen)
+            if node.children[bit] is None:
+                node.children[bit] = _Node(depth + 1)
+            node = node.children[bit]
+            path.append(node)
+
+        if node.prefix is None:
+            self.size += 1
+
+            # The children of the new subnet were children of its parent
+            node.covered = sum(self._size(depth, max_prefixlen) for child, depth in self._children_nodes(node, prefixlen))
+            parent = self._parent_node(path)
+            if parent is not None:
+                parent.covered += self._size(prefixlen, max_prefixlen) - node.covered
+
+        node.prefix = str(prefix)
+        node.value = value
+        self._update_free_masks(path)
+
+    def remove(self, prefix):
+        address, prefixlen, _, max_prefixlen = self._key(prefix)
+        path = [self.roots[max_prefixlen]]
+        node = path[0]
+        for depth in range(prefixlen):
+            node = node.children[self._bit(address, depth, max_prefixlen)]
+            if node is None:
+                return False
+            path.append(node)
+
+        if node.prefix is None:
+            return False
+
+        # The children of the removed subnet move up to its parent
+        parent = self._parent_node(path)
+        if parent is not None:
+            parent.covered += node.covered - self._size(prefixlen, max_prefixlen)
+
+        node.prefix = None
+        node.value = None
+        node.covered = 0
+        self.size -= 1
+
+        # Prune the branch back up to the nearest node that is still needed, so an empty node always means "free"
+        for depth in range(prefixlen, 0, -1):
+            node = path[depth]
+            if node.prefix is not None or node.children[0] is not None or node.children[1] is not None:
+                break
+            path[depth - 1].children[self._bit(address, depth - 1, max_prefixlen)] = None
+            path.pop()
+
+        self._update_free_masks(path)
+        return True
+
+    def get(self, prefix, default=None):
+        node = self._find_node(prefix)
+        if node is None or node.prefix is None:
+            return default
+        return node.value
+
+    def covered(self, prefix):
+        # Number of addresses of the stored subnet covered by its children subnets
+        node = self._find_node(prefix)
+        if node is None or node.prefix is None:
+            return 0
+        return node.covered
+
+    def utilization(self, prefix):
+        # True division of the integers, exact enough for the IPv6 address counts
+        address, prefixlen, _, max_prefixlen = self._key(prefix)
+        return round((self.covered(prefix) / self._size(prefixlen, max_prefixlen)) * 100,2)
+
+    def longest_match(self, prefix, strict=False):
+        # Return the most specific stored subnet containing prefix. With strict=True the prefix itself is excluded,
+        # which gives the parent of a subnet.
+        address, prefixlen, _, max_prefixlen = self._key(prefix)
+        node = self.roots[max_prefixlen]
+        match = None
+        for depth in range(prefixlen):
+            if node.prefix is not None:
+                match = node.prefix
+            node = node.children[self._bit(address, depth, max_prefixlen)]
+            if node is None:
+                return match
+
+        if not strict and node.prefix is not None:
+            match = node.prefix
+        return match
+
+    def matches(self, prefix):
+        # Return all the stored subnets containing prefix (prefix included), from the least to the most specific.
+        address, prefixlen, _, max_prefixlen = self._key(prefix)
+        node = self.roots[max_prefixlen]
+        matches = []
+        for depth in range(prefixlen):
+            if node.prefix is not None:
+                matches.append(node.prefix)
+            node = node.children[self._bit(address, depth, max_prefixlen)]
+            if node is None:
+                return matches
+
+        if node.prefix is not None:
+            matches.append(node.prefix)
+        return matches
+
+    def children(self, prefix):
+        # Return the nearest stored subnets under prefix (the subnets whose parent is, or would be, prefix),
+        # sorted by network address.
+        node = self._find_node(prefix)
+        if node is None:
+            return []
+
+        children = []
+        stack = [node.children[1], node.children[0]]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if node.prefix is not None:
+                children.append(node.prefix)
+            else:
+                stack.append(node.children[1])
+                stack.append(node.children[0])
+        return children
+
+    def is_free(self, prefix):
+        # A prefix is free when neither it nor any more specific subnet under it is stored.
+        node = self._find_node(prefix)
+        return node is None or (node.prefix is None and node.children[0] is None and node.children[1] is None)
+
+    def free_blocks(self, prefix, prefixlen):
+        # Generate, in address order, the blocks of length prefixlen under prefix that don't overlap any stored subnet
+        # below prefix. Allocated branches are skipped as a whole, and blocks are only built when consumed.
+        address, parent_prefixlen, _, max_prefixlen = self._key(prefix)
+        if not parent_prefixlen <= prefixlen <= max_prefixlen:
+            raise ValueError(f"Invalid prefix length: {prefixlen}")
+
+        stack = [(self._find_node(prefix), address, parent_prefixlen)]
+        while stack:
+            node, address, depth = stack.pop()
+
+            if node is None or (depth == parent_prefixlen and node.children[0] is None and node.children[1] is None):
+                # Nothing stored in this branch, all its blocks are free
+                for index in range(1 << (prefixlen - depth)):
+                    yield self._prefix(address + (index << (max_prefixlen - prefixlen)), prefixlen, max_prefixlen)
+                continue
+
+            if (node.prefix is not None and depth > parent_prefixlen) or depth == prefixlen:
+                continue
+
+            # No free region large enough in this branch
+            if not node.free_mask & ((2 << prefixlen) - 1):
+                continue
+
+            stack.append((node.children[1], address | (1 << (max_prefixlen - 1 - depth)), depth + 1))
+            stack.append((node.children[0], address, depth + 1))
+
+    def find_free_block(self, prefix, prefixlen, best_fit=False):
+        # Return a free block of length prefixlen under prefix, or None when there is no room.
+        # First fit gives the block with the lowest address. Best fit takes the block from the smallest free region
+        # that can hold it, to keep the large free regions for large allocations.
+        address, depth, _, max_prefixlen = self._key(prefix)
+        if not depth <= prefixlen <= max_prefixlen:
+            raise ValueError(f"Invalid prefix length: {prefixlen}")
+
+        node = self._find_node(prefix)
+        if node is None:
+            return self._prefix(address, prefixlen, max_prefixlen)
+
+        wanted = node.free_mask & ((2 << prefixlen) - 1)
+        if not wanted:
+            return None
+        if best_fit:
+            wanted = 1 << (wanted.bit_length() - 1)
+
+        while True:
+            if node.children[0] is None and node.children[1] is None:
+                return self._prefix(address, prefixlen, max_prefixlen)
+
+            for bit in (0, 1):
+                child = node.children[bit]
+                child_address = address | (bit << (max_prefixlen - 1 - depth))
+                if child is None:
+                    if wanted & (1 << (depth + 1)):
+                        return self._prefix(child_address, prefixlen, max_prefixlen)
+                elif child.prefix is None and child.free_mask & wanted:
+                    node, address = child, child_address
+                    depth += 1
+                    break
+            else:
+                return None
+
+    def _prefix(self, address, prefixlen, max_prefixlen):
+        return str(Prefix(address, prefixlen, max_prefixlen))
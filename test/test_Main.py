@@ -1,8 +1,12 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
 from Main import app
 from unittest.mock import AsyncMock, patch
-from bson import ObjectId
+from bson import Binary, ObjectId
+from subnet_trie import SubnetTrie
+from router_pool import RouterPool
+from view_cache import ViewCache
 
 
 client = TestClient(app)
@@ -15,7 +19,7 @@ client = TestClient(app)
 @pytest.fixture
 def mock_mongo_router():
     """Mock MongoDB collection"""
-    with patch("Main.router_collection") as mock_router_collection:
+    with patch("Main.router_collection") as mock_router_collection, patch("Main.router_pool", RouterPool()):
         mock_router_collection.find_one = AsyncMock(return_value=None)  # No existing router
 
         async_mock_find = AsyncMock()
@@ -44,10 +48,25 @@ def mock_mongo_subnet():
         mock_subnet_collection.insert_one = AsyncMock(return_value=None)  # Mock insert
         mock_subnet_collection.delete_one = AsyncMock(return_value=AsyncMock(deleted_count=1))  # Mock delete
         mock_subnet_collection.delete_many = AsyncMock(return_value=AsyncMock(deleted_count=1))  # Mock delete Many
+        mock_subnet_collection.bulk_write = AsyncMock(return_value=None)  # Mock batched writes
         yield mock_subnet_collection  # Provide the mock to tests
 
 
 
+@pytest.fixture(autouse=True)
+def fresh_view_cache():
+    """Empty view cache for every test"""
+    with patch("Main.view_cache", ViewCache()) as mock_cache:
+        yield mock_cache
+
+
+@pytest.fixture
+def mock_subnet_index():
+    """Fresh in-memory subnet index"""
+    with patch("Main.subnet_index", SubnetTrie()) as mock_index:
+        yield mock_index
+
+
 @pytest.fixture
 def mock_router_connection_test():
     with patch("Main.router_connection_test") as mock:
@@ -165,16 +184,15 @@ def test_add_router_existing_ip(mock_mongo_router):
     assert response.json()["detail"] == "Router already exists"
 
 
-# ✅ Test: Add More than Routers Number Limit
-def test_add_router_limit_exceeded(mock_mongo_router):
-    #Test adding a third router when limit is 2
+# ✅ Test: Add a Third Router, no routers number limit
+def test_add_router_no_limit(mock_mongo_router):
     async_mock_find = AsyncMock()
     async_mock_find.to_list = AsyncMock(return_value=[router1_data_valid, router2_data_valid])  # Two routers exist
     mock_mongo_router.find.return_value = async_mock_find
 
     response = client.post("/routers/", json=router_data_valid)
-    assert response.status_code == 400
-    assert response.json()["detail"] == "Limit exceeded, there are already two Routers."
+    assert response.status_code == 200
+    assert response.json() == {"message": "Router added successfully"}
 
 
 # ✅ Test: Router Input IP Invalid
@@ -259,17 +277,46 @@ def test_get_subnet_detail_not_existing(mock_mongo_subnet):
 
 
 # ✅ Test: Add Major Subnet Successfully
-def test_add_major_subnet_success(mock_mongo_subnet):
+def test_add_major_subnet_success(mock_mongo_subnet, mock_subnet_index):
     mock_mongo_subnet.find_one.return_value = None  # No existing subnet
 
     response = client.post("/subnets/", json=subnet_dict)
 
     assert response.status_code == 200
     assert response.json() == {"message": "Subnet added successfully"}
+    assert mock_subnet_index.get("192.168.1.0/24") == "192.168.1.0/24"
+
+
+# ✅ Test: Major Subnet Stored Normalized, as Held by the Index
+def test_add_major_subnet_normalized(mock_mongo_subnet, mock_subnet_index):
+    mock_mongo_subnet.find_one.return_value = None
+
+    major_subnet = {key: value for key, value in subnet_dict.items() if key != "subnet_root"}
+    response = client.post("/subnets/", json={**major_subnet, "subnet_prefix": "10.0.0.5/8", "subnet_id": "10.0.0.5", "subnet_mask": "8"})
+
+    assert response.status_code == 200
+    mock_mongo_subnet.find_one.assert_called_once_with({"subnet_prefix": "10.0.0.0/8"})
+    document = mock_mongo_subnet.insert_one.call_args.args[0]
+    assert (document["subnet_prefix"], document["subnet_id"], document["subnet_root"], document["subnet_parent"]) == ("10.0.0.0/8", "10.0.0.0", "10.0.0.0/8", "")
+    assert "10.0.0.0/8" in mock_subnet_index
+
+
+# ✅ Test: Major Subnet Overlapping an Existing Tree Refused
+def test_add_major_subnet_overlap(mock_mongo_subnet, mock_subnet_index):
+    mock_mongo_subnet.find_one.return_value = None
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+
+    for subnet_prefix in ("10.1.0.0/16", "0.0.0.0/0"):
+        response = client.post("/subnets/", json={**subnet_dict, "subnet_prefix": subnet_prefix})
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Overlaps existing major subnets"}
+
+    mock_mongo_subnet.insert_one.assert_not_called()
+    assert mock_subnet_index.children("10.0.0.0/8") == []
 
 
 # ✅ Test: The New Added Major Subnet Already Exist
-def test_add_major_subnet_already_exists(mock_mongo_subnet):
+def test_add_major_subnet_already_exists(mock_mongo_subnet, mock_subnet_index):
     mock_mongo_subnet.find_one.return_value = {"subnet_prefix": "192.168.1.0/24"}
 
     response = client.post("/subnets/", json=subnet_dict)
@@ -279,7 +326,8 @@ def test_add_major_subnet_already_exists(mock_mongo_subnet):
 
 
 # ✅ Test: Delete Subnet Successfully
-def test_delete_subnet_success(mock_mongo_subnet):
+def test_delete_subnet_success(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("192.168.1.0/24", "192.168.1.0/24")
     mock_mongo_subnet.find_one.return_value = {"_id": moc_id, "subnet_prefix": "192.168.1.0/24", "subnet_parent":""}  # Found subnet
 
     mock_mongo_subnet.delete_many.return_value.deleted_count = 1
@@ -290,16 +338,16 @@ def test_delete_subnet_success(mock_mongo_subnet):
 
 
 # ✅ Test: Delete Subnet with Children Subnet
-def test_delete_subnet_with_children(mock_mongo_subnet):
-    child_id = ObjectId()
+def test_delete_subnet_with_children(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("192.168.1.0/24", "192.168.1.0/24")
+    mock_subnet_index.insert("192.168.1.0/25", "192.168.1.0/24")
     mock_mongo_subnet.find_one.return_value = {"_id": moc_id, "subnet_prefix": "192.168.1.0/24", "subnet_parent":""}  # Found subnet
 
-    mock_mongo_subnet.find.return_value.to_list = AsyncMock(return_value=[{"_id": child_id, "subnet_prefix": "192.168.1.0/25", "subnet_parent": "192.168.1.0/24"}])
-
     response = client.delete(f"/subnet/{moc_id}")
 
     assert response.status_code == 400
     assert response.json() == {"detail": "The subnet contains active smaller subnet(s). Cant' be deleted!"}
+    mock_mongo_subnet.delete_one.assert_not_called()
 
 
 # ✅ Test: Delete Subnet Successfully (no Children Subnets)
@@ -339,6 +387,55 @@ def test_scan_subnet_success(mock_mongo_subnet,mock_mongo_router,mock_router_con
     assert response.json() == {"message": "Subnet Scanned Successfully"}
 
 
+# ✅ Test: Connection Test of a Router whose Password Can't be Decrypted
+def test_connection_bad_password(mock_mongo_router):
+    async_mock_find = AsyncMock()
+    async_mock_find.to_list = AsyncMock(return_value=[{**router1_data_valid, "_id": ObjectId(moc_id), "router_password": "v2:AAAA"}])
+    mock_mongo_router.find.return_value = async_mock_find
+
+    response = client.get(f"/routers/testconnection/{moc_id}")
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Router password can't be decrypted, please save it again"}
+
+
+# ✅ Test: Metrics of the Requests and the Scans
+def test_metrics(mock_mongo_subnet,mock_mongo_router,mock_router_connection_test,mock_route_scan):
+    mock_mongo_subnet.find_one.return_value = {"_id": moc_id, "subnet_prefix": "192.168.1.0/24"}
+    mock_mongo_router.find.return_value.to_list = AsyncMock(return_value=[router1_data_valid, router2_data_valid])
+    mock_router_connection_test.return_value = True
+    mock_route_scan.return_value = {"status": True, "online_status": "Active", "online_utilization": 0.0}
+    client.put("/scan_subnet/", json={"subnet_prefix": "192.168.1.0/24"})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'ipam_http_request_duration_seconds_count{handler="/scan_subnet/",method="PUT",status="200"}' in response.text
+    assert 'ipam_subnet_scans_total{outcome="success"}' in response.text
+    assert 'ipam_view_cache_requests_total{result="miss"}' in response.text
+    assert "# TYPE ipam_operation_duration_seconds histogram" in response.text
+
+
+# ✅ Test: Scan through the Async Transport for the Vendors Configured, NAPALM for the Others
+def test_scan_subnet_async_transport(mock_mongo_subnet,mock_mongo_router,mock_route_scan):
+    import Main
+    mock_mongo_subnet.find_one.return_value = {"_id": moc_id, "subnet_prefix": "192.168.1.0/24"}
+    mock_mongo_router.find.return_value.to_list = AsyncMock(return_value=[router1_data_valid, router2_data_valid])
+    mock_route_scan.return_value = {"status": True, "online_status": "Active", "online_utilization": 0.0}
+    async_route_scan = AsyncMock(return_value={"status": True, "online_status": "Active", "online_utilization": 50.0})
+
+    with patch("Main.ROUTER_TRANSPORTS", {router1_data_valid["router_vendor"]: "asyncssh"}), patch("Main.async_route_scan", async_route_scan):
+        response = client.put("/scan_subnet/", json={"subnet_prefix": "192.168.1.0/24"})
+
+    assert response.status_code == 200
+    async_route_scan.assert_awaited_once()
+    assert async_route_scan.call_args.args == ("192.168.1.0/24", router1_data_valid["router_vendor"])
+    assert async_route_scan.call_args.kwargs["transport"] is Main.async_transport
+    assert async_route_scan.call_args.kwargs["hostname"] == router1_data_valid["router_ip"]
+    mock_route_scan.assert_not_called()
+
+
 # ✅ Test: Scan Subnet Not Found
 def test_scan_subnet_not_found(mock_mongo_subnet):
     mock_mongo_subnet.find_one.return_value = None
@@ -348,3 +445,886 @@ def test_scan_subnet_not_found(mock_mongo_subnet):
     assert response.status_code == 404
     assert response.json() == {"detail": "Subnet not found"}
 
+
+# ✅ Test: Add Subnet Successfully, parent and children resolved from the index
+def test_add_subnet_success(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+    mock_subnet_index.insert("10.1.0.0/16", "10.0.0.0/8")
+    mock_subnet_index.insert("10.1.1.0/24", "10.0.0.0/8")
+    mock_mongo_subnet.update_many = AsyncMock(return_value=None)
+
+    new_subnet = {**subnet_dict, "subnet_id": "10.1.0.0", "subnet_mask": "20"}
+    response = client.post("/subnets/10.0.0.0-8/add-subnet", json=new_subnet)
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Subnet added successfully"}
+
+    inserted = mock_mongo_subnet.insert_one.call_args.args[0]
+    assert inserted["subnet_parent"] == "10.1.0.0/16"
+    assert inserted["subnet_root"] == "10.0.0.0/8"
+    assert (inserted["net_start"], inserted["net_end"]) == (167837696, 167841791)
+    mock_mongo_subnet.update_many.assert_called_once_with({"subnet_prefix": {"$in": ["10.1.1.0/24"]}}, {"$set": {"subnet_parent": "10.1.0.0/20"}})
+    mock_mongo_subnet.find_one.assert_not_called()
+    assert "10.1.0.0/20" in mock_subnet_index
+
+    # Parent /16 now covered by the new /20 only, the /20 covered by the moved /24
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [(update._filter, update._doc) for update in utilization_update] == [
+        ({"subnet_prefix": "10.1.0.0/16"}, {"$set": {"covered_addresses": 4096, "offline_utilization": 6.25}}),
+        ({"subnet_prefix": "10.1.0.0/20"}, {"$set": {"covered_addresses": 256, "offline_utilization": 6.25}}),
+    ]
+
+
+# ✅ Test: Add Subnet Already Exists
+def test_add_subnet_already_exists(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+    mock_subnet_index.insert("10.1.0.0/16", "10.0.0.0/8")
+
+    new_subnet = {**subnet_dict, "subnet_id": "10.1.0.0", "subnet_mask": "16"}
+    response = client.post("/subnets/10.0.0.0-8/add-subnet", json=new_subnet)
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Subnet Already Exists."}
+
+
+# ✅ Test: Scan Multiple Subnets, result per subnet
+def test_scan_subnets_results(mock_mongo_subnet,mock_mongo_router,mock_router_connection_test,mock_route_scan):
+    scanned_id = ObjectId()
+    missing_id = ObjectId()
+    mock_mongo_subnet.find.return_value.to_list = AsyncMock(return_value=[{"_id": scanned_id, "subnet_prefix": "192.168.1.0/24"}])
+
+    async_mock_find = AsyncMock()
+    async_mock_find.to_list = AsyncMock(return_value=[router1_data_valid])
+    mock_mongo_router.find.return_value = async_mock_find
+
+    mock_router_connection_test.return_value = True
+    mock_route_scan.return_value = {"status": True, "online_status": "Active", "online_utilization": 50.0}
+
+    response = client.put("/scan_subnets/", json=[str(scanned_id), str(missing_id)])
+
+    assert response.status_code == 200
+    assert response.json() == {"results": [
+        {"id": str(scanned_id), "subnet_prefix": "192.168.1.0/24", "success": True, "message": "Subnet Scanned Successfully"},
+        {"id": str(missing_id), "subnet_prefix": None, "success": False, "message": "Subnet not found"},
+    ]}
+    mock_mongo_subnet.update_one.assert_called_once_with({"_id": scanned_id}, {"$set": {"online_status": "Active", "online_utilization": 50.0}})
+
+
+# ✅ Test: Snapshot Scan, one routing table pull for all subnets
+def test_scan_snapshot(mock_mongo_subnet,mock_mongo_router):
+    from route_snapshot import RouteSnapshot
+
+    mock_mongo_subnet.find.return_value.__aiter__.return_value = [
+        {"_id": moc_id, "subnet_prefix": "10.1.0.0/16"},
+        {"_id": ObjectId(), "subnet_prefix": "10.2.0.0/16"},
+    ]
+    mock_mongo_subnet.bulk_write = AsyncMock(return_value=None)
+
+    async_mock_find = AsyncMock()
+    async_mock_find.to_list = AsyncMock(return_value=[{"_id": ObjectId(), **router1_data_valid}])
+    mock_mongo_router.find.return_value = async_mock_find
+
+    with patch("Main.route_table_snapshot", return_value=RouteSnapshot(["10.1.0.0/17", "10.1.128.0/18"])) as mock_snapshot, patch("Main.route_snapshots.get", return_value=None):
+        response = client.put("/scan_snapshot/")
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Subnets Scanned Successfully", "router": "test_router1", "routes": 2, "scanned": 2}
+    mock_snapshot.assert_called_once()
+
+    updates = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert updates[0]._doc == {"$set": {"online_status": "Active", "online_utilization": 75.0}}
+    assert updates[1]._doc == {"$set": {"online_status": "Inactive", "online_utilization": 0.0}}
+
+
+# ✅ Test: Subnet Detail API cached, revalidated with the ETag, and invalidated by an update
+def test_subnet_detail_view_cache(mock_mongo_subnet, mock_subnet_index, fresh_view_cache):
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+    mock_subnet_index.insert("10.1.0.0/16", "10.0.0.0/8")
+    subnet = {"_id": ObjectId(), "subnet_prefix": "10.1.0.0/16", "subnet_name": "core", "subnet_parent": "10.0.0.0/8"}
+    mock_mongo_subnet.find_one = AsyncMock(side_effect=lambda *args, **kwargs: dict(subnet))
+
+    response = client.get("/api/subnets/10.1.0.0-16")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert client.get("/api/subnets/10.1.0.0-16").json()["subnet"]["subnet_name"] == "core"
+    assert mock_mongo_subnet.find_one.call_count == 1
+    assert (fresh_view_cache.hits, fresh_view_cache.misses) == (1, 1)
+
+    response = client.get("/api/subnets/10.1.0.0-16", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # The update invalidates the subnet and its upper subnets only
+    fresh_view_cache.set(("/api/subnets/10.0.0.0-8", ""), "10.0.0.0/8", b"{}", "application/json", fresh_view_cache.version)
+    fresh_view_cache.set(("/api/subnets/10.2.0.0-16", ""), "10.2.0.0/16", b"{}", "application/json", fresh_view_cache.version)
+    client.put(f"/subnets/{subnet['_id']}", json={"subnet_name": "backbone"})
+    subnet["subnet_name"] = "backbone"
+    assert set(fresh_view_cache.entries) == {("/api/subnets/10.2.0.0-16", "")}
+
+    response = client.get("/api/subnets/10.1.0.0-16", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["subnet"]["subnet_name"] == "backbone"
+    assert response.headers["etag"] != etag
+
+
+# ✅ Test: Break Subnet with batched inserts
+def test_break_subnet_success(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+    mock_subnet_index.insert("10.1.0.0/16", "10.0.0.0/8")
+    mock_mongo_subnet.insert_many = AsyncMock(return_value=None)
+
+    with patch("Main.BREAK_WRITE_BATCH_SIZE", 3):
+        response = client.put("/break_subnet/", json={"subnet_prefix": "10.1.0.0/16", "break_prefixlen": "/18"})
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Subnet has been divided successfully"}
+
+    assert mock_mongo_subnet.insert_many.call_count == 2
+    inserted = [subnet for call in mock_mongo_subnet.insert_many.call_args_list for subnet in call.args[0]]
+    assert [subnet["subnet_prefix"] for subnet in inserted] == ["10.1.0.0/18", "10.1.64.0/18", "10.1.128.0/18", "10.1.192.0/18"]
+    assert inserted[1] == {"subnet_prefix": "10.1.64.0/18", "subnet_id": "10.1.64.0", "subnet_mask": "18", "subnet_root": "10.0.0.0/8",
+                           "subnet_parent": "10.1.0.0/16", "subnet_name": "", "subnet_service": "", "subnet_description": "",
+                           "offline_utilization": 0.00, "covered_addresses": 0, "online_status": "", "online_utilization": 0.00,
+                           "net_version": 4, "net_start": 167854080, "net_end": 167870463}
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [(update._filter, update._doc) for update in utilization_update] == [({"subnet_prefix": "10.1.0.0/16"}, {"$set": {"covered_addresses": 65536, "offline_utilization": 100.0}})]
+    assert mock_subnet_index.children("10.1.0.0/16") == [subnet["subnet_prefix"] for subnet in inserted]
+
+
+# ✅ Test: Break Subnet with a batch partly rejected, the written children are indexed and counted
+def test_break_subnet_batch_write_error(mock_mongo_subnet, mock_subnet_index):
+    from pymongo.errors import BulkWriteError
+    mock_subnet_index.insert("10.1.0.0/16", "10.1.0.0/16")
+    # The second batch has its first subnet added meanwhile by another instance
+    write_error = BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "E11000 duplicate key error"}]})
+    mock_mongo_subnet.insert_many = AsyncMock(side_effect=[None, write_error])
+
+    with patch("Main.BREAK_WRITE_BATCH_SIZE", 3):
+        response = client.put("/break_subnet/", json={"subnet_prefix": "10.1.0.0/16", "break_prefixlen": "/18"})
+
+    assert response.status_code == 200
+    assert mock_subnet_index.children("10.1.0.0/16") == ["10.1.0.0/18", "10.1.64.0/18", "10.1.128.0/18"]
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [(update._filter, update._doc) for update in utilization_update] == [({"subnet_prefix": "10.1.0.0/16"}, {"$set": {"covered_addresses": 49152, "offline_utilization": 75.0}})]
+
+
+# ✅ Test: Break Subnet Updates the Utilization when a Batch Fails
+def test_break_subnet_batch_failure(mock_mongo_subnet, mock_subnet_index):
+    from pymongo.errors import AutoReconnect
+    mock_subnet_index.insert("10.1.0.0/16", "10.1.0.0/16")
+    mock_mongo_subnet.insert_many = AsyncMock(side_effect=[None, AutoReconnect("connection closed")])
+
+    with patch("Main.BREAK_WRITE_BATCH_SIZE", 3), pytest.raises(AutoReconnect):
+        client.put("/break_subnet/", json={"subnet_prefix": "10.1.0.0/16", "break_prefixlen": "/18"})
+
+    assert mock_subnet_index.children("10.1.0.0/16") == ["10.1.0.0/18", "10.1.64.0/18", "10.1.128.0/18"]
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [(update._filter, update._doc) for update in utilization_update] == [({"subnet_prefix": "10.1.0.0/16"}, {"$set": {"covered_addresses": 49152, "offline_utilization": 75.0}})]
+
+
+# ✅ Test: Break Subnet already containing smaller subnets
+def test_break_subnet_with_children(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("10.1.0.0/16", "10.1.0.0/16")
+    mock_subnet_index.insert("10.1.1.0/24", "10.1.0.0/16")
+
+    response = client.put("/break_subnet/", json={"subnet_prefix": "10.1.0.0/16", "break_prefixlen": "/18"})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Subnet already contains smaller subnet(s). You should delete them first before breaking it."}
+
+
+# ✅ Test: Break Preview, child count and first/last subnets without writing
+def test_break_subnet_preview(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+
+    with patch("Main.BREAK_SYNC_CHILDREN", 1000), patch("Main.BREAK_PREVIEW_SIZE", 2):
+        response = client.post("/break_subnet/preview", json={"subnet_prefix": "10.0.0.0/8", "break_prefixlen": "/30"})
+
+    assert response.status_code == 200
+    assert response.json() == {"subnet_prefix": "10.0.0.0/8", "break_prefixlen": 30, "count": 4194304, "mode": "refused",
+                               "first": ["10.0.0.0/30", "10.0.0.4/30"], "last": ["10.255.255.248/30", "10.255.255.252/30"]}
+    mock_mongo_subnet.insert_many.assert_not_called()
+
+
+# ✅ Test: Break above the maximum child count refused
+def test_break_subnet_too_many_children(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+    mock_mongo_subnet.insert_many = AsyncMock(return_value=None)
+
+    response = client.put("/break_subnet/", json={"subnet_prefix": "10.0.0.0/8", "break_prefixlen": "/30"})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Too many subnets, a break can create up to 1048576 subnets!"}
+    mock_mongo_subnet.insert_many.assert_not_called()
+
+
+# ✅ Test: Large Break submitted as a background job, and run with progress
+def test_break_subnet_background_job(mock_mongo_subnet, mock_subnet_index):
+    import asyncio
+    from Main import run_break_job
+    from scan_scheduler import ScanScheduler
+    mock_subnet_index.insert("10.1.0.0/16", "10.1.0.0/16")
+    mock_mongo_subnet.insert_many = AsyncMock(return_value=None)
+
+    with patch("Main.BREAK_SYNC_CHILDREN", 2), patch("Main.BREAK_WRITE_BATCH_SIZE", 3), patch("Main.break_scheduler", ScanScheduler(run_break_job)) as scheduler:
+        response = client.put("/break_subnet/", json={"subnet_prefix": "10.1.0.0/16", "break_prefixlen": "/18"})
+        assert response.status_code == 200
+        job_id = response.json()["job_id"]
+        mock_mongo_subnet.insert_many.assert_not_called()
+
+        job = scheduler.get(job_id)
+        asyncio.run(scheduler.run(job))
+
+        progress = client.get(f"/break_jobs/{job_id}").json()
+
+    assert progress["status"] == "completed"
+    assert (progress["total"], progress["done"]) == (4, 4)
+    assert progress["params"] == {"subnet_prefix": "10.1.0.0/16", "break_prefixlen": 18}
+    assert mock_mongo_subnet.insert_many.call_count == 2
+    assert len(mock_subnet_index.children("10.1.0.0/16")) == 4
+
+
+# ✅ Test: Break Job whose Subnet is Deleted before it Runs
+def test_break_subnet_job_subnet_deleted(mock_mongo_subnet, mock_subnet_index):
+    import asyncio
+    from Main import run_break_job
+    from scan_scheduler import ScanScheduler
+    mock_subnet_index.insert("10.1.0.0/16", "10.1.0.0/16")
+    mock_mongo_subnet.insert_many = AsyncMock(return_value=None)
+
+    with patch("Main.BREAK_SYNC_CHILDREN", 2), patch("Main.break_scheduler", ScanScheduler(run_break_job)) as scheduler:
+        job_id = client.put("/break_subnet/", json={"subnet_prefix": "10.1.0.0/16", "break_prefixlen": "/18"}).json()["job_id"]
+        mock_subnet_index.remove("10.1.0.0/16")
+
+        asyncio.run(scheduler.run(scheduler.get(job_id)))
+        progress = client.get(f"/break_jobs/{job_id}").json()
+
+    assert (progress["done"], progress["error"]) == (0, "Subnet not found")
+    mock_mongo_subnet.insert_many.assert_not_called()
+
+
+# ✅ Test: Break releases the Root Lock between Batches, the next Batch sees the Subnets Added meanwhile
+def test_break_subnet_lock_released_between_batches(mock_mongo_subnet, mock_subnet_index):
+    import asyncio
+    from Main import get_subnet_lock, write_break_subnets
+    mock_subnet_index.insert("10.1.0.0/16", "10.1.0.0/16")
+    mock_mongo_subnet.insert_many = AsyncMock(return_value=None)
+
+    locked = []
+    def progress(done):
+        locked.append(get_subnet_lock("10.1.0.0/16").locked())
+        if len(locked) == 1:
+            # Added by another request between the batches
+            mock_subnet_index.insert("10.1.200.0/24", "10.1.0.0/16")
+            mock_subnet_index.insert("10.1.128.0/18", "10.1.0.0/16")
+
+    with patch("Main.BREAK_WRITE_BATCH_SIZE", 2):
+        asyncio.run(write_break_subnets("10.1.0.0/16", 18, progress))
+
+    assert locked == [False, False]
+    inserted = [subnet for call in mock_mongo_subnet.insert_many.call_args_list for subnet in call.args[0]]
+    assert [subnet["subnet_prefix"] for subnet in inserted] == ["10.1.0.0/18", "10.1.64.0/18", "10.1.192.0/18"]
+    moved = mock_mongo_subnet.bulk_write.call_args_list[-2].args[0]
+    assert [(update._filter, update._doc) for update in moved] == [({"subnet_prefix": "10.1.200.0/24"}, {"$set": {"subnet_parent": "10.1.192.0/18"}})]
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [update._filter for update in utilization_update] == [{"subnet_prefix": "10.1.0.0/16"}, {"subnet_prefix": "10.1.192.0/18"}]
+
+
+# ✅ Test: Add Major Subnet, duplicate rejected by the unique index
+def test_add_major_subnet_duplicate_key(mock_mongo_subnet, mock_subnet_index):
+    from pymongo.errors import DuplicateKeyError
+    mock_mongo_subnet.find_one.return_value = None
+    mock_mongo_subnet.insert_one.side_effect = DuplicateKeyError("E11000 duplicate key error")
+
+    response = client.post("/subnets/", json=subnet_dict)
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Major Subnet already exists"}
+    assert "192.168.1.0/24" not in mock_subnet_index
+
+
+# ✅ Test: Major Subnets API, keyset pagination on the network address
+def test_list_major_subnets_pagination(mock_mongo_subnet):
+    mock_subnets = [{"_id": ObjectId(), "subnet_prefix": f"10.{i}.0.0/16", "net_version": 4, "net_start": 167772160 + i * 65536,
+                     "net_end": 167772160 + i * 65536 + 65535} for i in range(3)]
+    mock_mongo_subnet.find.return_value.to_list = AsyncMock(return_value=mock_subnets)
+
+    response = client.get("/api/subnets?limit=2")
+
+    assert response.status_code == 200
+    result = response.json()
+    assert [subnet["subnet_prefix"] for subnet in result["subnets"]] == ["10.0.0.0/16", "10.1.0.0/16"]
+    assert result["next"]
+
+    query, projection = mock_mongo_subnet.find.call_args.args
+    assert query == {"subnet_parent": {"$in": ["", None]}}
+    assert "subnet_description" in projection
+    assert mock_mongo_subnet.find.call_args.kwargs == {"sort": [("net_version", 1), ("net_start", 1), ("net_end", -1)], "limit": 3}
+
+    mock_mongo_subnet.find.return_value.to_list = AsyncMock(return_value=mock_subnets[2:])
+    response = client.get(f"/api/subnets?limit=2&after={result['next']}")
+
+    assert response.json()["next"] is None
+    query, projection = mock_mongo_subnet.find.call_args.args
+    assert query == {"$and": [{"subnet_parent": {"$in": ["", None]}},
+                              {"$or": [{"net_version": {"$gt": 4}}, {"net_version": 4, "net_start": {"$gt": 167837696}},
+                                       {"net_version": 4, "net_start": 167837696, "net_end": {"$lt": 167903231}}]}]}
+
+
+# ✅ Test: Subnet Detail API, children sorted by name
+def test_get_subnet_detail_api_sorted(mock_mongo_subnet):
+    mock_mongo_subnet.find_one.return_value = {"_id": moc_id, "subnet_prefix": "192.168.1.0/24"}
+
+    response = client.get("/api/subnets/192.168.1.0-24?sort=name&order=desc")
+
+    assert response.status_code == 200
+    assert response.json() == {"subnet": {"_id": str(moc_id), "subnet_prefix": "192.168.1.0/24"}, "subnets": [], "next": None}
+    assert mock_mongo_subnet.find.call_args.args[0] == {"subnet_parent": "192.168.1.0/24"}
+    assert mock_mongo_subnet.find.call_args.kwargs["sort"] == [("subnet_name", -1), ("net_version", -1), ("net_start", -1), ("net_end", 1)]
+
+    response = client.get("/api/subnets/192.168.1.0-24?after=not-a-cursor")
+    assert response.status_code == 400
+
+
+# ✅ Test: Search the subnets containing an IP address
+def test_search_contains(mock_mongo_subnet, mock_subnet_index):
+    for prefix in ["10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24"]:
+        mock_subnet_index.insert(prefix, "10.0.0.0/8")
+    mock_mongo_subnet.find.return_value.to_list = AsyncMock(return_value=[
+        {"_id": ObjectId(), "subnet_prefix": "10.0.0.0/8"},
+        {"_id": ObjectId(), "subnet_prefix": "10.1.1.0/24"},
+        {"_id": ObjectId(), "subnet_prefix": "10.1.0.0/16"},
+    ])
+
+    response = client.get("/api/search?mode=contains&q=10.1.1.20")
+
+    assert response.status_code == 200
+    assert [subnet["subnet_prefix"] for subnet in response.json()["results"]] == ["10.1.1.0/24", "10.1.0.0/16", "10.0.0.0/8"]
+    assert mock_mongo_subnet.find.call_args.args[0] == {"subnet_prefix": {"$in": ["10.1.1.0/24", "10.1.0.0/16", "10.0.0.0/8"]}}
+
+
+# ✅ Test: Search the subnets inside a range
+def test_search_within(mock_mongo_subnet):
+    response = client.get("/api/search?mode=within&q=10.1.0.0/16")
+
+    assert response.status_code == 200
+    assert response.json() == {"mode": "within", "query": "10.1.0.0/16", "results": [], "next": None}
+    assert mock_mongo_subnet.find.call_args.args[0] == {"net_version": 4, "net_start": {"$gte": 167837696}, "net_end": {"$lte": 167903231}}
+
+
+# ✅ Test: Search within a subnet, paged one subnet at a time through nested subnets starting at the same address
+def test_search_within_pages_nested():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from db_schema import get_network_fields
+    subnets = mongomock_motor.AsyncMongoMockClient()["network_db"]["subnets"]
+    prefixes = ["10.0.0.0/8", "10.0.0.0/16", "10.0.0.0/24", "10.1.0.0/16", "11.0.0.0/8", "2001:db8::/32"]
+    for prefix in prefixes:
+        asyncio.run(subnets.insert_one({"subnet_prefix": prefix, **get_network_fields(prefix)}))
+
+    found = []
+    url = "/api/search?mode=within&q=10.0.0.0/8&limit=1"
+    with patch("Main.collection", subnets):
+        response = client.get(url).json()
+        while True:
+            found += [subnet["subnet_prefix"] for subnet in response["results"]]
+            if not response["next"]:
+                break
+            response = client.get(f"{url}&after={response['next']}").json()
+
+    assert found == ["10.0.0.0/8", "10.0.0.0/16", "10.0.0.0/24", "10.1.0.0/16"]
+
+
+# ✅ Test: Search the first free blocks under a subnet
+def test_search_free(mock_mongo_subnet, mock_subnet_index):
+    for prefix in ["10.0.0.0/8", "10.0.0.0/24", "10.0.1.0/25"]:
+        mock_subnet_index.insert(prefix, "10.0.0.0/8")
+
+    response = client.get("/api/search?mode=free&q=10.0.0.0/8&prefixlen=24&limit=2")
+
+    assert response.status_code == 200
+    assert response.json()["results"] == [{"subnet_prefix": "10.0.2.0/24"}, {"subnet_prefix": "10.0.3.0/24"}]
+    mock_mongo_subnet.find.assert_not_called()
+
+    response = client.get("/api/search?mode=free&q=10.0.0.0/8&prefixlen=8")
+    assert response.status_code == 400
+
+
+# ✅ Test: Allocate the next free subnet
+def test_allocate_subnet_first_fit(mock_mongo_subnet, mock_subnet_index):
+    for prefix in ["10.0.0.0/16", "10.0.0.0/24", "10.0.2.0/23"]:
+        mock_subnet_index.insert(prefix, "10.0.0.0/16")
+
+    response = client.post("/subnets/10.0.0.0-16/allocate", json={"prefixlen": 24, "subnet_name": "customer"})
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Subnet allocated successfully", "subnet_prefix": "10.0.1.0/24"}
+    inserted = mock_mongo_subnet.insert_one.call_args.args[0]
+    assert (inserted["subnet_prefix"], inserted["subnet_mask"], inserted["subnet_parent"], inserted["subnet_name"]) == ("10.0.1.0/24", "24", "10.0.0.0/16", "customer")
+
+    # The allocated subnet is reserved, the next call gets the next free one
+    response = client.post("/subnets/10.0.0.0-16/allocate", json={"prefixlen": 24})
+    assert response.json()["subnet_prefix"] == "10.0.4.0/24"
+
+
+# ✅ Test: Allocate from the smallest free region that fits
+def test_allocate_subnet_best_fit(mock_mongo_subnet, mock_subnet_index):
+    for prefix in ["10.0.0.0/16", "10.0.0.0/25", "10.0.1.0/24", "10.0.2.0/23", "10.0.4.0/22", "10.0.8.0/21", "10.0.16.0/20", "10.0.32.0/19", "10.0.64.0/18", "10.0.128.0/18", "10.0.192.0/19", "10.0.240.0/20"]:
+        mock_subnet_index.insert(prefix, "10.0.0.0/16")
+    # Free regions: 10.0.0.128/25 and 10.0.224.0/20
+
+    response = client.post("/subnets/10.0.0.0-16/allocate", json={"prefixlen": 26, "strategy": "best"})
+    assert response.json()["subnet_prefix"] == "10.0.0.128/26"
+
+    response = client.post("/subnets/10.0.0.0-16/allocate", json={"prefixlen": 20})
+    assert response.json()["subnet_prefix"] == "10.0.224.0/20"
+
+    response = client.post("/subnets/10.0.0.0-16/allocate", json={"prefixlen": 20})
+    assert response.status_code == 409
+    assert response.json() == {"detail": "No free subnet available"}
+
+
+# ✅ Test: Concurrent allocations never get the same subnet
+def test_allocate_subnet_concurrent(mock_mongo_subnet, mock_subnet_index):
+    import asyncio
+    from Main import allocate_subnet, SubnetAllocation
+
+    mock_subnet_index.insert("10.0.0.0/24", "10.0.0.0/24")
+
+    async def slow_insert(document):
+        await asyncio.sleep(0)
+    mock_mongo_subnet.insert_one.side_effect = slow_insert
+
+    async def allocate_all():
+        return await asyncio.gather(*(allocate_subnet("10.0.0.0", "24", SubnetAllocation(prefixlen=28)) for _ in range(16)))
+
+    results = asyncio.run(allocate_all())
+    assert len({result["subnet_prefix"] for result in results}) == 16
+
+
+# ✅ Test: Delete Subnet, parent utilization updated incrementally
+def test_delete_subnet_updates_parent_utilization(mock_mongo_subnet, mock_subnet_index):
+    for prefix in ["10.0.0.0/8", "10.1.0.0/16", "10.2.0.0/16"]:
+        mock_subnet_index.insert(prefix, "10.0.0.0/8")
+    mock_mongo_subnet.find_one.return_value = {"_id": moc_id, "subnet_prefix": "10.1.0.0/16", "subnet_parent": "10.0.0.0/8"}
+
+    response = client.delete(f"/subnet/{moc_id}")
+
+    assert response.status_code == 200
+    mock_mongo_subnet.delete_one.assert_called_once_with({"_id": moc_id})
+    mock_mongo_subnet.find.assert_not_called()    # Children checked in the index
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [(update._filter, update._doc) for update in utilization_update] == [({"subnet_prefix": "10.0.0.0/8"}, {"$set": {"covered_addresses": 65536, "offline_utilization": 0.39}})]
+
+
+# ✅ Test: Delete Subnet Updates the Parent Inserted while the Lock was Awaited
+def test_delete_subnet_parent_inserted_before_lock(mock_mongo_subnet, mock_subnet_index):
+    for prefix in ["10.0.0.0/8", "10.1.1.0/24"]:
+        mock_subnet_index.insert(prefix, "10.0.0.0/8")
+
+    async def read_subnet(query):
+        # Meanwhile 10.1.0.0/16 is added between 10.0.0.0/8 and 10.1.1.0/24
+        mock_subnet_index.insert("10.1.0.0/16", "10.0.0.0/8")
+        return {"_id": moc_id, "subnet_prefix": "10.1.1.0/24", "subnet_parent": "10.0.0.0/8"}
+    mock_mongo_subnet.find_one.side_effect = read_subnet
+
+    response = client.delete(f"/subnet/{moc_id}")
+
+    assert response.status_code == 200
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [(update._filter, update._doc) for update in utilization_update] == [({"subnet_prefix": "10.1.0.0/16"}, {"$set": {"covered_addresses": 0, "offline_utilization": 0.0}})]
+
+
+# ✅ Test: Bulk Delete, one query, one aggregation, one delete and one utilization update, with the outcome of every id
+def test_delete_subnets_bulk(mock_mongo_subnet, mock_subnet_index):
+    from unittest.mock import MagicMock
+    prefixes = ["10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24", "10.1.2.0/24", "10.2.0.0/16", "10.2.1.0/24", "10.3.0.0/16", "10.3.1.0/24", "10.3.1.0/25"]
+    for prefix in prefixes:
+        mock_subnet_index.insert(prefix, "10.0.0.0/8")
+
+    documents = [{"_id": ObjectId(), "subnet_prefix": prefix, "subnet_parent": parent} for prefix, parent in [
+        ("10.1.0.0/16", "10.0.0.0/8"), ("10.1.1.0/24", "10.1.0.0/16"), ("10.2.0.0/16", "10.0.0.0/8"),
+        ("10.2.1.0/24", "10.2.0.0/16"), ("10.3.0.0/16", "10.0.0.0/8"), ("10.3.1.0/24", "10.3.0.0/16")]]
+    mock_mongo_subnet.find.return_value.to_list = AsyncMock(return_value=documents)
+
+    async def children_groups():
+        for group in [{"_id": "10.1.0.0/16"}, {"_id": "10.3.1.0/24"}]:
+            yield group
+    mock_mongo_subnet.aggregate = MagicMock(return_value=children_groups())
+    mock_mongo_subnet.delete_many.return_value.deleted_count = 3
+
+    # Upper case hex ids are valid ObjectIds too
+    ids = [str(documents[0]["_id"]).upper()] + [str(document["_id"]) for document in documents[1:]] + ["not-an-id", str(ObjectId())]
+    response = client.request("DELETE", "/subnets/", json=ids)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Deleted 3 subnets, 5 not deleted"
+    outcomes = {result["subnet_prefix"]: (result["deleted"], result["message"]) for result in response.json()["results"]}
+    assert outcomes == {
+        "10.1.0.0/16": (False, "The subnet contains active smaller subnet(s). Cant' be deleted!"),
+        "10.1.1.0/24": (True, "Subnet Deleted"),
+        "10.2.0.0/16": (True, "Subnet Deleted"),
+        "10.2.1.0/24": (True, "Subnet Deleted"),
+        "10.3.0.0/16": (False, "The subnet contains active smaller subnet(s). Cant' be deleted!"),
+        "10.3.1.0/24": (False, "The subnet contains active smaller subnet(s). Cant' be deleted!"),
+        None: (False, "Subnet not found"),
+    }
+    assert [result["message"] for result in response.json()["results"]][-2:] == ["Invalid subnet id", "Subnet not found"]
+    assert response.json()["results"][0]["id"] == ids[0]
+
+    pipeline = mock_mongo_subnet.aggregate.call_args.args[0]
+    assert set(pipeline[0]["$match"]["subnet_parent"]["$in"]) == {document["subnet_prefix"] for document in documents}
+    deleted_ids = mock_mongo_subnet.delete_many.call_args.args[0]["_id"]["$in"]
+    assert deleted_ids == [documents[1]["_id"], documents[2]["_id"], documents[3]["_id"]]
+    mock_mongo_subnet.find_one.assert_not_called()
+
+    assert "10.2.0.0/16" not in mock_subnet_index and "10.1.0.0/16" in mock_subnet_index
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [update._filter for update in utilization_update] == [{"subnet_prefix": "10.1.0.0/16"}, {"subnet_prefix": "10.0.0.0/8"}]
+
+
+# ✅ Test: Bulk Delete of Subnets Deleted or Moved by Another Request before the Locks are Held
+def test_delete_subnets_changed_before_lock(mock_mongo_subnet, mock_subnet_index):
+    from unittest.mock import MagicMock
+    for prefix in ["10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24", "10.2.0.0/16"]:
+        mock_subnet_index.insert(prefix, "10.0.0.0/8")
+
+    subnet_24 = {"_id": ObjectId(), "subnet_prefix": "10.1.1.0/24", "subnet_parent": "10.1.0.0/16"}
+    subnet_16 = {"_id": ObjectId(), "subnet_prefix": "10.2.0.0/16", "subnet_parent": "10.0.0.0/8"}
+
+    async def read_subnets():
+        if mock_mongo_subnet.find.return_value.to_list.await_count == 1:
+            # Meanwhile 10.2.0.0/16 is deleted, and 10.1.0.0/20 is added between 10.1.0.0/16 and 10.1.1.0/24
+            mock_subnet_index.remove("10.2.0.0/16")
+            mock_subnet_index.insert("10.1.0.0/20", "10.0.0.0/8")
+            return [subnet_24, subnet_16]
+        return [{**subnet_24, "subnet_parent": "10.1.0.0/20"}]
+    mock_mongo_subnet.find.return_value.to_list = AsyncMock(side_effect=read_subnets)
+
+    async def children_groups():
+        return
+        yield
+    mock_mongo_subnet.aggregate = MagicMock(return_value=children_groups())
+    mock_mongo_subnet.delete_many.return_value.deleted_count = 1
+
+    response = client.request("DELETE", "/subnets/", json=[str(subnet_24["_id"]), str(subnet_16["_id"])])
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Deleted 1 subnets, 1 not deleted"
+    assert [(result["subnet_prefix"], result["deleted"], result["message"]) for result in response.json()["results"]] == [
+        ("10.1.1.0/24", True, "Subnet Deleted"), (None, False, "Subnet not found")]
+    assert mock_mongo_subnet.delete_many.call_args.args[0]["_id"]["$in"] == [subnet_24["_id"]]
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [update._filter for update in utilization_update] == [{"subnet_prefix": "10.1.0.0/20"}]
+
+
+# ✅ Test: Scan Job Submitted, job id returned immediately
+def test_submit_scan_job():
+    with patch("Main.scan_scheduler.submit") as mock_submit:
+        mock_submit.return_value.job_id = "job1"
+        mock_submit.return_value.status = "queued"
+        response = client.post("/scan_jobs/", json={"ids": [str(moc_id)]})
+
+    assert response.status_code == 200
+    assert response.json() == {"job_id": "job1", "status": "queued"}
+    mock_submit.assert_called_once_with("ids", [str(moc_id)])
+
+    response = client.post("/scan_jobs/", json={"scope": "everything"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid scan scope"}
+
+
+# ✅ Test: Scan Job Not Found
+def test_get_scan_job_not_found():
+    response = client.get("/scan_jobs/unknown")
+
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Scan job not found"}
+
+
+# ✅ Test: Scan Job Run, results and history written per batch
+def test_run_scan_job(mock_mongo_subnet,mock_mongo_router,mock_router_connection_test,mock_route_scan):
+    import asyncio
+    from Main import run_scan_job
+    from scan_scheduler import ScanJob
+
+    mock_mongo_subnet.find.return_value.to_list = AsyncMock(return_value=[
+        {"_id": moc_id, "subnet_prefix": "10.1.0.0/16"},
+        {"_id": ObjectId(), "subnet_prefix": "10.2.0.0/16"},
+    ])
+    async_mock_find = AsyncMock()
+    async_mock_find.to_list = AsyncMock(return_value=[router1_data_valid])
+    mock_mongo_router.find.return_value = async_mock_find
+
+    mock_router_connection_test.return_value = True
+    mock_route_scan.side_effect = lambda subnet_prefix, *args, **kwargs: {"status": True, "online_status": "Active", "online_utilization": 50.0} if subnet_prefix == "10.1.0.0/16" else {"status": False}
+
+    job = ScanJob("major")
+    with patch("Main.scan_history_collection") as mock_history:
+        mock_history.insert_many = AsyncMock(return_value=None)
+        asyncio.run(run_scan_job(job))
+
+    assert (job.status, job.total, job.done, job.failed) == ("running", 2, 2, 1)
+    mock_mongo_subnet.find.assert_called_once_with({"subnet_parent": {"$in": ["", None]}}, {"subnet_prefix": 1})
+    mock_router_connection_test.assert_not_called()    # No connection test before the scans
+
+    updates = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert [(update._filter, update._doc) for update in updates] == [({"_id": moc_id}, {"$set": {"online_status": "Active", "online_utilization": 50.0}})]
+    history = mock_history.insert_many.call_args.args[0]
+    assert [(record["subnet_prefix"], record["job_id"], record["online_utilization"]) for record in history] == [("10.1.0.0/16", job.job_id, 50.0)]
+
+
+# ✅ Test: Scan Failover, a failing router is skipped once its breaker is open
+def test_scan_subnet_failover(mock_mongo_subnet,mock_mongo_router,mock_route_scan):
+    mock_mongo_subnet.find_one.return_value = {"_id": moc_id, "subnet_prefix": "192.168.1.0/24"}
+    async_mock_find = AsyncMock()
+    async_mock_find.to_list = AsyncMock(return_value=[router1_data_valid, router2_data_valid])
+    mock_mongo_router.find.return_value = async_mock_find
+
+    def route_scan(subnet_prefix, router_vendor, sessions=None, router_id=None, **device_info):
+        if device_info["hostname"] == "192.168.2.1":
+            return {"status": False, "online_status": "", "online_utilization": None}
+        return {"status": True, "online_status": "Active", "online_utilization": 25.0}
+    mock_route_scan.side_effect = route_scan
+
+    with patch("Main.router_pool", RouterPool(failure_threshold=2)):
+        for _ in range(3):
+            response = client.put("/scan_subnet/", json={"subnet_prefix": "192.168.1.0/24"})
+            assert response.json() == {"message": "Subnet Scanned Successfully"}
+
+    # Main router tried twice, then skipped
+    assert [call.kwargs["hostname"] for call in mock_route_scan.call_args_list] == ["192.168.2.1", "192.168.2.2", "192.168.2.1", "192.168.2.2", "192.168.2.2"]
+    mock_mongo_router.find.assert_called_once()    # Routers read once
+    mock_mongo_subnet.update_one.assert_called_with({"_id": moc_id}, {"$set": {"online_status": "Active", "online_utilization": 25.0}})
+
+
+# ✅ Test: Half Open Router Tried by One Scan Only, the Concurrent Scans Use the Next Router
+def test_scan_half_open_trial(mock_route_scan):
+    import asyncio
+    from Main import scan_with_failover
+    from router_pool import CircuitBreaker, RouteSource
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure()
+    breaker.opened -= 60
+    sources = [RouteSource(router1_data_valid, breaker, "test_password"), RouteSource(router2_data_valid, CircuitBreaker(), "test_password")]
+    mock_route_scan.return_value = {"status": True, "online_status": "Active", "online_utilization": 25.0}
+
+    async def scan_concurrently():
+        return await asyncio.gather(*(scan_with_failover("192.168.1.0/24", sources) for _ in range(3)))
+
+    asyncio.run(scan_concurrently())
+
+    assert sorted(call.kwargs["hostname"] for call in mock_route_scan.call_args_list) == ["192.168.2.1", "192.168.2.2", "192.168.2.2"]
+    assert breaker.state == "closed"
+
+
+# ✅ Test: Scan in Race Mode, the first answer is taken
+def test_scan_subnet_race(mock_mongo_subnet,mock_mongo_router,mock_route_scan):
+    import threading
+    mock_mongo_subnet.find_one.return_value = {"_id": moc_id, "subnet_prefix": "192.168.1.0/24"}
+    async_mock_find = AsyncMock()
+    async_mock_find.to_list = AsyncMock(return_value=[router1_data_valid, router2_data_valid])
+    mock_mongo_router.find.return_value = async_mock_find
+
+    slow_router = threading.Event()
+    def route_scan(subnet_prefix, router_vendor, sessions=None, router_id=None, **device_info):
+        if device_info["hostname"] == "192.168.2.1":
+            slow_router.wait(5)
+            return {"status": True, "online_status": "Active", "online_utilization": 100.0}
+        return {"status": True, "online_status": "Active", "online_utilization": 25.0}
+    mock_route_scan.side_effect = route_scan
+
+    response = client.put("/scan_subnet/", json={"subnet_prefix": "192.168.1.0/24", "race": True})
+    slow_router.set()
+
+    assert response.json() == {"message": "Subnet Scanned Successfully"}
+    mock_mongo_subnet.update_one.assert_called_once_with({"_id": moc_id}, {"$set": {"online_status": "Active", "online_utilization": 25.0}})
+
+
+# ✅ Test: Bulk Import, parents from the index, existing subnets moved under the imported ones
+def test_import_subnets(mock_mongo_subnet, mock_subnet_index):
+    import json
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+    mock_subnet_index.insert("10.1.1.0/24", "10.0.0.0/8")
+    mock_mongo_subnet.insert_many = AsyncMock(return_value=None)
+
+    body = (
+        "subnet_prefix,subnet_name,subnet_service,subnet_description\n"
+        "10.1.1.128/25,lan,access,\n"
+        "10.1.0.0/16,core,backbone,\n"
+        "10.0.0.0/8,major,,\n"
+        "172.16.0.0/12,new major,,\n"
+        "10.1.1.0/33,wrong,,\n"
+    )
+    with patch("Main.IMPORT_BATCH_SIZE", 2):
+        response = client.post("/api/import?format=csv", content=body)
+
+    assert response.status_code == 200
+    progress = [json.loads(line) for line in response.text.splitlines()]
+    assert progress[0] == {"processed": 3, "total": 5, "imported": 2, "existing": 1, "failed": 1}
+    assert progress[-1]["imported"] == 3
+    assert progress[-1]["errors"][0]["line"] == 6
+
+    inserted = [document for call in mock_mongo_subnet.insert_many.call_args_list for document in call.args[0]]
+    assert [(document["subnet_prefix"], document["subnet_parent"], document["subnet_root"]) for document in inserted] == [
+        ("10.1.0.0/16", "10.0.0.0/8", "10.0.0.0/8"),
+        ("10.1.1.128/25", "10.1.1.0/24", "10.0.0.0/8"),
+        ("172.16.0.0/12", "", "172.16.0.0/12"),
+    ]
+    moved = mock_mongo_subnet.bulk_write.call_args_list[0].args[0]
+    assert [(update._filter, update._doc) for update in moved] == [({"subnet_prefix": "10.1.1.0/24"}, {"$set": {"subnet_parent": "10.1.0.0/16"}})]
+    assert mock_subnet_index.children("10.1.0.0/16") == ["10.1.1.0/24"]
+
+
+# ✅ Test: Bulk Import, root lock released while the progress is sent
+def test_import_subnets_progress_unlocked(mock_mongo_subnet, mock_subnet_index):
+    import asyncio
+    from Main import get_subnet_lock, import_subnet_rows
+    from subnet_import import SortedRows
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+    mock_mongo_subnet.insert_many = AsyncMock(return_value=None)
+    rows = SortedRows()
+    for index in range(3):
+        rows.append((4, 167772160 + (index << 16), 16, "", "", ""))
+
+    async def run_import():
+        progress = import_subnet_rows(rows, [], 0)
+        await anext(progress)
+        assert not get_subnet_lock("10.0.0.0/8").locked()
+        remaining = [line async for line in progress]
+        assert not get_subnet_lock("10.0.0.0/8").locked()
+        return remaining
+
+    with patch("Main.IMPORT_BATCH_SIZE", 2):
+        assert len(asyncio.run(run_import())) == 1
+    assert mock_subnet_index.children("10.0.0.0/8") == ["10.0.0.0/16", "10.1.0.0/16", "10.2.0.0/16"]
+
+
+# ✅ Test: Bulk Import, parent found once the root lock is held
+def test_import_subnets_tree_changed_while_locked(mock_mongo_subnet, mock_subnet_index):
+    from Main import get_subnet_lock, import_subnet_rows
+    from subnet_import import SortedRows
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+    mock_mongo_subnet.insert_many = AsyncMock(return_value=None)
+    rows = SortedRows()
+    rows.append((4, 167837952, 24, "lan", "", ""))    # 10.1.1.0/24
+
+    async def run_import():
+        root_lock = get_subnet_lock("10.0.0.0/8")
+        await root_lock.acquire()
+        progress = asyncio.ensure_future(anext(import_subnet_rows(rows, [], 0)))
+        await asyncio.sleep(0)
+        # A subnet added under the root while the import waits for the lock
+        mock_subnet_index.insert("10.1.0.0/16", "10.0.0.0/8")
+        root_lock.release()
+        return await progress
+
+    asyncio.run(run_import())
+
+    document = mock_mongo_subnet.insert_many.call_args.args[0][0]
+    assert (document["subnet_prefix"], document["subnet_parent"], document["subnet_root"]) == ("10.1.1.0/24", "10.1.0.0/16", "10.0.0.0/8")
+
+
+# ✅ Test: Bulk Import, wrong format
+def test_import_subnets_invalid_format():
+    response = client.post("/api/import?format=xlsx", content="")
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid import format"}
+
+
+# ✅ Test: Streaming Export of a Subtree as CSV
+def test_export_subnets_csv(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("10.0.0.0/8", "10.0.0.0/8")
+    mock_mongo_subnet.find.return_value.__aiter__.return_value = [
+        {"subnet_prefix": "10.0.0.0/8", "subnet_parent": "", "subnet_root": "10.0.0.0/8", "subnet_name": "major", "subnet_service": "",
+         "subnet_description": "Site A, B", "offline_utilization": 0.39, "covered_addresses": 65536, "online_status": "Active", "online_utilization": 12.5},
+        {"subnet_prefix": "10.1.0.0/16", "subnet_parent": "10.0.0.0/8", "subnet_root": "10.0.0.0/8", "subnet_name": "core"},
+    ]
+
+    with patch("Main.EXPORT_BATCH_SIZE", 1):
+        response = client.get("/api/export?format=csv&root=10.0.0.0/8")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines() == [
+        "subnet_prefix,subnet_parent,subnet_root,subnet_name,subnet_service,subnet_description,offline_utilization,covered_addresses,online_status,online_utilization",
+        '10.0.0.0/8,,10.0.0.0/8,major,,"Site A, B",0.39,65536,Active,12.5',
+        "10.1.0.0/16,10.0.0.0/8,10.0.0.0/8,core,,,,,,",
+    ]
+    query = mock_mongo_subnet.find.call_args.args[0]
+    assert query == {"net_version": 4, "net_start": {"$gte": 167772160}, "net_end": {"$lte": 184549375}}
+    assert mock_mongo_subnet.find.call_args.kwargs["batch_size"] == 1
+
+
+# ✅ Test: Streaming Export as NDJSON
+def test_export_subnets_ndjson(mock_mongo_subnet):
+    import json
+    mock_mongo_subnet.find.return_value.__aiter__.return_value = [{"_id": moc_id, "subnet_prefix": "10.0.0.0/8", "offline_utilization": 0.0}]
+
+    response = client.get("/api/export")
+
+    assert response.status_code == 200
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert exported[0]["subnet_prefix"] == "10.0.0.0/8"
+    assert "_id" not in exported[0]
+    assert mock_mongo_subnet.find.call_args.args[0] == {}
+
+    response = client.get("/api/export?root=192.168.0.0/16")
+    assert response.status_code == 404
+
+
+# ✅ Test: Add IPv6 Subnet
+def test_add_subnet_ipv6(mock_mongo_subnet, mock_subnet_index):
+    mock_subnet_index.insert("2001:db8::/32", "2001:db8::/32")
+
+    new_subnet = {**subnet_dict, "subnet_id": "2001:DB8:1::", "subnet_mask": "48"}
+    response = client.post("/subnets/2001:db8::-32/add-subnet", json=new_subnet)
+
+    assert response.status_code == 200
+    inserted = mock_mongo_subnet.insert_one.call_args.args[0]
+    assert (inserted["subnet_prefix"], inserted["subnet_parent"]) == ("2001:db8:1::/48", "2001:db8::/32")
+    assert inserted["net_start"] == Binary(bytes.fromhex("20010db8000100000000000000000000"))
+    assert inserted["covered_addresses"] == "0"
+    utilization_update = mock_mongo_subnet.bulk_write.call_args.args[0]
+    assert utilization_update[0]._doc == {"$set": {"covered_addresses": str(1 << 80), "offline_utilization": 0.0}}
+
+    new_subnet = {**subnet_dict, "subnet_id": "2001:db8:2::", "subnet_mask": "129"}
+    response = client.post("/subnets/2001:db8::-32/add-subnet", json=new_subnet)
+    assert response.json() == {"detail": "Wrong subnet Mask, Please input mask in range (0 to 128) !"}
+
+    new_subnet = {**subnet_dict, "subnet_id": "10.0.0.0", "subnet_mask": "8"}
+    response = client.post("/subnets/2001:db8::-32/add-subnet", json=new_subnet)
+    assert response.json() == {"detail": "Invalid Subnet."}
+
+
+# ✅ Test: Page Cursor over IPv6 Network Addresses
+def test_page_cursor_ipv6(mock_mongo_subnet):
+    from db_schema import get_network_fields
+    subnets = [{"_id": ObjectId(), "subnet_prefix": prefix, **get_network_fields(prefix)} for prefix in ["2001:db8::/32", "2001:db9::/32"]]
+    mock_mongo_subnet.find.return_value.to_list = AsyncMock(return_value=subnets)
+
+    response = client.get("/api/subnets?limit=1")
+
+    result = response.json()
+    assert result["subnets"][0]["net_start"] == 0x20010db8000000000000000000000000
+    client.get(f"/api/subnets?limit=1&after={result['next']}")
+    query = mock_mongo_subnet.find.call_args.args[0]
+    assert query["$and"][1]["$or"][1] == {"net_version": 6, "net_start": {"$gt": Binary(bytes.fromhex("20010db8000000000000000000000000"))}}
+
+
+# ✅ Test: Page Cursor from the last IPv4 Subnet Reaches the IPv6 Subnets
+def test_page_cursor_address_family(mock_mongo_subnet):
+    from db_schema import get_network_fields
+    subnets = [{"_id": ObjectId(), "subnet_prefix": prefix, "subnet_name": "Core", **get_network_fields(prefix)} for prefix in ["10.0.0.0/8", "2001:db8::/32"]]
+    mock_mongo_subnet.find.return_value.to_list = AsyncMock(return_value=subnets)
+
+    result = client.get("/api/subnets?limit=1&sort=name&order=desc").json()
+    client.get(f"/api/subnets?limit=1&sort=name&order=desc&after={result['next']}")
+
+    query = mock_mongo_subnet.find.call_args.args[0]
+    assert query["$and"][1] == {"$or": [{"subnet_name": {"$lt": "Core"}},
+                                        {"subnet_name": "Core", "net_version": {"$lt": 4}},
+                                        {"subnet_name": "Core", "net_version": 4, "net_start": {"$lt": 167772160}},
+                                        {"subnet_name": "Core", "net_version": 4, "net_start": 167772160, "net_end": {"$gt": 184549375}}]}
+
+    response = client.get(f"/api/subnets?limit=1&after={result['next']}")
+    assert response.status_code == 400
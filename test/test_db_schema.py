@@ -0,0 +1,105 @@
+import asyncio
+from bson import Binary
+from unittest.mock import AsyncMock, MagicMock
+from utils import decrypt_password, get_secret_key
+from db_schema import reencrypt_router_passwords, ensure_indexes, ensure_scan_history, backfill_network_fields, backfill_covered_addresses, get_network_fields, decode_address
+from subnet_trie import SubnetTrie
+
+
+# ✅ Test: Numeric Network Fields
+def test_get_network_fields():
+    assert get_network_fields("10.0.0.0/8") == {"net_version": 4, "net_start": 167772160, "net_end": 184549375}
+    assert get_network_fields("192.168.1.5/32") == {"net_version": 4, "net_start": 3232235781, "net_end": 3232235781}
+
+
+# ✅ Test: Indexes Created
+def test_ensure_indexes():
+    collection = MagicMock(create_index=AsyncMock())
+    router_collection = MagicMock(create_index=AsyncMock())
+
+    asyncio.run(ensure_indexes(collection, router_collection))
+
+    indexes = {call.kwargs["name"]: call for call in collection.create_index.call_args_list}
+    assert indexes["subnet_prefix_unique"].kwargs["unique"]
+    assert set(indexes) == {"subnet_prefix_unique", "subnet_parent_net_range", "subnet_root", "net_version_range"}
+    assert indexes["subnet_parent_net_range"].args[0] == [("subnet_parent", 1), ("net_version", 1), ("net_start", 1), ("net_end", -1)]
+    assert indexes["net_version_range"].args[0] == [("net_version", 1), ("net_start", 1), ("net_end", -1)]
+    assert router_collection.create_index.call_args.kwargs == {"unique": True, "name": "router_ip_unique"}
+
+
+# ✅ Test: Backfill of the Subnets Missing Network Fields
+def test_backfill_network_fields():
+    collection = MagicMock(bulk_write=AsyncMock())
+    collection.find.return_value.__aiter__.return_value = [
+        {"_id": 1, "subnet_prefix": "10.0.0.0/8"},
+        {"_id": 2, "subnet_prefix": "10.1.0.0/16"},
+        {"_id": 3, "subnet_prefix": "10.2.0.0/16"},
+    ]
+
+    assert asyncio.run(backfill_network_fields(collection, batch_size=2)) == 3
+
+    collection.find.assert_called_once_with({"net_version": {"$exists": False}}, {"subnet_prefix": 1})
+    assert collection.bulk_write.call_count == 2
+    assert collection.bulk_write.call_args.args[0][0]._doc == {"$set": {"net_version": 4, "net_start": 167903232, "net_end": 167968767}}
+
+
+# ✅ Test: Backfill of the Subnets Missing Covered Addresses, counted by the index
+def test_backfill_covered_addresses():
+    subnet_index = SubnetTrie()
+    for subnet_prefix, subnet_root in [("10.0.0.0/8", "10.0.0.0/8"), ("10.1.0.0/16", "10.0.0.0/8"), ("2001:db8::/32", "2001:db8::/32"), ("2001:db8::/48", "2001:db8::/32")]:
+        subnet_index.insert(subnet_prefix, subnet_root)
+    collection = MagicMock(bulk_write=AsyncMock())
+    collection.find.return_value.__aiter__.return_value = [
+        {"_id": 1, "subnet_prefix": "10.0.0.0/8"},
+        {"_id": 2, "subnet_prefix": "10.1.0.0/16"},
+        {"_id": 3, "subnet_prefix": "2001:db8::/32"},
+        {"_id": 4, "subnet_prefix": "10.9.0.0/16"},     # Not in the index
+    ]
+
+    assert asyncio.run(backfill_covered_addresses(collection, subnet_index)) == 3
+
+    collection.find.assert_called_once_with({"covered_addresses": {"$exists": False}}, {"subnet_prefix": 1})
+    assert [update._doc for update in collection.bulk_write.call_args.args[0]] == [
+        {"$set": {"covered_addresses": 65536}}, {"$set": {"covered_addresses": 0}}, {"$set": {"covered_addresses": str(1 << 80)}}]
+
+
+# ✅ Test: Scan History Time Series Collection
+def test_ensure_scan_history():
+    from pymongo.errors import CollectionInvalid
+    db = MagicMock(create_collection=AsyncMock(side_effect=CollectionInvalid("collection scan_history already exists")))
+    db.__getitem__.return_value.create_index = AsyncMock()
+
+    asyncio.run(ensure_scan_history(db, retention=3600))
+
+    assert db.create_collection.call_args.kwargs["timeseries"]["metaField"] == "subnet_prefix"
+    assert db.create_collection.call_args.kwargs["expireAfterSeconds"] == 3600
+    assert db["scan_history"].create_index.call_args.kwargs == {"name": "subnet_prefix_scanned_at"}
+
+
+# ✅ Test: IPv6 Network Fields Stored as Fixed Width Binary
+def test_get_network_fields_ipv6():
+    network_fields = get_network_fields("2001:db8::/32")
+
+    assert network_fields["net_start"] == Binary(bytes.fromhex("20010db8000000000000000000000000"))
+    assert network_fields["net_end"] == Binary(bytes.fromhex("20010db8ffffffffffffffffffffffff"))
+    assert decode_address(network_fields["net_end"]) == 0x20010db8ffffffffffffffffffffffff
+    assert decode_address(167772160) == 167772160
+
+
+# ✅ Test: Router Passwords Encrypted Again with the EAX Tag
+def test_reencrypt_router_passwords():
+    import base64
+    from Cryptodome.Cipher import AES
+    cipher = AES.new(get_secret_key(), AES.MODE_EAX)
+    legacy = base64.b64encode(cipher.nonce + cipher.encrypt(b"secret")).decode()
+
+    router_collection = MagicMock(update_one=AsyncMock())
+    router_collection.find.return_value.__aiter__.return_value = [{"_id": 1, "router_password": legacy}, {"_id": 2, "router_password": "not base64!"}]
+
+    assert asyncio.run(reencrypt_router_passwords(router_collection)) == 1
+
+    assert router_collection.find.call_args.args[0] == {"router_password": {"$not": {"$regex": "^v2:"}}}
+    router_id, update = router_collection.update_one.call_args.args
+    assert router_id == {"_id": 1}
+    assert update["$set"]["router_password"].startswith("v2:")
+    assert decrypt_password(update["$set"]["router_password"]) == "secret"
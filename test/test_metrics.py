@@ -0,0 +1,120 @@
+import asyncio
+import types
+import pytest
+from unittest.mock import MagicMock, patch
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import metrics
+from metrics import Histogram, MetricsMiddleware, MongoCommandMetrics, Registry, timed
+from utils import route_scan
+
+
+def mongo_event(command_name, duration_micros=1500):
+    return types.SimpleNamespace(command_name=command_name, duration_micros=duration_micros)
+
+
+# ✅ Test: Counter Series per Label Values, Rendered in the Prometheus Text Format
+def test_counter_render():
+    registry = Registry()
+    counter = registry.counter("test_calls_total", "Calls.", ["outcome"])
+    counter.inc(outcome="success")
+    counter.inc(2, outcome="success")
+    counter.inc(outcome='fail"ure')
+
+    assert registry.render() == ('# HELP test_calls_total Calls.\n# TYPE test_calls_total counter\n'
+                                 'test_calls_total{outcome="fail\\"ure"} 1\ntest_calls_total{outcome="success"} 3\n')
+
+
+# ✅ Test: Histogram Buckets are Cumulative, with +Inf, Sum and Count
+def test_histogram_samples():
+    histogram = Histogram("test_seconds", "Time.", ["stage"], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, stage="parse")
+
+    samples = {(suffix, labels.get("le")): value for suffix, labels, value in histogram.get_samples()}
+    assert samples[("_bucket", "0.1")] == 2
+    assert samples[("_bucket", "1.0")] == 3
+    assert samples[("_bucket", "+Inf")] == 4
+    assert samples[("_sum", None)] == 5.65
+    assert samples[("_count", None)] == 4
+    assert 'test_seconds_bucket{stage="parse",le="+Inf"} 4' in histogram.render()
+
+
+# ✅ Test: Duplicate Metric Names are Refused
+def test_duplicate_metric():
+    registry = Registry()
+    registry.counter("test_total", "Test.")
+    with pytest.raises(ValueError):
+        registry.counter("test_total", "Test.")
+
+
+# ✅ Test: timed() as Context Manager, Decorator and Coroutine Decorator
+def test_timed():
+    histogram = Histogram("test_seconds", "Time.", ["operation"])
+
+    with timed(histogram, operation="block"):
+        pass
+
+    @timed(histogram, operation="function")
+    def function(value):
+        return value * 2
+
+    @timed(histogram, operation="coroutine")
+    async def coroutine(value):
+        return value * 3
+
+    assert function(2) == 4
+    assert asyncio.run(coroutine(2)) == 6
+    with pytest.raises(ValueError), timed(histogram, operation="error"):
+        raise ValueError("failed")
+
+    assert function.__name__ == "function"
+    assert {key: series[2] for key, series in histogram.series.items()} == {("block",): 1, ("function",): 1, ("coroutine",): 1, ("error",): 1}
+
+
+# ✅ Test: Requests Timed per Route Template, with their MongoDB Commands
+def test_middleware_and_mongo_commands():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    listener = MongoCommandMetrics()
+
+    @app.get("/test-metrics/{item_id}")
+    async def get_item(item_id: str):
+        listener.succeeded(mongo_event("find"))
+        listener.failed(mongo_event("update"))
+        return {"item_id": item_id}
+
+    client = TestClient(app)
+    assert client.get("/test-metrics/1").status_code == 200
+    assert client.get("/test-metrics/2").status_code == 200
+    assert client.get("/test-metrics-missing").status_code == 404
+
+    handler = "/test-metrics/{item_id}"
+    assert metrics.REQUEST_SECONDS.series[(handler, "GET", "200")][2] == 2
+    assert metrics.REQUEST_SECONDS.series[("other", "GET", "404")][2] >= 1
+    assert metrics.MONGO_COMMAND_SECONDS.series[(handler, "find")][2] == 2
+    assert metrics.MONGO_COMMAND_FAILURES.series[(handler, "update")] == 2
+    # Two commands per request
+    assert metrics.MONGO_COMMANDS_PER_REQUEST.series[(handler,)][1:] == [4, 2]
+
+
+# ✅ Test: MongoDB Commands Outside of a Request are Counted as Background
+def test_mongo_commands_background():
+    before = metrics.MONGO_COMMAND_SECONDS.series.get(("background", "testCommand"), [None, 0, 0])[2]
+    MongoCommandMetrics().succeeded(mongo_event("testCommand"))
+    assert metrics.MONGO_COMMAND_SECONDS.series[("background", "testCommand")][2] == before + 1
+
+
+# ✅ Test: Router Scan Outcomes and Stage Timings
+def test_route_scan_metrics():
+    device = MagicMock()
+    device.cli.return_value = {"show ip route 10.0.0.0 255.0.0.0 longer-prefixes": "O 10.0.0.0/9 [110/20] via 10.255.0.1"}
+    with patch("utils.open_router_device", return_value=device):
+        assert route_scan("10.0.0.0/8", "Cisco", hostname="192.0.2.10", username="admin", password="secret")["online_utilization"] == 50.0
+    with patch("utils.open_router_device", side_effect=ConnectionError("unreachable")):
+        assert route_scan("10.0.0.0/8", "Cisco", hostname="192.0.2.10", username="admin", password="secret")["status"] is False
+
+    assert metrics.ROUTER_CALLS.series[("route_scan", "Cisco", "192.0.2.10", "success")] >= 1
+    assert metrics.ROUTER_CALLS.series[("route_scan", "Cisco", "192.0.2.10", "failure")] >= 1
+    assert metrics.ROUTER_SECONDS.series[("Cisco", "192.0.2.10", "command")][2] >= 1
+    assert metrics.ROUTER_SECONDS.series[("Cisco", "192.0.2.10", "parse")][2] >= 1
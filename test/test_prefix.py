@@ -0,0 +1,63 @@
+import ipaddress
+import pytest
+from prefix import Prefix
+
+
+# ✅ Test: Parse and Format IPv4 and IPv6 Prefixes
+def test_parse_prefix():
+    prefix = Prefix.parse("10.1.0.0/16")
+    assert (prefix.address, prefix.prefixlen, prefix.version) == (167837696, 16, 4)
+    assert str(prefix) == "10.1.0.0/16"
+    assert prefix.size == 65536
+    assert prefix.last_address == int(ipaddress.ip_address("10.1.255.255"))
+
+    prefix = Prefix.parse("2001:DB8:0:0::/48")
+    assert prefix.version == 6
+    assert str(prefix) == "2001:db8::/48"
+
+    assert str(Prefix.parse("10.1.2.3/16")) == "10.1.0.0/16"
+    assert str(Prefix.parse("10.1.2.3")) == "10.1.2.3/32"
+
+
+# ✅ Test: Wrong Prefixes Refused Like ipaddress
+@pytest.mark.parametrize("prefix", ["10.1.0/16", "10.01.0.0/16", "10.256.0.0/16", "10.1.0.0/33", "10.1.0.0/-1",
+                                    "10.1.0.0/", "2001:db8::/129", "2001:db8::g/64", "", "a.b.c.d/8"])
+def test_parse_invalid_prefix(prefix):
+    with pytest.raises(ValueError):
+        Prefix.parse(prefix)
+
+
+# ✅ Test: Strict Parsing Refuses Host Bits
+def test_parse_strict():
+    with pytest.raises(ValueError):
+        Prefix.parse("10.1.2.3/16", strict=True)
+    assert Prefix.parse("10.1.0.0/16", strict=True) == Prefix.parse("10.1.0.0/16")
+
+
+# ✅ Test: Subnets Generated Like ipaddress, with a Window
+def test_subnets():
+    main = Prefix.parse("10.16.0.0/12")
+    expected = [str(subnet) for subnet in ipaddress.ip_network("10.16.0.0/12").subnets(new_prefix=20)]
+
+    assert main.count_subnets(20) == len(expected)
+    assert [str(subnet) for subnet in main.subnets(20)] == expected
+    assert [str(subnet) for subnet in main.subnets(20, start=3, stop=6)] == expected[3:6]
+
+    v6 = Prefix.parse("2001:db8::/32")
+    assert [str(subnet) for subnet in v6.subnets(34)] == ["2001:db8::/34", "2001:db8:4000::/34", "2001:db8:8000::/34", "2001:db8:c000::/34"]
+
+    with pytest.raises(ValueError):
+        list(main.subnets(8))
+
+
+# ✅ Test: Containment, Equality and Ordering
+def test_contains_and_order():
+    main = Prefix.parse("10.0.0.0/8")
+    assert main.contains(Prefix.parse("10.1.0.0/16"))
+    assert main.contains(main)
+    assert not Prefix.parse("10.1.0.0/16").contains(main)
+    assert not main.contains(Prefix.parse("::/0"))
+
+    prefixes = [Prefix.parse(p) for p in ["2001:db8::/32", "10.1.0.0/16", "10.0.0.0/8", "10.0.0.0/16"]]
+    assert [str(p) for p in sorted(prefixes)] == ["10.0.0.0/8", "10.0.0.0/16", "10.1.0.0/16", "2001:db8::/32"]
+    assert len({Prefix.parse("10.0.0.0/8"), Prefix.parse("10.0.0.1/8")}) == 1
@@ -0,0 +1,58 @@
+from route_snapshot import RouteSnapshot, RouteSnapshotCache
+from utils import get_subnet_utilization, parse_routes
+
+
+route_table = """
+Codes: L - local, C - connected, S - static, B - BGP
+      10.0.0.0/8 is variably subnetted, 5 subnets, 4 masks
+B        10.1.0.0/16 [200/0] via 192.168.0.1, 1d00h
+B        10.1.1.0/24 [200/0] via 192.168.0.1, 1d00h
+B        10.1.2.0/25 [200/0] via 192.168.0.1, 1d00h
+S        10.2.0.0/24 [1/0] via 192.168.0.2
+B        172.16.0.0/12 [200/0] via 192.168.0.1, 1d00h
+"""
+
+
+# ✅ Test: Snapshot Lookup gives the same result as a Route Scan of the subnet
+def test_snapshot_lookup():
+    routes = parse_routes(route_table)
+    snapshot = RouteSnapshot(routes)
+
+    assert len(snapshot) == 6
+    routes_under = {
+        "10.0.0.0/8": ["10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24", "10.1.2.0/25", "10.2.0.0/24"],
+        "10.1.0.0/16": ["10.1.0.0/16", "10.1.1.0/24", "10.1.2.0/25"],
+        "10.1.0.0/20": ["10.1.1.0/24", "10.1.2.0/25"],
+        "10.2.0.0/16": ["10.2.0.0/24"],
+    }
+    for subnet, routes in routes_under.items():
+        assert snapshot.lookup(subnet) == {"online_status": "Active", "online_utilization": get_subnet_utilization(subnet, routes)}
+
+    assert snapshot.lookup("10.1.1.0/24") == {"online_status": "Active", "online_utilization": 0.0}
+    assert snapshot.lookup("10.3.0.0/16") == {"online_status": "Inactive", "online_utilization": 0.0}
+    assert snapshot.lookup("172.16.0.0/16") == {"online_status": "Inactive", "online_utilization": 0.0}
+
+
+# ✅ Test: Snapshot Cache Expiry
+def test_snapshot_cache_ttl():
+    snapshot = RouteSnapshot(["10.1.0.0/16"])
+
+    cache = RouteSnapshotCache(ttl=300)
+    cache.put("router1", snapshot)
+    assert cache.get("router1") is snapshot
+    cache.invalidate("router1")
+    assert cache.get("router1") is None
+
+    cache = RouteSnapshotCache(ttl=0)
+    cache.put("router1", snapshot)
+    assert cache.get("router1") is None
+
+
+# ✅ Test: Snapshot Lookup of IPv6 Subnets
+def test_snapshot_lookup_ipv6():
+    snapshot = RouteSnapshot(["10.0.0.0/8", "2001:db8::/32", "2001:db8::/33", "2001:db8:8000::/34"])
+
+    assert len(snapshot) == 4
+    assert snapshot.lookup("2001:db8::/32") == {"online_status": "Active", "online_utilization": 75.0}
+    assert snapshot.lookup("2001:db9::/32") == {"online_status": "Inactive", "online_utilization": 0.0}
+    assert snapshot.lookup("::/0")["online_utilization"] == 0.0
@@ -0,0 +1,44 @@
+import random
+import pytest
+from utils import get_subnet_utilization, parse_routes
+
+numpy = pytest.importorskip("numpy")
+from route_vector import get_covered_addresses, get_route_utilization, parse_ipv4_routes
+
+
+# ✅ Test: Routes Parsed into Arrays Like parse_routes
+def test_parse_ipv4_routes():
+    output = ("C    10.1.0.0/24 is directly connected\n"
+              "S    10.1.1.5/24 [1/0] via 10.0.0.1\n"
+              "     10.01.0.0/24 leading zeros, 300.1.1.0/24 wrong octet, 10.2.0.0/33 wrong length\n"
+              "     2001:db8::/32 and 0.0.0.0/0\n")
+
+    addresses, prefixlens = parse_ipv4_routes(output)
+
+    routes = [f"{address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}/{prefixlen}" for address, prefixlen in zip(addresses.tolist(), prefixlens.tolist())]
+    assert routes == ["10.1.0.0/24", "10.1.1.0/24", "0.0.0.0/0"]
+    assert routes == [str(route) for route in parse_routes(output, 4)]
+
+
+# ✅ Test: Covered Addresses of Nested and Overlapping Intervals
+def test_get_covered_addresses():
+    starts = numpy.array([10, 0, 12, 30, 5], dtype=numpy.int64)
+    ends = numpy.array([20, 8, 14, 40, 9], dtype=numpy.int64)
+
+    assert get_covered_addresses(starts, ends) == 9 + 10 + 10
+    assert get_covered_addresses(starts[:0], ends[:0]) == 0
+
+
+# ✅ Test: Same Utilization as the Pure Python Path
+def test_get_route_utilization_matches_python():
+    rnd = random.Random(0)
+    lines = []
+    for _ in range(5000):
+        prefixlen = rnd.randint(12, 30)
+        address = (10 << 24) + rnd.randrange(0, 1 << 24)
+        lines.append(f"O    {address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}/{prefixlen} [110/2] via 10.0.0.1")
+    output = "\n".join(lines)
+
+    for main_subnet in ("10.0.0.0/8", "10.128.0.0/9", "10.0.0.0/12"):
+        assert get_route_utilization(main_subnet, output) == get_subnet_utilization(main_subnet, parse_routes(output, 4))
+    assert get_route_utilization("10.0.0.0/8", "") == 0.0
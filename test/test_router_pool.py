@@ -0,0 +1,139 @@
+import pytest
+from unittest.mock import patch
+from router_pool import CircuitBreaker, RouterPool
+from utils import encrypt_password
+
+
+routers = [
+    {"_id": 1, "router_ip": "192.168.2.1", "router_username": "test_username", "router_password": "encrypted1", "router_vendor": "Juniper"},
+    {"_id": 2, "router_ip": "192.168.2.2", "router_username": "test_username", "router_password": "encrypted2", "router_vendor": "Cisco"},
+    {"_id": 3, "router_ip": "192.168.2.3", "router_username": "test_username", "router_password": "encrypted3", "router_vendor": "Huawei"},
+]
+
+
+@pytest.fixture
+def mock_decrypt_password():
+    with patch("router_pool.decrypt_password", side_effect=lambda password: password.replace("encrypted", "password")) as mock:
+        yield mock
+
+
+# ✅ Test: Circuit Breaker Opens, then Half Opens after the Reset Timeout
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    breaker.record_failure()
+    assert breaker.available()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.available()
+
+    breaker.opened -= 60
+    assert breaker.state == "half-open"
+    assert breaker.available()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+# ✅ Test: Half Open Breaker Lets One Trial Call Through
+def test_circuit_breaker_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    assert breaker.acquire() and breaker.acquire()
+
+    breaker.record_failure()
+    breaker.opened -= 60
+    assert breaker.acquire()
+    assert not breaker.available()
+    assert not breaker.acquire()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    breaker.opened -= 60
+
+    # Cancelled trial call, then a trial call that never reported back
+    assert breaker.acquire()
+    breaker.release()
+    assert breaker.acquire()
+    breaker.trial -= 60
+    assert breaker.acquire()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.acquire() and breaker.acquire()
+
+
+# ✅ Test: Credentials Decrypted Once, Reused by the Reloads
+def test_router_pool_load(mock_decrypt_password):
+    pool = RouterPool(ttl=60)
+    assert pool.stale()
+
+    pool.load(routers)
+
+    assert not pool.stale()
+    assert mock_decrypt_password.call_count == 3
+    assert [source.device_info["password"] for source in pool.sources] == ["password1", "password2", "password3"]
+
+    pool.invalidate()
+    assert pool.stale()
+
+    pool.load(routers)
+    assert mock_decrypt_password.call_count == 3
+    assert pool.get("2").device_info["password"] == "password2"
+    assert pool.get("4") is None
+
+
+# ✅ Test: Password Decrypted Again when Changed, Invalidated, or Older than password_ttl
+def test_router_pool_password_cache(mock_decrypt_password):
+    pool = RouterPool(password_ttl=3600)
+    pool.load(routers)
+
+    pool.load([{**routers[0], "router_password": "encrypted9"}, *routers[1:]])
+    assert mock_decrypt_password.call_count == 4
+    assert pool.get("1").device_info["password"] == "password9"
+
+    pool.invalidate("2")
+    pool.load(routers[1:])
+    assert mock_decrypt_password.call_count == 5
+    assert "1" not in pool.passwords
+
+    pool.passwords["3"] = (*pool.passwords["3"][:2], pool.passwords["3"][2] - 3600)
+    pool.load(routers[1:])
+    assert mock_decrypt_password.call_count == 6
+
+
+# ✅ Test: Open Routers Skipped, Breakers Kept on Reload
+def test_router_pool_available(mock_decrypt_password):
+    pool = RouterPool(failure_threshold=1)
+    pool.load(routers)
+
+    pool.sources[0].breaker.record_failure()
+    assert [source.router_id for source in pool.available()] == ["2", "3"]
+
+    pool.load(routers[:2])
+    assert [source.router_id for source in pool.available()] == ["2"]
+
+
+# ✅ Test: Scans Spread over the Routers in Turn
+def test_router_pool_spread(mock_decrypt_password):
+    pool = RouterPool()
+    pool.load(routers)
+
+    firsts = [pool.spread()[0].router_id for _ in range(4)]
+
+    assert firsts == ["1", "2", "3", "1"]
+    assert sorted(source.router_id for source in pool.spread()) == ["1", "2", "3"]
+
+
+# ✅ Test: Router with an Undecryptable Password Left Out, the Others Loaded
+def test_router_pool_bad_password():
+    with patch("utils.get_secret_key", return_value=b"0123456789abcdef"):
+        good = {**routers[0], "router_password": encrypt_password("password1")}
+        corrupted = encrypt_password("password2")
+        bad = {**routers[1], "router_password": corrupted[:-4] + ("AAAA" if corrupted[-4:] != "AAAA" else "BBBB")}
+
+        pool = RouterPool()
+        pool.load([good, bad])
+
+    assert [source.router_id for source in pool.sources] == ["1"]
+    assert pool.get("1").device_info["password"] == "password1"
+    assert "2" in pool.errors and "1" not in pool.errors
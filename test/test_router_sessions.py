@@ -0,0 +1,64 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from router_sessions import RouterSessionManager
+
+
+device_info = {"hostname": "192.168.2.1", "username": "test_username", "password": "test_password"}
+
+
+@pytest.fixture
+def mock_open_router_device():
+    with patch("router_sessions.open_router_device") as mock:
+        mock.side_effect = lambda router_vendor, **device_info: MagicMock()
+        yield mock
+
+
+# ✅ Test: Repeated Calls Reuse One Session
+def test_session_reused(mock_open_router_device):
+    sessions = RouterSessionManager()
+
+    first = sessions.run("router1", "Juniper", device_info, lambda device: device)
+    second = sessions.run("router1", "Juniper", device_info, lambda device: device)
+
+    assert first is second
+    assert mock_open_router_device.call_count == 1
+
+
+# ✅ Test: Reconnect When the Session Fails
+def test_session_reconnect_on_failure(mock_open_router_device):
+    sessions = RouterSessionManager()
+    broken = sessions.run("router1", "Juniper", device_info, lambda device: device)
+
+    def command(device):
+        if device is broken:
+            raise ConnectionError("Session dropped")
+        return device
+
+    healthy = sessions.run("router1", "Juniper", device_info, command)
+
+    assert healthy is not broken
+    broken.close.assert_called_once()
+    assert sessions.run("router1", "Juniper", device_info, lambda device: device) is healthy
+
+
+# ✅ Test: New Credentials Open a New Session
+def test_session_credentials_changed(mock_open_router_device):
+    sessions = RouterSessionManager()
+    old = sessions.run("router1", "Juniper", device_info, lambda device: device)
+    new = sessions.run("router1", "Juniper", {**device_info, "password": "newpassword"}, lambda device: device)
+
+    assert old is not new
+    old.close.assert_called_once()
+
+
+# ✅ Test: Idle Sessions are Evicted, and All Sessions Closed on Shutdown
+def test_session_idle_eviction(mock_open_router_device):
+    sessions = RouterSessionManager(idle_timeout=0)
+    idle = sessions.run("router1", "Juniper", device_info, lambda device: device)
+    sessions.evict_idle()
+    idle.close.assert_called_once()
+
+    sessions = RouterSessionManager()
+    device = sessions.run("router2", "Cisco", device_info, lambda device: device)
+    sessions.close_all()
+    device.close.assert_called_once()
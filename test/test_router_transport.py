@@ -0,0 +1,176 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+
+asyncssh = pytest.importorskip("asyncssh")
+from router_transport import AsyncSSHTransport, RouterCommandError, async_route_scan, async_route_table_snapshot, async_router_connection_test, parse_router_transports
+
+# Local SSH stand-in of a router, replaying canned command outputs
+CANNED_OUTPUTS = {
+    "show ip route 10.1.0.0 255.255.0.0 longer-prefixes": (
+        "Codes: L - local, C - connected, S - static\n\n"
+        "     10.0.0.0/8 is variably subnetted, 2 subnets, 2 masks\n"
+        "O        10.1.0.0/17 [110/20] via 10.255.0.1, 3d04h, GigabitEthernet0/0\n"
+        "S        10.1.128.0/18 [1/0] via 10.255.0.2\n"),
+    "show ip route 10.2.0.0 255.255.0.0 longer-prefixes": "",
+    "display ip routing-table": "Destination/Mask    Proto   Pre  Cost  Flags NextHop  Interface\n10.1.0.0/16  Static  60  0  RD  10.255.0.1  GE0/0/1\n",
+    "display ipv6 routing-table": "Destination  : 2001:db8::  PrefixLength : 32\n",
+}
+
+
+class StandInRouter(asyncssh.SSHServer):
+    connections = 0
+    sends_exit_status = True
+
+    def connection_made(self, connection):
+        StandInRouter.connections += 1
+
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return (username, password) == ("admin", "secret")
+
+
+async def run_command(process):
+    if process.command == "slow":
+        await asyncio.sleep(30)
+    if process.command == "fail":
+        process.exit(1)
+        return
+    if process.command == "hangup":
+        # Channel closed without an exit status
+        process.close()
+        return
+    process.stdout.write(CANNED_OUTPUTS.get(process.command, f"% Invalid input detected: {process.command}\n"))
+    if StandInRouter.sends_exit_status:
+        process.exit(0)
+    else:
+        process.close()
+
+
+async def with_router(test):
+    # Start the stand-in router on a free local port, and run test(device_info)
+    StandInRouter.connections = 0
+    StandInRouter.sends_exit_status = True
+    server = await asyncssh.create_server(StandInRouter, "127.0.0.1", 0, server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+                                          process_factory=run_command)
+    device_info = {"hostname": "127.0.0.1", "port": server.sockets[0].getsockname()[1], "username": "admin", "password": "secret"}
+    try:
+        return await test(device_info)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+# ✅ Test: Route Scan over SSH, One Connection Reused by the Scans
+def test_async_route_scan():
+    async def test(device_info):
+        transport = AsyncSSHTransport()
+        active = await async_route_scan("10.1.0.0/16", "Cisco", transport=transport, router_id="r1", **device_info)
+        inactive = await async_route_scan("10.2.0.0/16", "Cisco", transport=transport, router_id="r1", **device_info)
+        transport.close_all()
+        return active, inactive
+
+    active, inactive = asyncio.run(with_router(test))
+
+    assert active == {"status": True, "online_status": "Active", "online_utilization": 75.0}
+    assert inactive == {"status": True, "online_status": "Inactive", "online_utilization": 0.00}
+    assert StandInRouter.connections == 1
+
+
+# ✅ Test: Wrong Credentials, Connection Test and Scan Fail
+def test_async_wrong_password():
+    async def test(device_info):
+        transport = AsyncSSHTransport()
+        wrong = {**device_info, "password": "wrong"}
+        return (await async_router_connection_test("Cisco", transport=transport, router_id="r1", **device_info),
+                await async_router_connection_test("Cisco", transport=transport, router_id="r2", **wrong),
+                await async_route_scan("10.1.0.0/16", "Cisco", transport=transport, router_id="r2", **wrong))
+
+    alive, wrong_alive, wrong_scan = asyncio.run(with_router(test))
+
+    assert alive is True
+    assert wrong_alive is False
+    assert wrong_scan["status"] is False
+
+
+# ✅ Test: Command Timeout and Cancellation Close their Channel Only, the Other Commands Complete
+def test_async_timeout_and_cancel():
+    command = "show ip route 10.1.0.0 255.255.0.0 longer-prefixes"
+
+    async def test(device_info):
+        transport = AsyncSSHTransport(command_timeout=0.2)
+        with pytest.raises(asyncio.TimeoutError):
+            await transport.cli("r1", device_info, ["slow"])
+        assert "r1" in transport.connections
+
+        transport.command_timeout = 30
+        slow = asyncio.create_task(transport.cli("r1", device_info, ["slow"]))
+        await asyncio.sleep(0.2)
+        concurrent = asyncio.create_task(transport.cli("r1", device_info, [command]))
+        slow.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await slow
+        output = await concurrent
+        assert output == {command: CANNED_OUTPUTS[command]}
+        assert (await transport.cli("r1", device_info, [command])) == output
+        transport.close_all()
+
+    asyncio.run(asyncio.wait_for(with_router(test), 10))
+    assert StandInRouter.connections == 1
+
+
+# ✅ Test: Failed or Interrupted Commands Fail the Call instead of Returning an Empty Output
+def test_async_failed_command():
+    async def test(device_info):
+        transport = AsyncSSHTransport()
+        with pytest.raises(RouterCommandError):
+            await transport.cli("r1", device_info, ["fail"])
+        with pytest.raises(RouterCommandError):
+            await transport.cli("r1", device_info, ["hangup"])
+        with patch("router_transport.get_route_command", return_value="hangup"):
+            scan = await async_route_scan("10.1.0.0/16", "Cisco", transport=transport, router_id="r1", **device_info)
+        transport.close_all()
+        return scan
+
+    assert asyncio.run(asyncio.wait_for(with_router(test), 10))["status"] is False
+
+
+# ✅ Test: Route Scan on a Device Closing the Channel without an Exit Status
+def test_async_route_scan_without_exit_status():
+    async def test(device_info):
+        StandInRouter.sends_exit_status = False
+        transport = AsyncSSHTransport()
+        scan = await async_route_scan("10.1.0.0/16", "Cisco", transport=transport, router_id="r1", **device_info)
+        with pytest.raises(RouterCommandError):
+            await transport.cli("r1", device_info, ["hangup"])
+        transport.close_all()
+        return scan
+
+    assert asyncio.run(asyncio.wait_for(with_router(test), 10)) == {"status": True, "online_status": "Active", "online_utilization": 75.0}
+
+
+# ✅ Test: Routing Table Snapshot over SSH
+def test_async_route_table_snapshot():
+    async def test(device_info):
+        transport = AsyncSSHTransport()
+        snapshot = await async_route_table_snapshot("Huawei", transport=transport, router_id="r1", **device_info)
+        transport.close_all()
+        return snapshot
+
+    snapshot = asyncio.run(with_router(test))
+
+    assert len(snapshot) == 2
+    assert snapshot.lookup("10.1.0.0/16")["online_status"] == "Active"
+
+
+# ✅ Test: Transport Chosen per Vendor
+def test_parse_router_transports():
+    assert parse_router_transports("") == {}
+    assert parse_router_transports("Cisco=asyncssh, Huawei=napalm") == {"Cisco": "asyncssh", "Huawei": "napalm"}
+    with pytest.raises(ValueError):
+        parse_router_transports("Cisco=telnet")
@@ -0,0 +1,88 @@
+import asyncio
+from scan_scheduler import ScanJob, ScanScheduler
+
+
+# ✅ Test: Job Progress and ETA
+def test_scan_job_progress():
+    job = ScanJob()
+    assert job.to_dict()["status"] == "queued"
+    assert job.eta() is None
+
+    job.start(4)
+    job.advance(1)
+    job.advance(1, failed=1)
+
+    progress = job.to_dict()
+    assert (progress["status"], progress["done"], progress["failed"], progress["progress"]) == ("running", 2, 1, 50.0)
+    assert progress["eta_seconds"] >= 0
+
+    job.finish()
+    assert job.to_dict()["status"] == "completed"
+    assert job.eta() is None
+
+
+# ✅ Test: Submitted Jobs Run in the Background, in Order
+def test_scheduler_runs_jobs():
+    ran = []
+
+    async def run_job(job):
+        job.start(1)
+        if job.scope == "major":
+            raise RuntimeError("Router failure")
+        ran.append(job.scope)
+        job.advance(1)
+
+    async def main():
+        scheduler = ScanScheduler(run_job)
+        scheduler.start()
+        first = scheduler.submit("all")
+        second = scheduler.submit("major")
+        assert first.status == "queued"
+
+        while second.status in ("queued", "running"):
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+        return first, second
+
+    first, second = asyncio.run(main())
+
+    assert ran == ["all"]
+    assert first.status == "completed"
+    assert (second.status, second.error) == ("failed", "Router failure")
+
+
+# ✅ Test: Periodic Rescans Not Stacked
+def test_scheduler_periodic_rescan():
+    async def main():
+        finished = asyncio.Event()
+
+        async def run_job(job):
+            await finished.wait()
+
+        scheduler = ScanScheduler(run_job, interval=0.01, scope="major")
+        scheduler.start()
+        await asyncio.sleep(0.1)
+        pending = [job for job in scheduler.list() if job.trigger == "schedule"]
+        finished.set()
+        await scheduler.stop()
+        return pending
+
+    pending = asyncio.run(main())
+
+    # The first scheduled job never finished, no other one was queued
+    assert len(pending) == 1
+    assert pending[0].scope == "major"
+
+
+# ✅ Test: Finished Jobs Dropped Past the Limit
+def test_scheduler_max_jobs():
+    async def main():
+        scheduler = ScanScheduler(None, max_jobs=2)
+        jobs = [scheduler.submit() for _ in range(3)]
+        jobs[0].finish()
+        scheduler.submit()
+        return scheduler, jobs
+
+    scheduler, jobs = asyncio.run(main())
+    assert scheduler.get(jobs[0].job_id) is None
+    assert scheduler.get(jobs[1].job_id) is jobs[1]
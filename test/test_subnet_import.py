@@ -0,0 +1,56 @@
+import io
+from subnet_import import load_import_rows
+
+
+# ✅ Test: CSV Rows Parsed and Sorted, Upper Subnets First
+def test_load_csv_rows():
+    text_file = io.StringIO(
+        "subnet_prefix,subnet_name,subnet_service,subnet_description\n"
+        "10.1.0.0/16,core,backbone,\"Core, site A\"\n"
+        "10.0.0.0/8,major,,\n"
+        "10.1.0.1/16,wrong,,\n"
+        "10.1.0.0/24,lan,access,\n"
+    )
+
+    rows, errors, error_count = load_import_rows(text_file, "csv")
+
+    assert list(rows) == [
+        (4, 167772160, 8, "major", "", ""),
+        (4, 167837696, 16, "core", "backbone", "Core, site A"),
+        (4, 167837696, 24, "lan", "access", ""),
+    ]
+    assert error_count == 1
+    assert errors[0]["line"] == 4
+
+
+# ✅ Test: NDJSON Rows, Wrong Lines Reported
+def test_load_ndjson_rows():
+    text_file = io.StringIO(
+        '{"subnet_prefix": "192.168.1.0/24", "subnet_name": "lan"}\n'
+        "\n"
+        "not json\n"
+        '["192.168.0.0/16"]\n'
+        '{"subnet_prefix": "192.168.0.0/16"}\n'
+    )
+
+    rows, errors, error_count = load_import_rows(text_file, "ndjson", max_errors=1)
+
+    assert [row[:3] for row in rows] == [(4, 3232235520, 16), (4, 3232235776, 24)]
+    assert error_count == 2
+    assert errors == [{"line": 3, "error": "Invalid row"}]
+
+
+# ✅ Test: Rows Sorted in Chunks Spilled to Temporary Files, then Merged
+def test_load_rows_spilled_chunks():
+    prefixes = ["10.3.0.0/16", "2001:db8::/32", "10.0.0.0/8", "10.1.0.0/16", "10.2.0.0/16", "10.1.1.0/24", "192.168.0.0/16"]
+    text_file = io.StringIO("subnet_prefix,subnet_name\n" + "".join(f"{prefix},name \"{index}\"\n" for index, prefix in enumerate(prefixes)))
+
+    rows, errors, error_count = load_import_rows(text_file, "csv", chunk_size=2)
+
+    assert len(rows) == 7
+    assert len(rows.files) == 3
+    assert [row[:3] for row in rows] == [(4, 167772160, 8), (4, 167837696, 16), (4, 167837952, 24), (4, 167903232, 16),
+                                         (4, 167968768, 16), (4, 3232235520, 16), (6, 0x20010db8 << 96, 32)]
+    assert list(rows)[0][3] == 'name "2"'
+    rows.close()
+    assert rows.files == []
@@ -0,0 +1,112 @@
+from subnet_trie import SubnetTrie
+
+
+def build_trie(prefixes):
+    trie = SubnetTrie()
+    for prefix in prefixes:
+        trie.insert(prefix, "10.0.0.0/8")
+    return trie
+
+
+# ✅ Test: Insert, Lookup and Remove
+def test_insert_and_remove():
+    trie = build_trie(["10.0.0.0/8", "10.1.0.0/16"])
+
+    assert len(trie) == 2
+    assert "10.1.0.0/16" in trie
+    assert "10.1.0.0/17" not in trie
+    assert trie.get("10.1.0.0/16") == "10.0.0.0/8"
+
+    assert trie.remove("10.1.0.0/16")
+    assert not trie.remove("10.1.0.0/16")
+    assert "10.1.0.0/16" not in trie
+    assert len(trie) == 1
+
+
+# ✅ Test: Longest Prefix Match
+def test_longest_match():
+    trie = build_trie(["10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24"])
+
+    assert trie.longest_match("10.1.1.5/32") == "10.1.1.0/24"
+    assert trie.longest_match("10.1.1.0/24") == "10.1.1.0/24"
+    assert trie.longest_match("10.1.1.0/24", strict=True) == "10.1.0.0/16"
+    assert trie.longest_match("10.2.0.0/16", strict=True) == "10.0.0.0/8"
+    assert trie.longest_match("192.168.0.0/16") is None
+
+
+# ✅ Test: Nearest Children
+def test_children():
+    trie = build_trie(["10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24", "10.0.0.0/24", "10.200.0.0/16"])
+
+    assert trie.children("10.0.0.0/8") == ["10.0.0.0/24", "10.1.0.0/16", "10.200.0.0/16"]
+    assert trie.children("10.1.0.0/16") == ["10.1.1.0/24"]
+    # Not stored prefix: children are the subnets that would move under it
+    assert trie.children("10.0.0.0/15") == ["10.0.0.0/24", "10.1.0.0/16"]
+    assert trie.children("172.16.0.0/12") == []
+
+
+# ✅ Test: Free Prefix Check
+def test_is_free():
+    trie = build_trie(["10.0.0.0/8", "10.1.1.0/24"])
+
+    assert trie.is_free("10.2.0.0/16")
+    assert not trie.is_free("10.1.0.0/16")
+    assert not trie.is_free("10.1.1.0/24")
+
+    trie.remove("10.1.1.0/24")
+    assert trie.is_free("10.1.0.0/16")
+
+
+# ✅ Test: All Matches and Free Blocks
+def test_matches_and_free_blocks():
+    trie = build_trie(["10.0.0.0/8", "10.0.0.0/24", "10.0.1.0/25", "10.0.2.0/23"])
+
+    assert trie.matches("10.0.1.5/32") == ["10.0.0.0/8", "10.0.1.0/25"]
+    assert trie.matches("192.168.0.0/16") == []
+
+    free_blocks = trie.free_blocks("10.0.0.0/8", 25)
+    assert [next(free_blocks) for _ in range(3)] == ["10.0.1.128/25", "10.0.4.0/25", "10.0.4.128/25"]
+    assert list(trie.free_blocks("10.0.0.0/24", 25)) == ["10.0.0.0/25", "10.0.0.128/25"]
+    assert list(trie.free_blocks("10.0.0.0/8", 8)) == []
+
+
+# ✅ Test: Covered Addresses and Utilization
+def test_covered_and_utilization():
+    trie = build_trie(["10.0.0.0/16", "10.0.1.0/24", "10.0.1.0/26"])
+
+    assert trie.covered("10.0.0.0/16") == 256
+    assert trie.utilization("10.0.0.0/16") == 0.39
+    assert trie.covered("10.0.1.0/24") == 64
+
+    # A subnet inserted between a parent and its children takes the children over
+    trie.insert("10.0.0.0/23")
+    assert trie.covered("10.0.0.0/16") == 512
+    assert trie.covered("10.0.0.0/23") == 256
+    assert trie.utilization("10.0.0.0/23") == 50.0
+
+    # Removing it gives the children back to the parent
+    trie.remove("10.0.0.0/23")
+    assert trie.covered("10.0.0.0/16") == 256
+    assert trie.covered("172.16.0.0/12") == 0
+
+
+# ✅ Test: IPv6 Subnets, separate from the IPv4 ones
+def test_ipv6():
+    trie = build_trie(["10.0.0.0/8", "::/0", "2001:db8::/32", "2001:db8:1::/48", "2001:DB8:0:0:1::/80"])
+
+    assert "2001:db8:0:0:1::/80" in trie
+    assert trie.longest_match("2001:db8:1:2::/64") == "2001:db8:1::/48"
+    assert trie.matches("10.1.0.0/16") == ["10.0.0.0/8"]
+    assert trie.children("2001:db8::/32") == ["2001:db8:0:0:1::/80", "2001:db8:1::/48"]
+
+    assert trie.covered("2001:db8::/32") == (1 << 80) + (1 << 48)
+    assert trie.utilization("2001:db8::/32") == 0.0
+    assert trie.utilization("::/0") == 0.0
+    assert trie.covered("::/0") == 1 << 96
+
+    assert trie.find_free_block("2001:db8::/32", 48) == "2001:db8:2::/48"
+    assert trie.find_free_block("2001:db8::/32", 48, best_fit=True) == "2001:db8:2::/48"
+    assert list(zip(range(2), trie.free_blocks("2001:db8::/32", 64))) == [(0, "2001:db8:0:1::/64"), (1, "2001:db8:0:2::/64")]
+
+    trie.remove("2001:db8::/32")
+    assert trie.children("::/0") == ["2001:db8:0:0:1::/80", "2001:db8:1::/48"]
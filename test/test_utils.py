@@ -0,0 +1,126 @@
+import base64
+import pytest
+from Cryptodome.Cipher import AES
+from utils import check_secret_key, decrypt_password, encrypt_password, get_secret_key, get_break_preview, get_break_subnet, get_subnet_utilization, parse_routes, prefix_to_interval, validate_prefix_length
+from prefix import Prefix
+
+
+# ✅ Test: Prefix to Interval
+def test_prefix_to_interval():
+    assert prefix_to_interval("10.0.0.0/8") == (167772160, 184549376, 8)
+    assert prefix_to_interval((167772160, 8)) == (167772160, 184549376, 8)
+
+
+# ✅ Test: Utilization without Children
+def test_subnet_utilization_empty():
+    assert get_subnet_utilization("192.168.1.0/24", []) == 0.0
+
+
+# ✅ Test: Nested Subnets are not Counted Twice
+def test_subnet_utilization_nested():
+    subnets = ["192.168.1.0/25", "192.168.1.0/26", "192.168.1.128/27", "192.168.1.0/24"]
+    assert get_subnet_utilization("192.168.1.0/24", subnets) == 62.5
+
+
+# ✅ Test: Strings and Parsed Integers give the same Utilization
+def test_subnet_utilization_parsed_integers():
+    subnets = ["10.0.0.0/10", "10.64.0.0/11", "10.64.0.0/12", "10.200.3.0/24"]
+    parsed = [prefix_to_interval(subnet)[0::2] for subnet in subnets]
+
+    assert get_subnet_utilization("10.0.0.0/8", subnets) == 37.5
+    assert get_subnet_utilization((167772160, 8), parsed) == 37.5
+
+
+# ✅ Test: IPv6 Utilization
+def test_subnet_utilization_ipv6():
+    assert get_subnet_utilization("2001:db8::/32", ["2001:db8::/33", "2001:db8:8000::/34"]) == 75.0
+    assert get_subnet_utilization("2001:db8::/32", ["2001:db8::/48"]) == 0.0
+
+
+# ✅ Test: IPv4 and IPv6 Routes Parsed from the Vendors Outputs
+def test_parse_routes():
+    cisco = """
+B   10.1.0.0/16 [200/0] via 192.168.0.1, 1d00h
+B   2001:DB8:1::/48 [200/0]
+     via FE80::1, GigabitEthernet0/0/0
+"""
+    junos = "2001:db8:2::/48    *[BGP/170] 1d 00:00:00, localpref 100\n10.2.0.0/16  *[Static/5]"
+    huawei = """
+ Destination  : 2001:DB8:3::                            PrefixLength : 48
+ NextHop      : FE80::1                                 Preference   : 255
+"""
+
+    assert parse_routes(cisco) == [Prefix.parse("10.1.0.0/16"), Prefix.parse("2001:db8:1::/48")]
+    assert [str(route) for route in parse_routes(junos, 6)] == ["2001:db8:2::/48"]
+    assert [str(route) for route in parse_routes(junos, 4)] == ["10.2.0.0/16"]
+    assert [str(route) for route in parse_routes(huawei)] == ["2001:db8:3::/48"]
+    assert parse_routes("S    10.1.1.5/24 [1/0]\n     10.01.0.0/24, 300.1.1.0/24, 10.2.0.0/33") == [Prefix.parse("10.1.1.0/24")]
+
+
+# ✅ Test: Prefix Length Range per IP Version
+def test_validate_prefix_length():
+    assert validate_prefix_length("32")
+    assert not validate_prefix_length("33")
+    assert validate_prefix_length("128", 128)
+    assert not validate_prefix_length("129", 128)
+
+
+# ✅ Test: Break Subnet Generator, with a window of the children
+def test_get_break_subnet():
+    children = get_break_subnet("10.0.0.0/8", 30)
+    assert next(children)["subnet_prefix"] == "10.0.0.0/30"
+    assert next(children)["subnet_prefix"] == "10.0.0.4/30"
+
+    window = list(get_break_subnet("10.1.0.0/16", 18, start=1, stop=3))
+    assert [child["subnet_prefix"] for child in window] == ["10.1.64.0/18", "10.1.128.0/18"]
+    assert window[0]["subnet_id"] == "10.1.64.0"
+    assert window[0]["subnet_mask"] == "18"
+
+
+# ✅ Test: Break Preview, small breaks are not listed twice
+def test_get_break_preview():
+    preview = get_break_preview("2001:db8::/32", 64, preview_size=1)
+    assert preview["count"] == 2 ** 32
+    assert preview["first"] == ["2001:db8::/64"]
+    assert preview["last"] == ["2001:db8:ffff:ffff::/64"]
+
+    preview = get_break_preview("10.1.0.0/16", 17, preview_size=5)
+    assert preview["first"] == ["10.1.0.0/17", "10.1.128.0/17"]
+    assert preview["last"] == []
+
+
+# ✅ Test: Passwords Encrypted with the EAX Tag, and Modified Passwords Refused
+def test_encrypt_decrypt_password():
+    encrypted = encrypt_password("secret")
+    assert encrypted.startswith("v2:")
+    assert decrypt_password(encrypted) == "secret"
+    assert encrypt_password("secret") != encrypted
+
+    data = bytearray(base64.b64decode(encrypted[3:]))
+    data[16] ^= 1
+    with pytest.raises(ValueError):
+        decrypt_password("v2:" + base64.b64encode(bytes(data)).decode())
+
+
+# ✅ Test: Passwords Encrypted Without the Tag Still Decrypted
+def test_decrypt_legacy_password():
+    cipher = AES.new(get_secret_key(), AES.MODE_EAX)
+    legacy = base64.b64encode(cipher.nonce + cipher.encrypt(b"secret")).decode()
+
+    assert decrypt_password(legacy) == "secret"
+
+
+# ✅ Test: Startup Check of the Secret Key
+def test_check_secret_key(monkeypatch):
+    check_secret_key()
+
+    monkeypatch.setenv("SECRET_KEY", "short")
+    with pytest.raises(ValueError):
+        check_secret_key()
+
+    monkeypatch.delenv("SECRET_KEY")
+    with pytest.raises(ValueError):
+        check_secret_key()
+
+    monkeypatch.undo()
+    check_secret_key()
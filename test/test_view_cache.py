@@ -0,0 +1,61 @@
+from unittest.mock import patch
+from view_cache import ViewCache
+
+
+# ✅ Test: Hits, Misses and ETag of the Cached Views
+def test_get_and_set():
+    cache = ViewCache()
+    assert cache.get("home") is None
+
+    entry = cache.set("home", "", b"<html>", "text/html", cache.version)
+    assert cache.get("home") is entry
+    assert entry.etag == cache.set("other", "", b"<html>", "text/html", cache.version).etag
+    assert entry.etag != cache.set("third", "", b"<html/>", "text/html", cache.version).etag
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+# ✅ Test: Least Recently Used View Dropped Past max_entries
+def test_size_bound():
+    cache = ViewCache(max_entries=2)
+    cache.set("a", "10.0.0.0/8", b"a", "text/html", cache.version)
+    cache.set("b", "10.1.0.0/16", b"b", "text/html", cache.version)
+    cache.get("a")
+    cache.set("c", "10.2.0.0/16", b"c", "text/html", cache.version)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert "10.1.0.0/16" not in cache.keys
+
+
+# ✅ Test: Views Expire After the TTL, TTL 0 Disables the Cache
+def test_ttl():
+    cache = ViewCache(ttl=30)
+    with patch("view_cache.time.monotonic", return_value=100):
+        cache.set("a", "", b"a", "text/html", cache.version)
+    with patch("view_cache.time.monotonic", return_value=129):
+        assert cache.get("a") is not None
+    with patch("view_cache.time.monotonic", return_value=130):
+        assert cache.get("a") is None
+    assert not cache.keys
+
+    cache = ViewCache(ttl=0)
+    cache.set("a", "", b"a", "text/html", cache.version)
+    assert cache.get("a") is None
+
+
+# ✅ Test: Invalidation Drops Only the Given Prefixes, and Views Rendered Meanwhile
+def test_invalidate():
+    cache = ViewCache()
+    cache.set("detail", "10.1.0.0/16", b"a", "text/html", cache.version)
+    cache.set("detail-api", "10.1.0.0/16", b"a", "application/json", cache.version)
+    cache.set("other", "10.2.0.0/16", b"b", "text/html", cache.version)
+
+    version = cache.version
+    cache.invalidate(["10.1.0.0/16", "10.0.0.0/8"])
+    assert cache.get("detail") is None and cache.get("detail-api") is None
+    assert cache.get("other") is not None
+
+    # Rendered before the invalidation: returned to its caller but not kept
+    entry = cache.set("detail", "10.1.0.0/16", b"stale", "text/html", version)
+    assert entry.body == b"stale"
+    assert cache.get("detail") is None
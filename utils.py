@@ -1,15 +1,18 @@
 import ipaddress
 import re
+from prefix import Prefix
+import route_vector
+from metrics import OPERATION_SECONDS, ROUTER_CALLS, ROUTER_SECONDS, timed
 from napalm import get_network_driver
 import os
 import Cryptodome
 from Cryptodome.Cipher import AES
 import base64
+import functools
 
-SECRET_KEY = os.getenv("SECRET_KEY")
 
-
-def route_scan(route_prefix,router_vendor, **device_info):
+def get_driver_name(router_vendor):
+    # Map the router vendor to its NAPALM driver name
     if router_vendor == "Juniper":
         router_vendor = "junos"
     elif router_vendor == "Cisco":
@@ -17,84 +20,210 @@ def route_scan(route_prefix,router_vendor, **device_info):
     elif router_vendor == "Huawei":
         router_vendor = "huawei_vrp"
 
-    try:
-        driver = get_network_driver(router_vendor)
-        device = driver(**device_info)
+    return router_vendor
+
+
+def open_router_device(router_vendor, **device_info):
+    driver = get_network_driver(get_driver_name(router_vendor))
+    device = driver(**device_info)
+    with timed(ROUTER_SECONDS, vendor=router_vendor, router=device_info['hostname'], stage="connect"):
         device.open()
+    return device
 
-        route_network = ipaddress.IPv4Network(route_prefix)
-        route_network_id = route_network.network_address
-        route_network_mask = route_network.netmask
-        route_network_prefixlen = route_network.prefixlen
 
-        if router_vendor == "junos":
-            route_output = device.get_route_to(route_prefix)
-            route_list = route_output.keys()
-            route_list_str = " ".join(route_list)
+def get_route_command(route_prefix, router_vendor):
+    # CLI command listing the routes under route_prefix
+    router_vendor = get_driver_name(router_vendor)
 
+    route_network = ipaddress.ip_network(route_prefix)
+    route_network_id = route_network.network_address
+    route_network_mask = route_network.netmask
+    route_network_prefixlen = route_network.prefixlen
 
-        elif router_vendor == "ios":
+    if router_vendor == "junos":
+        command = f"show route {route_network} terse"
+
+    elif router_vendor == "ios":
+        if route_network.version == 6:
+            command = f"show ipv6 route {route_network} longer-prefixes"
+        else:
             command = f"show ip route {route_network_id} {route_network_mask} longer-prefixes"
-            route_list_str = device.cli([command], )[command]
 
+    elif router_vendor == "huawei_vrp":
+        if route_network.version == 6:
+            command = f"display ipv6 routing-table {route_network_id} {route_network_prefixlen} longer-match"
+        else:
+            command = f"display ip routing-table {route_network_id} {route_network_prefixlen} longer-match"
 
-        elif router_vendor == "huawei_vrp":
-            command =f"display ip routing-table {route_network_id} {route_network_prefixlen} longer-match"
-            route_list_str = device.cli([command], )[command]
+    return command
 
 
-        if not route_list_str:
-            return {"status": True,"online_status": "Inactive", "online_utilization": 0.00}
+def get_route_output(device, route_prefix, router_vendor):
+    # Query the routes under route_prefix from an opened device, and return them as text.
+    if get_driver_name(router_vendor) == "junos":
+        route_output = device.get_route_to(route_prefix)
+        route_list = route_output.keys()
+        return " ".join(route_list)
 
-        else:
-            pattern = "(?:\d{1,3}\.){3}\d{1,3}/\d{1,2}"
-            route_dict_list = re.findall(pattern, route_list_str)
+    command = get_route_command(route_prefix, router_vendor)
+    return device.cli([command], )[command]
+
+
+def get_route_table_commands(router_vendor):
+    # CLI commands listing the full IPv4 and IPv6 routing tables
+    router_vendor = get_driver_name(router_vendor)
+
+    if router_vendor == "junos":
+        commands = ["show route table inet.0 terse", "show route table inet6.0 terse"]
+    elif router_vendor == "ios":
+        commands = ["show ip route", "show ipv6 route"]
+    elif router_vendor == "huawei_vrp":
+        commands = ["display ip routing-table", "display ipv6 routing-table"]
+
+    return commands
+
+
+def get_route_table_output(device, router_vendor):
+    # Query the full IPv4 and IPv6 routing tables from an opened device, and return them as text.
+    commands = get_route_table_commands(router_vendor)
+    output = device.cli(commands, )
+    return "\n".join(output[command] for command in commands)
+
+
+# "a.b.c.d/len" and "x:x::x/len" routes, and the "Destination : x:x:: PrefixLength : len" IPv6 routes of Huawei
+ROUTE_PATTERN = re.compile(r"(?<![\w:.])((?:\d{1,3}\.){3}\d{1,3}/\d{1,2}|[0-9A-Fa-f]{0,4}(?::[0-9A-Fa-f]{0,4}){2,7}/\d{1,3})(?![\w:.])")
+HUAWEI_IPV6_ROUTE_PATTERN = re.compile(r"Destination\s*:\s*([0-9A-Fa-f:]+)\s+PrefixLength\s*:\s*(\d{1,3})")
 
-            utilization = get_subnet_utilization(route_prefix, route_dict_list)
-            return {"status": True, "online_status": "Active", "online_utilization": utilization}
 
+def parse_routes(route_list_str, version=None):
+    # Extract the routes from a router output as Prefix objects, and of one IP version only when given
+    routes = ROUTE_PATTERN.findall(route_list_str)
+    routes += [f"{address}/{prefixlen}" for address, prefixlen in HUAWEI_IPV6_ROUTE_PATTERN.findall(route_list_str)]
+
+    parsed_routes = []
+    for route in routes:
+        try:
+            prefix = Prefix.parse(route)
+        except ValueError:
+            continue
+        if version is None or prefix.version == version:
+            parsed_routes.append(prefix)
+    return parsed_routes
+
+
+def run_on_router(router_vendor, function, sessions=None, router_id=None, **device_info):
+    # Run function(device) on the router. With a session manager the router session is reused between calls,
+    # otherwise a new connection is opened and closed afterwards.
+    def run(device):
+        with timed(ROUTER_SECONDS, vendor=router_vendor, router=device_info['hostname'], stage="command"):
+            return function(device)
+
+    if sessions is not None:
+        return sessions.run(router_id or device_info['hostname'], router_vendor, device_info, run)
+
+    device = open_router_device(router_vendor, **device_info)
+    try:
+        return run(device)
+    finally:
+        device.close()
+
+
+def get_route_scan_result(route_prefix, route_list_str):
+    # Online status and utilization of route_prefix from the routes under it
+    if not route_list_str:
+        return {"status": True,"online_status": "Inactive", "online_utilization": 0.00}
+
+    version = Prefix.parse(route_prefix).version
+    if version == 4 and route_vector.numpy is not None:
+        # Large IPv4 outputs are parsed and merged in bulk with NumPy when it is installed
+        utilization = route_vector.get_route_utilization(route_prefix, route_list_str)
+    else:
+        utilization = get_subnet_utilization(route_prefix, parse_routes(route_list_str, version))
+    return {"status": True, "online_status": "Active", "online_utilization": utilization}
+
+
+def route_scan(route_prefix,router_vendor, sessions=None, router_id=None, **device_info):
+    try:
+        route_list_str = run_on_router(router_vendor, lambda device: get_route_output(device, route_prefix, router_vendor), sessions, router_id, **device_info)
+        with timed(ROUTER_SECONDS, vendor=router_vendor, router=device_info['hostname'], stage="parse"):
+            scan_result = get_route_scan_result(route_prefix, route_list_str)
 
     except Exception as e:
         print(f"exception: {e}")
+        ROUTER_CALLS.inc(call="route_scan", vendor=router_vendor, router=device_info.get('hostname'), outcome="failure")
         return {"status": False, "online_status": "", "online_utilization": None}
 
-def router_connection_test(router_vendor, **device_info):
-    if router_vendor == "Juniper":
-        router_vendor = "junos"
-    elif router_vendor == "Cisco":
-        router_vendor = "ios"
-    elif router_vendor == "Huawei":
-        router_vendor = "huawei_vrp"
+    ROUTER_CALLS.inc(call="route_scan", vendor=router_vendor, router=device_info['hostname'], outcome="success")
+    return scan_result
 
+def router_connection_test(router_vendor, sessions=None, router_id=None, **device_info):
     try:
-        driver = get_network_driver(router_vendor)
-        device = driver(**device_info)
-        device.open()
-
-        return True
+        alive = run_on_router(router_vendor, is_router_alive, sessions, router_id, **device_info)
 
     except Exception as e:
         print(f"exception: {e}")
+        ROUTER_CALLS.inc(call="connection_test", vendor=router_vendor, router=device_info.get('hostname'), outcome="failure")
         return False
 
+    ROUTER_CALLS.inc(call="connection_test", vendor=router_vendor, router=device_info['hostname'], outcome="success")
+    return alive
+
+
+def is_router_alive(device):
+    if not device.is_alive().get("is_alive", False):
+        raise ConnectionError("Router session is not alive")
+    return True
+
+
+def prefix_to_interval(prefix, max_prefixlen=32):
+    # Convert a prefix, given as "a.b.c.d/len" string, Prefix or as already parsed (network address integer, prefix length),
+    # into an integer [start, end) address interval. Returns (start, end, prefixlen).
+    if isinstance(prefix, (str, Prefix)):
+        prefix = Prefix.parse(prefix)
+        return prefix.address, prefix.address + prefix.size, prefix.prefixlen
+
+    address, prefixlen = prefix
+
+    if not 0 <= prefixlen <= max_prefixlen:
+        raise ValueError(f"Invalid prefix length: {prefixlen}")
+
+    size = 1 << (max_prefixlen - prefixlen)
+    start = address & ~(size - 1)
+    return start, start + size, prefixlen
+
 
-def get_subnet_utilization(main_subnet, subnet_dict):
-    main_subnet = ipaddress.ip_network(main_subnet)
-    main_subnet_total_ips = main_subnet.num_addresses
+def get_covered_addresses(intervals):
+    # Number of addresses covered by the union of [start, end) intervals. Sort once and merge in a single pass.
+    covered = 0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                covered += current_end - current_start
+            current_start, current_end = start, end
+        elif end > current_end:
+            current_end = end
 
-    subnet_list = [ipaddress.ip_network(subnet) for subnet in subnet_dict if ipaddress.ip_network(subnet).prefixlen > main_subnet.prefixlen]
+    if current_end is not None:
+        covered += current_end - current_start
+    return covered
 
-    # need to not count the sub-addresses under the subnets to not to count them twice.
-    utilized_ips = 0
-    for subnet in subnet_list:
-        pass_subnet = True
-        for item in subnet_list:
-            if subnet.subnet_of(item) and subnet!=item:
-                pass_subnet = False
-                break
 
-        if pass_subnet:
-            utilized_ips += subnet.num_addresses
+@timed(OPERATION_SECONDS, operation="get_subnet_utilization")
+def get_subnet_utilization(main_subnet, subnet_dict, max_prefixlen=32):
+    # Subnets can be strings "a.b.c.d/len", Prefix objects (not parsed again) or (network address integer, prefix length) tuples.
+    main_start, main_end, main_prefixlen = prefix_to_interval(main_subnet, max_prefixlen)
+    main_subnet_total_ips = main_end - main_start
+
+    # Only more specific subnets are counted. Merging the intervals makes sure that addresses under nested subnets
+    # are not counted twice.
+    intervals = []
+    for subnet in subnet_dict:
+        start, end, prefixlen = prefix_to_interval(subnet, max_prefixlen)
+        if prefixlen > main_prefixlen:
+            intervals.append((start, end))
+
+    utilized_ips = get_covered_addresses(intervals)
 
     utilization = round((utilized_ips / main_subnet_total_ips) * 100,2)
     return utilization
@@ -103,56 +232,87 @@ def get_subnet_utilization(main_subnet, subnet_dict):
 
 def validate_ip(ip):
     try:
-        ipaddress.IPv4Address(ip)
+        ipaddress.ip_address(ip)
         return True
-    except ipaddress.AddressValueError:
+    except ValueError:
         return False
 
-def validate_prefix_length(prefixlen):
-    if int(prefixlen) in range(0,33):
+def validate_prefix_length(prefixlen, max_prefixlen=32):
+    # max_prefixlen is 32 for IPv4 and 128 for IPv6
+    if int(prefixlen) in range(0,max_prefixlen + 1):
         return True
     else:
         return False
 
 
-def get_break_subnet(main_subnet_prefix, prefixlen):
-    main_subnet = ipaddress.IPv4Network(main_subnet_prefix)
-    subnets_list = list(main_subnet.subnets(new_prefix=prefixlen))
-    child_subnets_list = []
-    for subnet in subnets_list:
+def get_break_subnet(main_subnet_prefix, prefixlen, start=0, stop=None):
+    # Generate the child subnets one by one, nothing is built before it is consumed.
+    # start and stop select a window of the children, by index.
+    main_subnet = Prefix.parse(main_subnet_prefix, strict=True)
+    for subnet in main_subnet.subnets(prefixlen, start, stop):
         data = {}
-        data["subnet_prefix"] = str(subnet)
-        data["subnet_id"] = str(subnet.network_address)
-        data["subnet_mask"] = str(subnet.prefixlen)
+        data["subnet_id"] = subnet.network_address
+        data["subnet_prefix"] = f"{data['subnet_id']}/{prefixlen}"
+        data["subnet_mask"] = str(prefixlen)
         data["subnet_name"] = ""
         data["subnet_service"] = ""
         data["subnet_description"] = ""
-        child_subnets_list.append(data)
+        yield data
 
-    return child_subnets_list
 
+def get_break_preview(main_subnet_prefix, prefixlen, preview_size=5):
+    # Number of child subnets of a break, with the first and last preview_size of them, without generating the others
+    main_subnet = Prefix.parse(main_subnet_prefix, strict=True)
+    count = main_subnet.count_subnets(prefixlen)
+    first = [str(subnet) for subnet in main_subnet.subnets(prefixlen, 0, preview_size)]
+    last = [str(subnet) for subnet in main_subnet.subnets(prefixlen, max(preview_size, count - preview_size))]
+    return {"subnet_prefix": str(main_subnet), "break_prefixlen": prefixlen, "count": count, "first": first, "last": last}
 
 
-def encrypt_password(password):
-    # SECRET_KEY must be stored in OS as Environment variable. And must be 16 character long.
-    # You may set it here as a string for testing for example: SECRET_KEY = "012345678901234".encode()
-    SECRET_KEY = os.getenv("SECRET_KEY").encode()
+# Encrypted passwords are "v2:" followed by base64(nonce + ciphertext + EAX tag), the tag is verified on decryption.
+# Passwords encrypted by the previous versions are base64(nonce + ciphertext) without the tag: they are still decrypted,
+# without verification, until "python db_schema.py" encrypts them again.
+ENCRYPTED_PASSWORD_PREFIX = "v2:"
 
-    if SECRET_KEY is None:
+
+@functools.lru_cache(maxsize=1)
+def get_secret_key():
+    # SECRET_KEY must be stored in OS as Environment variable. And must be 16 character long (24 or 32 also accepted by AES).
+    # You may set it here as a string for testing for example: SECRET_KEY = "012345678901234".encode()
+    secret_key = os.getenv("SECRET_KEY")
+    if not secret_key or len(secret_key.encode()) not in (16, 24, 32):
         raise ValueError("SECRET_KEY is not set!. Please set it as an Environment Variable on your system with 16 Character.")
-    cipher = AES.new(SECRET_KEY, AES.MODE_EAX)
+    return secret_key.encode()
+
+
+def check_secret_key():
+    # Startup check: the key is set and usable, so a wrong key fails the startup instead of the first scan
+    get_secret_key.cache_clear()
+    if decrypt_password(encrypt_password("check")) != "check":
+        raise ValueError("SECRET_KEY can't decrypt the passwords it encrypts!")
+
+
+def encrypt_password(password):
+    cipher = AES.new(get_secret_key(), AES.MODE_EAX)
     nonce = cipher.nonce  # Needed for decryption
     ciphertext, tag = cipher.encrypt_and_digest(password.encode('utf-8'))
-    return base64.b64encode(nonce + ciphertext).decode('utf-8')
+    return ENCRYPTED_PASSWORD_PREFIX + base64.b64encode(nonce + ciphertext + tag).decode('utf-8')
+
 
 def decrypt_password(encrypted_password):
+    # Raise ValueError when the password was not encrypted with SECRET_KEY, or was modified
+    if encrypted_password.startswith(ENCRYPTED_PASSWORD_PREFIX):
+        encrypted_password = base64.b64decode(encrypted_password[len(ENCRYPTED_PASSWORD_PREFIX):])
+        nonce = encrypted_password[:16]  # Extract nonce
+        ciphertext = encrypted_password[16:-16]  # Extract ciphertext
+        tag = encrypted_password[-16:]  # Extract tag
+
+        cipher = AES.new(get_secret_key(), AES.MODE_EAX, nonce=nonce)
+        return cipher.decrypt_and_verify(ciphertext, tag).decode('utf-8')
+
     encrypted_password = base64.b64decode(encrypted_password)
     nonce = encrypted_password[:16]  # Extract nonce
     ciphertext = encrypted_password[16:]  # Extract ciphertext
 
-    # Retrieving the SECRET_KEY from OS environment variables
-    SECRET_KEY = os.getenv("SECRET_KEY").encode()
-
-    cipher = AES.new(SECRET_KEY, AES.MODE_EAX, nonce=nonce)
-    decrypted_password = cipher.decrypt(ciphertext).decode('utf-8')
-    return decrypted_password
+    cipher = AES.new(get_secret_key(), AES.MODE_EAX, nonce=nonce)
+    return cipher.decrypt(ciphertext).decode('utf-8')
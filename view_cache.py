@@ -0,0 +1,82 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+# In-process cache of the rendered subnet views (home page, subnet detail page and their JSON APIs).
+# Entries are kept up to ttl seconds, and the least recently used ones are dropped past max_entries.
+# Every entry is stored under the prefix of the subnet it shows ("" for the major subnets list), so a write
+# invalidates only the views of the subnets it changed. Each process has its own cache, the TTL bounds how
+# long a write made by another process can go unnoticed.
+
+
+class CachedView:
+    __slots__ = ("prefix", "body", "media_type", "etag", "expires")
+
+    def __init__(self, prefix, body, media_type, expires):
+        self.prefix = prefix
+        self.body = body
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.expires = expires
+
+
+class ViewCache:
+    def __init__(self, ttl=30, max_entries=1024):
+        self.ttl = ttl                  # Seconds an entry is used, 0 disables the cache
+        self.max_entries = max_entries
+        self.entries = OrderedDict()    # key -> CachedView, least recently used first
+        self.keys = {}                  # prefix -> keys of its entries
+        self.version = 0                # Incremented by every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires <= time.monotonic():
+            self.discard(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key, prefix, body, media_type, version):
+        # version is the cache version read before the view was rendered: a view rendered while a write
+        # invalidated the cache may be stale, it is returned but not stored
+        entry = CachedView(prefix, body, media_type, time.monotonic() + self.ttl)
+        if self.ttl <= 0 or version != self.version:
+            return entry
+
+        self.discard(key)
+        self.entries[key] = entry
+        self.keys.setdefault(prefix, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self.discard(next(iter(self.entries)))
+        return entry
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.keys.get(entry.prefix)
+            keys.discard(key)
+            if not keys:
+                del self.keys[entry.prefix]
+
+    def invalidate(self, prefixes):
+        # Drop the views of the given prefixes. The caller passes the changed subnets with their ancestors.
+        self.version += 1
+        for prefix in prefixes:
+            for key in list(self.keys.get(prefix, ())):
+                self.discard(key)
+
+    def clear(self):
+        self.version += 1
+        self.entries.clear()
+        self.keys.clear()
+
+    def stats(self):
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}